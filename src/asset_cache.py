@@ -0,0 +1,332 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from os import getenv
+from typing import Optional
+from urllib.parse import urlparse
+from weakref import WeakSet
+
+from playwright.sync_api import BrowserContext, Route, Request, Error
+from playwright.async_api import BrowserContext as AsyncBrowserContext, Route as AsyncRoute
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# cache: serve static assets from disk, record: save every response of the session,
+# replay: answer from a recording only (offline), off: no routing
+ASSET_CACHE_MODE = getenv('ASSET_CACHE_MODE', 'cache')
+ASSET_CACHE_DIR = getenv('ASSET_CACHE_DIR', '.asset-cache')
+# Disk space of the cache, the least recently used assets are evicted past it; 0 disables the cache
+ASSET_CACHE_MAX_MB = float(getenv('ASSET_CACHE_MAX_MB', '500'))
+ASSET_RECORDING_DIR = getenv('ASSET_RECORDING_DIR', 'asset-recording')
+# Playwright globs of the static hosts (or path prefixes) routed through the cache in cache mode,
+# every other request goes straight to the network without a trip through the route handler
+ASSET_CACHE_URLS = tuple(pattern.strip() for pattern in getenv(
+    'ASSET_CACHE_URLS',
+    'https://*.ibytedtos.com/**,https://*.ibyteimg.com/**,https://*.tiktokcdn.com/**,https://*.tiktokcdn-us.com/**'
+).split(',') if pattern.strip())
+
+ASSET_RESOURCE_TYPES = ('script', 'stylesheet', 'font', 'image')
+# A response allowed in the shared cache for at least this long is treated as static
+MIN_MAX_AGE = 24 * 3600  # seconds
+# Build tools put a content hash in the file names of versioned bundles (app.3f9a1c2e.js, app-3f9a1c2e8b.css)
+HASHED_NAME = re.compile(r'[.\-_/][0-9a-f]{8,}[.\-_/]|[.\-_][0-9a-f]{8,}$', re.IGNORECASE)
+# Describe the encoded body, the cache keeps and serves the decoded one
+DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'set-cookie')
+
+
+def max_age(cache_control: str) -> Optional[int]:
+    match = re.search(r'(?:s-maxage|max-age)=(\d+)', cache_control)
+    return int(match.group(1)) if match else None
+
+
+def is_static(url: str, headers: dict) -> bool:
+    """Whether a response can be served again to any context, and for how long isn't checked here"""
+    cache_control = headers.get('cache-control', '').lower()
+    if 'no-store' in cache_control or 'private' in cache_control:
+        return False
+    if 'immutable' in cache_control or (max_age(cache_control) or 0) >= MIN_MAX_AGE:
+        return True
+    return bool(HASHED_NAME.search(urlparse(url).path))
+
+
+class AssetCache:
+    """
+    Request routing that answers from a local disk store, shared by every process and browser launch
+
+    In cache mode only the requests to the static hosts of url_patterns are
+    routed, and only their static assets (scripts, stylesheets, fonts and
+    images whose response is immutable, long lived or has a hashed name) are
+    stored and served, under a size cap with LRU eviction. In record mode every
+    response of the session is stored, to be served by replay mode without
+    any network.
+
+    Its route is registered before the network policy's, so the policy decides
+    first and hands the requests it lets through to the cache (route.fallback).
+    """
+
+    def __init__(self, directory: str = ASSET_CACHE_DIR, max_bytes: int = int(ASSET_CACHE_MAX_MB * 1024 * 1024),
+                 mode: str = 'cache', url_patterns: tuple = ASSET_CACHE_URLS):
+        """
+        Open (and create if needed) the store
+
+        Args:
+            directory: Directory of the stored bodies and of their SQLite index
+            max_bytes: Total size of the stored bodies, 0 for no limit
+            mode: cache, record or replay
+            url_patterns: Playwright globs of the requests routed in cache mode, record and replay route all
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.url_patterns = url_patterns if mode == 'cache' else ('**/*',)
+        self.counts = Counter()  # hits, misses, stored, evicted, corrupt, replay_misses
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self._contexts = WeakSet()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self.connection = sqlite3.connect(
+            os.path.join(directory, 'index.db'), timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS assets (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                expires_at REAL,
+                used_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute('CREATE INDEX IF NOT EXISTS assets_used_at ON assets (used_at)')
+        self.connection.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional['AssetCache']:
+        """Cache selected by ASSET_CACHE_MODE, None when it is off"""
+        if ASSET_CACHE_MODE in ('record', 'replay'):
+            return cls(ASSET_RECORDING_DIR, 0, ASSET_CACHE_MODE)
+        if ASSET_CACHE_MODE == 'off' or ASSET_CACHE_MAX_MB <= 0:
+            return None
+        return cls()
+
+    def key(self, request: Request) -> Optional[str]:
+        """Store key of a request, None if the mode doesn't store its kind of request"""
+        if self.mode == 'cache':
+            if request.method != 'GET' or request.resource_type not in ASSET_RESOURCE_TYPES:
+                return None
+            return hashlib.sha256(request.url.encode()).hexdigest()
+        post_data = request.post_data_buffer or b''
+        return hashlib.sha256(
+            f'{request.method} {request.url} '.encode() + hashlib.sha256(post_data).digest()).hexdigest()
+
+    def apply(self, context: BrowserContext) -> None:
+        """Route the requests of the context (all its pages and popups) through the cache"""
+        if context in self._contexts:
+            return
+        self._contexts.add(context)
+        for pattern in self.url_patterns:
+            context.route(pattern, self._handle)
+
+    async def apply_async(self, context: AsyncBrowserContext) -> None:
+        """Async counterpart of apply"""
+        if context in self._contexts:
+            return
+        self._contexts.add(context)
+        for pattern in self.url_patterns:
+            await context.route(pattern, self._handle_async)
+
+    def get(self, key: str) -> Optional[tuple[int, dict, bytes]]:
+        """Stored (status, headers, body) of a key, None if missing, expired or corrupt"""
+        row = self.connection.execute(
+            'SELECT status, headers, sha256, expires_at FROM assets WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return None
+        status, headers, digest, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                body = f.read()
+        except OSError:
+            body = None
+        if body is None or hashlib.sha256(body).hexdigest() != digest:
+            # a crashed write or a file removed by hand, the next request stores it again
+            self.counts['corrupt'] += 1
+            self._delete([key])
+            return None
+        with self._lock, self.connection:
+            self.connection.execute('UPDATE assets SET used_at = ? WHERE key = ?', (time.time(), key))
+        return status, json.loads(headers), body
+
+    def put(self, key: str, url: str, status: int, headers: dict, body: bytes) -> None:
+        """Store a response, evicting the least recently used ones past max_bytes"""
+        headers = {name: value for name, value in headers.items() if name.lower() not in DROPPED_HEADERS}
+        age = max_age(headers.get('cache-control', '').lower())
+        expires_at = None
+        if self.mode == 'cache' and age is not None and not HASHED_NAME.search(urlparse(url).path):
+            expires_at = time.time() + age
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written aside and renamed, so another process never reads half a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        with self._lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO assets (key, url, status, headers, size, sha256, expires_at, used_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, url, status, json.dumps(headers), len(body), hashlib.sha256(body).hexdigest(),
+                 expires_at, time.time()))
+        self.counts['stored'] += 1
+        if self.max_bytes:
+            self._evict()
+
+    def stats(self) -> dict:
+        """Counters of this process, for logs and job results"""
+        lookups = self.counts['hits'] + self.counts['misses']
+        return {
+            'mode': self.mode,
+            **self.counts,
+            'hit_rate': round(self.counts['hits'] / lookups, 3) if lookups else None,
+            'bytes_saved': self.bytes_saved,
+        }
+
+    def disk_usage(self) -> dict:
+        """Assets stored and their total size, shared by every process using the directory"""
+        stored, size = self.connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM assets').fetchone()
+        return {'directory': self.directory, 'assets': stored, 'mb': round(size / 1024 / 1024, 1)}
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _handle(self, route: Route) -> None:
+        key = self.key(route.request)
+        if key is None:
+            route.fallback()
+            return
+        cached = self.get(key)
+        if cached:
+            self._count_hit(cached)
+            route.fulfill(status=cached[0], headers=cached[1], body=cached[2])
+            return
+        self.counts['misses'] += 1
+        if self.mode == 'replay':
+            self._replay_miss(route.request)
+            route.abort('internetdisconnected')
+            return
+        try:
+            response = route.fetch(max_redirects=0 if self.mode == 'record' else None)
+            body = response.body()
+        except Error as e:
+            logger.debug(f'Asset fetch failed, leaving it to the browser: {e}')
+            route.fallback()
+            return
+        self._store(key, route.request, response.status, response.headers, body)
+        route.fulfill(response=response, body=body)
+
+    async def _handle_async(self, route: AsyncRoute) -> None:
+        key = self.key(route.request)
+        if key is None:
+            await route.fallback()
+            return
+        cached = self.get(key)
+        if cached:
+            self._count_hit(cached)
+            await route.fulfill(status=cached[0], headers=cached[1], body=cached[2])
+            return
+        self.counts['misses'] += 1
+        if self.mode == 'replay':
+            self._replay_miss(route.request)
+            await route.abort('internetdisconnected')
+            return
+        try:
+            response = await route.fetch(max_redirects=0 if self.mode == 'record' else None)
+            body = await response.body()
+        except Error as e:
+            logger.debug(f'Asset fetch failed, leaving it to the browser: {e}')
+            await route.fallback()
+            return
+        self._store(key, route.request, response.status, response.headers, body)
+        await route.fulfill(response=response, body=body)
+
+    def _count_hit(self, cached: tuple) -> None:
+        self.counts['hits'] += 1
+        self.bytes_saved += len(cached[2])
+
+    def _replay_miss(self, request: Request) -> None:
+        self.counts['replay_misses'] += 1
+        logger.warning(f'Not in the recording: {request.method} {request.url}')
+
+    def _store(self, key: str, request: Request, status: int, headers: dict, body: bytes) -> None:
+        if self.mode == 'cache' and (status != 200 or not is_static(request.url, headers)):
+            return
+        try:
+            self.put(key, request.url, status, headers, body)
+        except OSError as e:
+            logger.warning(f'Could not store {request.url}: {e}')
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, 'objects', key[:2], key)
+
+    def _evict(self) -> None:
+        with self._lock:
+            total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM assets').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for key, size in self.connection.execute('SELECT key, size FROM assets ORDER BY used_at'):
+                if total <= self.max_bytes:
+                    break
+                evicted.append(key)
+                total -= size
+        self.counts['evicted'] += len(evicted)
+        self._delete(evicted)
+
+    def _delete(self, keys: list[str]) -> None:
+        with self._lock, self.connection:
+            self.connection.executemany('DELETE FROM assets WHERE key = ?', [(key,) for key in keys])
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_asset_cache() -> Optional[AssetCache]:
+    """Process-wide asset cache configured by the env, created on first use (None when off)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AssetCache.from_env() or False
+        return _cache or None
+
+
+if __name__ == "__main__":
+    """_summary_ Show what the asset cache (or a recording) holds on disk.
+    Args:
+        recording (bool): Show ASSET_RECORDING_DIR instead of ASSET_CACHE_DIR
+
+    Usage example: python asset_cache.py --recording
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Show the assets stored by the asset cache or a recording.')
+    parser.add_argument('--recording', action='store_true',
+                        help='Show the recording instead of the cache')
+    args = parser.parse_args()
+    cache = AssetCache(ASSET_RECORDING_DIR, 0, 'replay') if args.recording else AssetCache()
+    print(cache.disk_usage())
@@ -0,0 +1,359 @@
+from typing import Optional
+
+from playwright.async_api import Page, TimeoutError, Error
+from creator_index import CreatorIndex, build_im_url, parse_im_url, normalize_handle
+from creator_search import Resolution, RESOLVED, build_detail_url, is_creator_search_response
+
+from overlays import OverlayGuard
+from captcha_watcher import CaptchaWatcher
+from sent_ledger import SentLedger
+from screenshots import get_screenshot_service
+from metrics import timed
+from timeout_policy import TimeoutPolicy
+from phases import FIND_CREATOR, OPEN_CONVERSATION, PROCESS_MESSAGES
+from outreach_bot_base import OutreachBotBase
+from outreach_bot import (
+    SessionExpiredError,
+    is_find_creator_url,
+    FIND_CREATOR_URL,
+    TAKE_DEBUG_SCREENS,
+    PAGE_TITLE_SELECTOR,
+    SEARCH_INPUT_SELECTOR,
+    EMPTY_ROW_SELECTOR,
+    FIRST_ROW_CELL_SELECTOR,
+    MESSAGE_ICON_SELECTOR,
+    SEND_BUTTON_SELECTOR,
+    MESSAGE_INPUT_SELECTOR,
+    IM_HEADER_SELECTOR,
+    IM_URL_PATTERN,
+    DETAIL_URL_PATTERN,
+    IM_SPA_NAVIGATION,
+    CLICK_MESSAGE_BUTTON_JS,
+    SWITCH_CONVERSATION_JS,
+    CONVERSATION_SHOWN_JS,
+)
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+async def take_debug_screenshot_async(page: Page, name: str) -> Optional[str]:
+    """Capture a page and queue its upload, without waiting for S3"""
+    return await get_screenshot_service().capture_async(page, name)
+
+
+class AsyncOutreachMessageBot(OutreachBotBase):
+    """asyncio port of OutreachMessageBot, so many pages can wait on the site concurrently"""
+
+    def __init__(self, page: Page, creator_index: Optional[CreatorIndex] = None,
+                 overlay_guard: Optional[OverlayGuard] = None,
+                 captcha_watcher: Optional[CaptchaWatcher] = None,
+                 timeout_policy: Optional[TimeoutPolicy] = None,
+                 ledger: Optional[SentLedger] = None):
+        super().__init__(page, creator_index, overlay_guard or OverlayGuard(
+            screenshot=take_debug_screenshot_async if TAKE_DEBUG_SCREENS else None),
+            captcha_watcher, timeout_policy, ledger)
+
+    async def watch_page(self, page: Page) -> None:
+        """Handle overlays and captchas on a page the bot works on, and keep track of it"""
+        self.track_page(page)
+        await self.overlays.attach_async(page)
+        await self.captcha_watcher.attach_async(page)
+
+    async def execute(self, config: dict) -> dict:
+        """Execute the outreach message task, resuming from the last checkpoint after a failure"""
+        creator = config['creator']
+        failed_phase, resume_phase = self.start_attempt(config)
+        logger.info(f"Run AsyncOutreachMessageBot for creator: '{creator}' from phase {resume_phase}")
+        await self.watch_page(self.page)
+
+        if resume_phase == FIND_CREATOR:
+            if not await self.open_indexed_conversation(creator):
+                self.phase = FIND_CREATOR
+                if config.get('creator_id'):
+                    # resolved ahead of time by resolve_creators.py, no search needed
+                    await self.open_resolved_creator(creator, config['creator_id'])
+                else:
+                    await self.find_creator(creator)
+                resume_phase = self.phase_after_search()
+            await self.close_finished_pages()
+        if resume_phase == OPEN_CONVERSATION:
+            self.phase = OPEN_CONVERSATION
+            await self.open_conversation(creator, reload=failed_phase == OPEN_CONVERSATION)
+            await self.close_finished_pages()
+
+        await self.captcha_watcher.solve_pending_async(self.page)
+        self.phase = PROCESS_MESSAGES
+        if self.checkpoint.im_url:
+            await self.resume_at(self.checkpoint.im_url, reload=failed_phase == PROCESS_MESSAGES)
+            self.im_page = self.page
+        await self.process_messages(config['message'], creator,
+                                    config.get('agency_campaign_id'), config.get('account'))
+
+        return {}
+
+    async def resume_at(self, url: str, reload: bool = False) -> None:
+        """Make sure the bot works on the page of a checkpoint, see OutreachMessageBot.resume_at"""
+        if self.page.is_closed() or self.page.url != url:
+            for page in reversed(self.page.context.pages):
+                if page.url == url:
+                    self.page = page
+                    await self.watch_page(page)
+                    break
+        if not self.page.is_closed() and self.page.url == url and not reload:
+            return
+
+        logger.info(f'Loading checkpoint {url}')
+        if self.page.is_closed():
+            self.page = await self.page.context.new_page()
+            await self.watch_page(self.page)
+        with timed('resume'), self.timeouts.measure('goto') as timeout:
+            await self.page.goto(url, timeout=timeout)
+
+    async def find_creator(self, creator: str) -> None:
+        """Search the creator and open their details tab"""
+        if not creator:
+            logger.warning(
+                'Encountered a creator without a tiktok_username, this task will not be executed')
+            return
+
+        logger.info('findCreator ...')
+        await self.open_search()
+        resolution = await self.search(creator)
+        if resolution and resolution.status == RESOLVED:
+            await self.open_resolved_creator(creator, resolution.creator_id)
+            return
+
+        # Wait for and click first result
+        with timed('row_click'):
+            with self.timeouts.measure('empty_row_hidden') as timeout:
+                await self.page.wait_for_selector(
+                    EMPTY_ROW_SELECTOR, state='hidden', timeout=timeout)
+            await self.page.locator(FIRST_ROW_CELL_SELECTOR).click()
+            await self.move_to_next_plan()
+            # the new tab starts on about:blank, a retry must resume at the creator's page
+            with self.timeouts.measure('details_url') as timeout:
+                await self.page.wait_for_url(DETAIL_URL_PATTERN, timeout=timeout)
+        self.details_opened()
+
+    async def open_search(self) -> None:
+        """Load the "Find creators" page, making sure it is the English one"""
+        if self.page is self.im_page and not self.page.is_closed():
+            # searched in a tab of its own, the IM tab stays open for a resolved creator
+            self.page = await self.page.context.new_page()
+            await self.watch_page(self.page)
+        with timed('goto'), self.timeouts.measure('goto') as timeout:
+            await self.page.goto(FIND_CREATOR_URL, timeout=timeout)
+        await self.skip_modal()
+
+        try:
+            if not await self.check_language():
+                with timed('reload'):
+                    await self.page.reload()
+                if not await self.check_language():
+                    await self.check_redirect()
+                    raise Exception(
+                        'Oops! This is not the English page, please try again later')
+        except TimeoutError:
+            await self.check_redirect()
+
+        logger.info('Successfully entered the creators page.')
+
+    async def search(self, creator: str) -> Optional[Resolution]:
+        """Search the creator on the creators page, see search_creator"""
+        with timed('search'):
+            with self.timeouts.measure('search_input') as timeout:
+                await self.page.wait_for_selector(SEARCH_INPUT_SELECTOR, timeout=timeout)
+            search_input = self.page.locator(SEARCH_INPUT_SELECTOR)
+            await search_input.fill(creator)
+            return await self.search_creator(search_input, creator)
+
+    async def search_creator(self, search_input, creator: str) -> Optional[Resolution]:
+        """Submit the search and match the creator in its API response, None to fall back to the table"""
+        if not self.interception.enabled():
+            await search_input.press('Enter')
+            return None
+        try:
+            with self.timeouts.measure('search_api') as timeout:
+                async with self.page.expect_response(is_creator_search_response, timeout=timeout) as response_info:
+                    await search_input.press('Enter')
+            payload = await (await response_info.value).json()
+        except TimeoutError:
+            self.interception.record(False)
+            logger.warning(f"No creator search response captured for '{creator}'")
+            return None
+        except (Error, ValueError) as e:
+            self.interception.record(True)
+            logger.warning(f"Unreadable creator search response for '{creator}': {e}")
+            return None
+        self.interception.record(True)
+        return self.match_search(payload, creator)
+
+    async def open_resolved_creator(self, creator: str, creator_id: str) -> None:
+        """Open the IM page of a creator resolved by the search when the shop is known, else its details page"""
+        if self.shop_id:
+            try:
+                await self.open_im(creator, self.shop_id, creator_id)
+                self.resolved_conversation_opened(creator, creator_id)
+                return
+            except Error as e:
+                logger.warning(f"IM page of resolved creator '{creator}' did not load, opening its details: {e}")
+
+        with timed('open_details'), self.timeouts.measure('goto') as timeout:
+            await self.page.goto(build_detail_url(creator_id), timeout=timeout)
+        logger.info('Successfully entered the creator details page from the search.')
+        self.checkpoint.details_url = self.page.url
+
+    async def open_conversation(self, creator: str, reload: bool = False) -> None:
+        """Open the IM tab from the creator details tab"""
+        logger.info('openConversation ...')
+        if self.checkpoint.details_url:
+            await self.resume_at(self.checkpoint.details_url, reload)
+
+        # Find and click message icon
+        with timed('message_button'):
+            with self.timeouts.measure('message_icon') as timeout:
+                await self.page.wait_for_selector(MESSAGE_ICON_SELECTOR, timeout=timeout)
+            await self.page.evaluate(CLICK_MESSAGE_BUTTON_JS)
+
+            await self.move_to_next_plan()
+        await self.index_conversation(creator)
+
+    async def check_redirect(self) -> None:
+        """Raise SessionExpiredError if the site sent us away from the creators page"""
+        current_url = self.page.url
+        if not is_find_creator_url(current_url):
+            cookies = await self.page.context.cookies()
+            raise SessionExpiredError(
+                f'Detected an incorrect redirect to: {current_url}. cookies: {cookies}')
+
+    async def open_indexed_conversation(self, creator: str) -> bool:
+        """Go straight to the IM page of an already indexed creator"""
+        ids = self.indexed_ids(creator)
+        if not ids:
+            return False
+        try:
+            await self.open_im(creator, *ids)
+        except Error as e:
+            self.indexed_conversation_failed(creator, e)
+            return False
+        self.indexed_conversation_opened(ids[0])
+        return True
+
+    async def open_im(self, creator: str, shop_id: str, creator_id: str) -> None:
+        """Open the conversation with a creator, inside the open IM app if it can, else by loading its IM page"""
+        url = build_im_url(shop_id, creator_id)
+        if await self.switch_conversation(creator, shop_id, url):
+            return
+        with timed('open_im'):
+            await self.page.goto(url)
+            with self.timeouts.measure('im_textarea') as timeout:
+                await self.page.wait_for_selector(MESSAGE_INPUT_SELECTOR, timeout=timeout)
+
+    async def switch_conversation(self, creator: str, shop_id: str, url: str) -> bool:
+        """Switch the IM tab to another creator of the same shop, see OutreachMessageBot.switch_conversation"""
+        im_page = self.im_page
+        if IM_SPA_NAVIGATION == 'off' or not creator or not im_page or im_page.is_closed():
+            return False
+        ids = parse_im_url(im_page.url)
+        if not ids or ids[0] != shop_id:
+            return False
+        try:
+            with timed('switch_im'):
+                await im_page.evaluate(SWITCH_CONVERSATION_JS, url)
+                with self.timeouts.measure('im_switch') as timeout:
+                    await im_page.wait_for_function(
+                        CONVERSATION_SHOWN_JS,
+                        arg=[IM_HEADER_SELECTOR, normalize_handle(creator), parse_im_url(url)[1]],
+                        timeout=timeout)
+                    await im_page.wait_for_selector(MESSAGE_INPUT_SELECTOR, timeout=timeout)
+        except Error as e:
+            logger.info(f"IM app did not switch to '{creator}', loading the page: {e}")
+            self.page = im_page
+            return False
+        self.page = im_page
+        if im_page not in self.pages:
+            self.pages.append(im_page)
+        logger.info(f"Switched the IM app to '{creator}'")
+        return True
+
+    async def index_conversation(self, creator: str) -> None:
+        """Checkpoint the IM tab open_conversation ended on, and record its IDs in the creator index"""
+        try:
+            with timed('wait_im'), self.timeouts.measure('im_url') as timeout:
+                await self.page.wait_for_url(IM_URL_PATTERN, timeout=timeout)
+        except TimeoutError:
+            logger.warning(f"IM tab of '{creator}' did not load, not indexing it")
+            return
+        self.conversation_opened(creator)
+
+    async def process_messages(self, message: str, creator: str, agency_campaign_id: Optional[str] = None,
+                               account: Optional[str] = None) -> None:
+        """Process and send messages to creator, recording the send in the ledger"""
+        logger.info('processMessages ...')
+
+        await self.skip_tip()
+        with timed('fill'):
+            await self.page.locator(MESSAGE_INPUT_SELECTOR).fill(message)
+
+        # Only click send in production
+        if self.is_production():
+            if not self.claim_send(agency_campaign_id, creator, account):
+                return
+            try:
+                with timed('send'):
+                    await self.page.locator(SEND_BUTTON_SELECTOR).first.click()
+            except Exception:
+                self.send_failed(agency_campaign_id, creator)
+                raise
+            self.send_confirmed(agency_campaign_id, creator)
+
+        logger.info('Mission accomplished!')
+
+    async def skip_modal(self) -> None:
+        """Skip modal if present, later ones are removed by the overlay guard"""
+        with timed('skip_modal'):
+            await self.overlays.dismiss_visible_async(self.page, 'modal')
+
+    async def skip_tip(self) -> None:
+        """Skip tutorial/welcome tip if present, later ones are skipped by the overlay guard"""
+        with timed('skip_tip'):
+            await self.overlays.dismiss_visible_async(self.page, 'skip_guide')
+
+    async def close_finished_pages(self) -> None:
+        """Close the tabs the bot moved away from, the finished phase won't resume on them"""
+        for page in self.pages:
+            if page is not self.page and not page.is_closed():
+                try:
+                    await page.close()
+                except Error as e:
+                    logger.warning(f'Could not close a finished tab: {e}')
+        self.pages = [self.page]
+
+    async def move_to_next_plan(self) -> None:
+        """Switch to the latest browser window/tab"""
+        pages = self.page.context.pages
+        if pages:
+            self.page = pages[-1]
+            await self.watch_page(self.page)
+
+    async def check_language(self) -> bool:
+        """Check if page is in English"""
+        logger.info('checkLanguage ...')
+        try:
+            with timed('check_language'), self.timeouts.measure('page_title') as timeout:
+                title_element = await self.page.wait_for_selector(PAGE_TITLE_SELECTOR, timeout=timeout)
+                title_text = await title_element.text_content()
+            is_english = title_text == 'Find creators'
+
+            if not is_english and TAKE_DEBUG_SCREENS:
+                await self.take_debug_screenshot('LOCALIZATION-ISSUES')
+
+            return is_english
+        except Error:
+            return False
+
+    async def take_debug_screenshot(self, name: str) -> Optional[str]:
+        """Capture the current page and upload it off the event loop"""
+        return await take_debug_screenshot_async(self.page, name)
+
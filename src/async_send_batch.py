@@ -0,0 +1,220 @@
+import asyncio
+import json
+import itertools
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+from async_outreach_bot import AsyncOutreachMessageBot
+from resolution_store import ResolutionStore
+from sent_ledger import SentLedger
+from creator_index import CreatorIndex
+from network_policy import NetworkPolicy
+from asset_cache import get_asset_cache
+from bot_context import new_bot_context_async
+from bot_session import AsyncBotSession, session_key
+from session_cache import SessionCache
+from send_batch import read_jobs, job_resolution, job_skip_result, resolved_creator_id, session_forgetter
+from send_message import IS_PROD, TAKE_DEBUG_SCREENS, job_config, record_failure, next_retry, finish_result
+from set_cookies import business_cookies
+from sentry import init_sentry, capture_scraper_exception, failure_screenshot_name
+from metrics import registry, write_metrics
+from logger import get_logger, log_context
+
+logger = get_logger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+
+
+async def handle_scraper_exception_async(e: Exception, bot: AsyncOutreachMessageBot, config: dict) -> None:
+    """Async counterpart of sentry.handle_scraper_exception, keeping the blocking reporting off the event loop"""
+    if not IS_PROD:
+        logger.error(f"Exception occurred: {e}")
+        return
+
+    picture_url = None
+    if TAKE_DEBUG_SCREENS:
+        picture_url = await bot.take_debug_screenshot(failure_screenshot_name(config))
+        logger.error(
+            f"OutreachMessageBot interrupted due to a missing element. screenshot link: {picture_url}")
+
+    await asyncio.to_thread(capture_scraper_exception, e, picture_url)
+
+
+async def retry_with_captchas_async(page: Page, message: str, tiktok_account: str, agency_campaign_id: str,
+                                    retries: Optional[int] = None,
+                                    creator_index: Optional[CreatorIndex] = None,
+                                    on_session_expired: Optional[Callable[[BrowserContext], bool]] = None,
+                                    creator_id: Optional[str] = None,
+                                    ledger: Optional[SentLedger] = None, account: Optional[str] = None,
+                                    bot: Optional[AsyncOutreachMessageBot] = None) -> dict:
+    """Async counterpart of send_message.retry_with_captchas"""
+    config = job_config(message, tiktok_account, agency_campaign_id, creator_id, account)
+    if bot:
+        bot.new_job()
+    else:
+        bot = AsyncOutreachMessageBot(page, creator_index, ledger=ledger)
+    result = {'success': False, 'attempts': 0, 'phase': None, 'error': None}
+
+    failures = Counter()
+    started = time.perf_counter()
+    # Each job runs in its own task, so its correlation id doesn't leak into the others
+    with log_context() as job_id, registry.transaction('async_send_batch'):
+        result['correlation_id'] = job_id
+        for attempt in itertools.count(1):
+            result['attempts'] = attempt
+            try:
+                await bot.execute(config)
+                result.update(success=True, phase=None, error=None)
+                break
+            except Exception as e:
+                if not record_failure(e, bot, result, failures):
+                    break
+                await handle_scraper_exception_async(e, bot, config)
+                policy = next_retry(e, bot, result, failures, attempt, retries, on_session_expired)
+                if not policy:
+                    break
+                if not bot.page.is_closed():
+                    await bot.captcha_watcher.solve_pending_async(bot.page)
+                await asyncio.sleep(policy.delay(failures[bot.phase]))
+
+    return finish_result(bot, result, failures, started)
+
+
+async def run_job(browser: Browser, job: dict, creator_index: Optional[CreatorIndex] = None,
+                  network_policy: Optional[NetworkPolicy] = None,
+                  session_cache: Optional[SessionCache] = None,
+                  resolutions: Optional[ResolutionStore] = None,
+                  ledger: Optional[SentLedger] = None, session: Optional[AsyncBotSession] = None) -> dict:
+    """
+    Run a single outreach job in its own context of the shared browser
+
+    Args:
+        session: Context and bot kept open for the next job of the same seller session,
+            used by one job at a time
+    """
+    started = time.monotonic()
+    result = {
+        'creator': job.get('creator'),
+        'agency_campaign_id': job.get('agency_campaign_id'),
+    }
+
+    account = job.get('account')
+    storage_state = session_cache.load(account) if session_cache and account else None
+    resolution = job_resolution(job, resolutions)
+    skip = job_skip_result(job, storage_state, resolution, ledger)
+    if skip:
+        result.update(skip)
+    else:
+        cookies = None if storage_state else business_cookies(job['sessionid_cookie'], job['web_id_cookie'])
+        context = bot = None
+        try:
+            if session:
+                bot = await session.bot_for(session_key(job, storage_state), storage_state, cookies,
+                                            creator_index, ledger)
+                page = bot.page
+            else:
+                # The bot follows new tabs through context.pages, so every job needs its own context
+                context = await new_bot_context_async(browser, storage_state, network_policy, cookies=cookies)
+                page = await context.new_page()
+                # created here rather than by retry_with_captchas_async, so a crash can be put down to its phase
+                bot = AsyncOutreachMessageBot(page, creator_index, ledger=ledger)
+            result.update(await retry_with_captchas_async(
+                page, job['message'], job['creator'], job['agency_campaign_id'],
+                creator_index=creator_index, on_session_expired=session_forgetter(session_cache, account),
+                creator_id=resolved_creator_id(resolution),
+
+                ledger=ledger, account=account, bot=bot))
+        except Exception as e:
+            logger.error(f"Job for creator '{job['creator']}' crashed: {e}")
+            result.update(success=False, phase=bot and bot.phase or 'setup_page', error=str(e))
+        finally:
+            if session:
+                await session.job_done(result)
+            elif context:
+                await context.close()
+
+    result['duration'] = round(time.monotonic() - started, 3)
+    return result
+
+
+async def run_batch(jobs_file: str, output_file: str, concurrency: int = DEFAULT_CONCURRENCY,
+                    metrics_file: Optional[str] = None) -> None:
+    """Run every job of jobs_file with at most `concurrency` pages open at once
+
+    Args:
+        metrics_file: File to save the step timings to, Prometheus text if it ends with .prom, JSON otherwise
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {True: 0, False: 0}
+    creator_index = CreatorIndex()
+    network_policy = NetworkPolicy.from_env()
+    session_cache = SessionCache()
+    resolutions = ResolutionStore()
+    ledger = SentLedger()
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=IS_PROD)
+        with open(output_file, 'a') as output:
+
+            async def run(job: dict) -> None:
+                try:
+                    result = await run_job(browser, job, creator_index, network_policy, session_cache,
+                                           resolutions, ledger)
+                finally:
+                    semaphore.release()
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+                counts[result['success']] += 1
+
+            tasks = []
+            for job in read_jobs(jobs_file):
+                # Acquire before scheduling so only `concurrency` jobs are ever in flight
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(run(job)))
+            await asyncio.gather(*tasks)
+
+        await browser.close()
+
+    logger.info(
+        f'Finished batch: {counts[True]} sent, {counts[False]} failed.')
+    if network_policy:
+        logger.info(f'Network policy stats: {network_policy.stats()}')
+    if asset_cache := get_asset_cache():
+        logger.info(f'Asset cache stats: {asset_cache.stats()}')
+    logger.info(f'Step timings: {registry.summary()}')
+    if metrics_file:
+        write_metrics(metrics_file)
+
+
+def main(jobs_file: str, output_file: str, concurrency: int = DEFAULT_CONCURRENCY,
+         metrics_file: Optional[str] = None) -> None:
+    asyncio.run(run_batch(jobs_file, output_file, concurrency, metrics_file))
+
+
+if __name__ == "__main__":
+    """_summary_ Send messages for a batch of jobs with several concurrent pages in one event loop.
+    Args:
+        jobs (str): JSONL or CSV file with creator, message, agency_campaign_id, and either an account
+            whose session was cached by login.py or sessionid_cookie and web_id_cookie, per job
+        output (str): JSONL file the per-job results are appended to as each job finishes
+        concurrency (int): Number of jobs (browser contexts) to run at the same time
+        metrics (str): Optional file to save step timings to (.prom for Prometheus text, JSON otherwise)
+
+    Usage example: python async_send_batch.py --jobs jobs.jsonl --output results.jsonl --concurrency 4
+    """
+    init_sentry()
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Send messages for a batch of outreach jobs concurrently.')
+    parser.add_argument('--jobs', required=True,
+                        help='JSONL or CSV file with one job per line')
+    parser.add_argument('--output', required=True,
+                        help='JSONL file to append per-job results to')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Number of jobs to run at the same time')
+    parser.add_argument('--metrics', default=None,
+                        help='File to save step timings to, Prometheus text if it ends with .prom, JSON otherwise')
+    args = parser.parse_args()
+    main(args.jobs, args.output, args.concurrency, args.metrics)
@@ -1,40 +1,105 @@
 import os
+import threading
 from datetime import datetime
 from typing import Optional
 
-from dotenv import load_dotenv
-import boto3
-from botocore.exceptions import ClientError
-
 from logger import get_logger
 
-load_dotenv()
 logger = get_logger(__name__)
 
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_DEFAULT_REGION = os.getenv("AWS_DEFAULT_REGION")
-AWS_BUCKET = os.getenv("AWS_BUCKET")
-
-boto3.setup_default_session(
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_DEFAULT_REGION
-)
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+_dotenv_loaded = False
+
+
+def aws_setting(name: str) -> Optional[str]:
+    """
+    AWS_* setting from the environment
+
+    The .env file is read on the first call rather than at import, like boto3
+    is only imported once something is uploaded.
+    """
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _dotenv_loaded = True
+    return os.getenv(name)
+
+
+def get_s3_client(region_name: Optional[str] = None, endpoint_url: Optional[str] = None):
+    """
+    Shared S3 client per region/endpoint
+
+    boto3 clients are thread-safe and keep a connection pool, so creating one
+    per upload only adds setup time. boto3 itself is imported on the first call,
+    most runs never upload anything and its import takes a few hundred ms.
+
+    Args:
+        region_name: AWS region, AWS_DEFAULT_REGION when None
+        endpoint_url: S3 endpoint to use instead of AWS (e.g. moto or MinIO), AWS_S3_ENDPOINT_URL when None
+    """
+    region_name = region_name or aws_setting('AWS_DEFAULT_REGION')
+    endpoint_url = endpoint_url or aws_setting('AWS_S3_ENDPOINT_URL')
+    key = (region_name, endpoint_url)
+    with _s3_clients_lock:
+        if key not in _s3_clients:
+            import boto3
+            if not _s3_clients:
+                boto3.setup_default_session(
+                    aws_access_key_id=aws_setting('AWS_ACCESS_KEY_ID'),
+                    aws_secret_access_key=aws_setting('AWS_SECRET_ACCESS_KEY'),
+                    region_name=aws_setting('AWS_DEFAULT_REGION')
+                )
+            _s3_clients[key] = boto3.client(
+                's3', region_name=region_name, endpoint_url=endpoint_url)
+        return _s3_clients[key]
 
 
 class ScreenshotStorage:
-    def __init__(self, bucket_name: str = AWS_BUCKET, region_name: str = AWS_DEFAULT_REGION):
+    def __init__(self, bucket_name: Optional[str] = None, region_name: Optional[str] = None,
+                 endpoint_url: Optional[str] = None):
         """
         Initialize AWS S3 client
 
         Args:
-            bucket_name: Name of the S3 bucket
-            region_name: AWS region name (default: us-east-1)
+            bucket_name: Name of the S3 bucket, AWS_BUCKET when None
+            region_name: AWS region name, AWS_DEFAULT_REGION when None
+            endpoint_url: S3 endpoint to use instead of AWS, e.g. a local stand-in for tests,
+                AWS_S3_ENDPOINT_URL when None
         """
-        self.s3_client = boto3.client('s3', region_name=region_name)
-        self.bucket_name = bucket_name
-        self.region_name = region_name
+        self.bucket_name = bucket_name or aws_setting('AWS_BUCKET')
+        self.region_name = region_name or aws_setting('AWS_DEFAULT_REGION')
+        self.endpoint_url = endpoint_url or aws_setting('AWS_S3_ENDPOINT_URL')
+
+    @property
+    def s3_client(self):
+        """Created on first use, by the upload thread rather than the page taking the screenshot"""
+        return get_s3_client(self.region_name, self.endpoint_url)
+
+    @staticmethod
+    def object_key(save_as_name: str, extension: str = 'png') -> str:
+        """S3 key of a screenshot saved today"""
+        # Create path similar to PHP version
+        path = f"tiktokbot-screenshots/{
+            datetime.now().strftime('%Y-%m-%d')}/"
+        return f"{path}{save_as_name}.{extension}"
+
+    def object_url(self, object_key: str) -> str:
+        """Public URL of an object of the bucket"""
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket_name}/{object_key}"
+        return f"https://{self.bucket_name}.s3.{
+            self.region_name}.amazonaws.com/{object_key}"
+
+    def upload(self, object_key: str, body: bytes, content_type: str) -> None:
+        """Upload an object, raising on failure"""
+        self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=object_key,
+            Body=body,
+            ContentType=content_type
+        )
 
     def save_screenshot(self, screenshot_bytes: bytes, save_as_name: str) -> Optional[str]:
         """
@@ -47,24 +112,15 @@ class ScreenshotStorage:
         Returns:
             str: URL of the uploaded file in S3, or None if upload fails
         """
+        from botocore.exceptions import ClientError
         try:
-            # Create path similar to PHP version
-            path = f"tiktokbot-screenshots/{
-                datetime.now().strftime('%Y-%m-%d')}/"
-            filename = f"{save_as_name}.png"
-            full_path = path + filename
+            full_path = self.object_key(save_as_name)
 
             # Upload directly to S3 from memory
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=full_path,
-                Body=screenshot_bytes,
-                ContentType='image/png'
-            )
+            self.upload(full_path, screenshot_bytes, 'image/png')
 
             # Generate the URL
-            url = f"https://{self.bucket_name}.s3.{
-                self.region_name}.amazonaws.com/{full_path}"
+            url = self.object_url(full_path)
             logger.info(f"Screenshot uploaded successfully to {url}")
             return url
 
@@ -83,6 +139,7 @@ class ScreenshotStorage:
         Returns:
             str: Presigned URL or None if generation fails
         """
+        from botocore.exceptions import ClientError
         try:
             url = self.s3_client.generate_presigned_url(
                 'get_object',
@@ -0,0 +1,180 @@
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from mock_seller_center import MockSellerCenter, MockSettings, solve_mock_captcha, MOCK_HOST, MOCK_PORT
+
+# The bot reads the seller center origin at import time, so point it at the mock before importing it.
+# This is assigned rather than defaulted so a benchmark can never reach the real site.
+os.environ['SELLER_CENTER_URL'] = f'http://{MOCK_HOST}:{MOCK_PORT}'
+# Learn timeouts in memory only, the mock's timings must not leak into the real timeouts file
+os.environ['TIMEOUT_POLICY_FILE'] = ''
+
+from playwright.sync_api import sync_playwright  # noqa: E402
+from send_batch import new_job_page  # noqa: E402
+from send_message import retry_with_captchas, IS_PROD  # noqa: E402
+from creator_index import CreatorIndex  # noqa: E402
+from network_policy import NetworkPolicy  # noqa: E402
+from overlays import OverlayGuard  # noqa: E402
+from captcha_watcher import CaptchaWatcher  # noqa: E402
+from metrics import registry, percentile, STEP_DURATION  # noqa: E402
+from logger import get_logger  # noqa: E402
+
+logger = get_logger(__name__)
+
+DEFAULT_JOBS = 20
+DEFAULT_CONCURRENCY_LEVELS = (1, 2, 4)
+BENCHMARK_MESSAGE = 'Hi! This is a benchmark message.'
+
+
+def run_level(jobs: int, concurrency: int, creator_index: Optional[CreatorIndex] = None,
+              headless: bool = True) -> dict:
+    """
+    Send `jobs` messages to the mock with `concurrency` browsers working in parallel
+
+    Each worker thread drives its own sync_playwright and browser, since the
+    sync API is bound to the thread that started it.
+
+    Returns:
+        dict: job count, successes, p50/p95 job latency, messages per minute and step timings
+    """
+    registry.reset()
+    pending = queue.SimpleQueue()
+    for i in range(jobs):
+        pending.put(f'bench_creator_{i}')
+    durations = []
+    failures = []
+    lock = threading.Lock()
+    network_policy = NetworkPolicy.from_env()
+
+    def work() -> None:
+        with sync_playwright() as p:
+            browser = p.chromium.launch(headless=headless)
+            try:
+                while True:
+                    try:
+                        creator = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    page = new_job_page(browser, network_policy)
+                    started = time.perf_counter()
+                    try:
+                        result = retry_with_captchas(
+                            page, BENCHMARK_MESSAGE, creator, 'benchmark', retries=1,
+                            creator_index=creator_index, account='benchmark',
+                            # no debug screenshots: they would be uploaded to S3
+                            overlay_guard=OverlayGuard(),
+                            captcha_watcher=CaptchaWatcher(solve=solve_mock_captcha))
+                    finally:
+                        page.context.close()
+                    with lock:
+                        if result['success']:
+                            durations.append(time.perf_counter() - started)
+                        else:
+                            failures.append(f"{creator}: {result['phase']}: {result['error']}")
+            finally:
+                browser.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=work, name=f'benchmark-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    durations.sort()
+    steps = {labels: summary for labels, summary in registry.summary().get(STEP_DURATION, {}).items()
+             if labels.startswith('outcome=ok')}
+    return {
+        'concurrency': concurrency,
+        'jobs': jobs,
+        'succeeded': len(durations),
+        'failures': failures,
+        'elapsed': round(elapsed, 2),
+        'p50': percentile(durations, 0.5),
+        'p95': percentile(durations, 0.95),
+        'messages_per_minute': round(len(durations) / elapsed * 60, 1) if elapsed else None,
+        'steps': steps,
+    }
+
+
+def main(jobs: int = DEFAULT_JOBS, concurrency_levels: tuple = DEFAULT_CONCURRENCY_LEVELS,
+         delay_scale: float = 1.0, captcha_rate: float = 0.0, use_index: bool = False,
+         output_file: Optional[str] = None, headless: bool = True) -> list[dict]:
+    """
+    Benchmark the send_message flow against the mock seller center at several concurrency levels
+
+    Args:
+        delay_scale: Multiplier of the mock's default delays, 0 for the bot's own overhead only
+        captcha_rate: Share of the mock pages showing a captcha
+        use_index: Resolve creators through a fresh creator index, so repeated runs of a
+            level after the first one measure the indexed path
+        output_file: JSON file to save the results to
+    """
+    if IS_PROD:
+        raise RuntimeError('Refusing to benchmark with ENVIRONMENT=production')
+
+    settings = MockSettings(captcha_rate=captcha_rate).scaled(delay_scale)
+    mock = MockSellerCenter(settings).start()
+    creator_index = None
+    if use_index:
+        creator_index = CreatorIndex(os.path.join(tempfile.mkdtemp(), 'benchmark_index.db'))
+
+    results = []
+    try:
+        for concurrency in concurrency_levels:
+            result = run_level(jobs, concurrency, creator_index, headless)
+            results.append(result)
+            print(f"concurrency={result['concurrency']:<3} ok={result['succeeded']}/{result['jobs']} "
+                  f"p50={result['p50']}s p95={result['p95']}s "
+                  f"throughput={result['messages_per_minute']} msg/min")
+            for failure in result['failures'][:5]:
+                print(f'    failed {failure}')
+    finally:
+        mock.stop()
+        if creator_index:
+            creator_index.close()
+
+    if output_file:
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    """_summary_ Measure latency and throughput of the bot against a local mock seller center, without touching TikTok.
+    Args:
+        jobs (int): Messages to send at each concurrency level
+        concurrency (str): Comma separated concurrency levels (browsers working in parallel)
+        delay_scale (float): Multiplier of the mock's page delays, 0 measures the bot's own overhead
+        captcha_rate (float): Share of mock pages showing a captcha
+        use_index (bool): Go through a creator index, so later levels measure the indexed path
+        output (str): JSON file to save the results to
+
+    Usage example: python benchmark.py --jobs 20 --concurrency 1,2,4 --output benchmark.json
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmark the outreach bot against a local mock seller center.')
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                        help='Messages to send at each concurrency level')
+    parser.add_argument('--concurrency', default=','.join(map(str, DEFAULT_CONCURRENCY_LEVELS)),
+                        help='Comma separated concurrency levels')
+    parser.add_argument('--delay_scale', type=float, default=1.0,
+                        help="Multiplier of the mock's page delays")
+    parser.add_argument('--captcha_rate', type=float, default=0.0,
+                        help='Share of mock pages showing a captcha')
+    parser.add_argument('--use_index', action='store_true',
+                        help='Resolve creators through a fresh creator index')
+    parser.add_argument('--output', default=None,
+                        help='JSON file to save the results to')
+    parser.add_argument('--headed', action='store_true',
+                        help='Show the browsers')
+    args = parser.parse_args()
+    main(args.jobs, tuple(int(level) for level in args.concurrency.split(',')),
+         args.delay_scale, args.captcha_rate, args.use_index, args.output, not args.headed)
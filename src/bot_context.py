@@ -0,0 +1,112 @@
+from functools import lru_cache
+from os import getenv
+from typing import Optional
+from weakref import WeakSet
+
+from playwright.sync_api import Browser, BrowserContext
+from playwright.async_api import Browser as AsyncBrowser, BrowserContext as AsyncBrowserContext
+from network_policy import NetworkPolicy
+from asset_cache import get_asset_cache
+from metrics import timed
+
+BROWSER_LOCALE = getenv('BROWSER_LOCALE', 'en-US')
+DEFAULT_TIMEOUT = 30000  # 30 second timeout
+
+# Contexts already set up, so a context handed to setup_context twice doesn't run every script twice
+_configured = WeakSet()
+
+
+def isolate_evasion(script: str) -> str:
+    """Run an evasion in its own function, so its 'use strict' and declarations stay local and an error only stops it"""
+    return f'try {{ (function () {{\n{script}\n}})() }} catch (e) {{}}'
+
+
+@lru_cache(maxsize=None)
+def stealth_script() -> str:
+    """
+    The stealth evasions as a single init script, built once per process
+
+    One init script saves a protocol round trip per evasion and per page.
+    The evasions use the `opts`, `utils` and magic array helpers the first
+    scripts declare, so those stay at the top level of the script; every
+    evasion after them is isolated (isolate_evasion), as if it ran in a
+    script of its own. playwright_stealth is only imported here, since its
+    import alone takes a few hundred ms.
+    """
+    from playwright_stealth import StealthConfig
+    from playwright_stealth.stealth import SCRIPTS
+    # The browser keeps its own languages, vendor and user agent
+    config = StealthConfig(
+        navigator_languages=False,
+        navigator_vendor=False,
+        navigator_user_agent=False
+    )
+    shared = (SCRIPTS['utils'], SCRIPTS['generate_magic_arrays'])
+    return ';\n'.join(
+        script if script in shared or script.startswith('const opts') else isolate_evasion(script)
+        for script in config.enabled_scripts)
+
+
+def setup_context(context: BrowserContext, network_policy: Optional[NetworkPolicy] = None,
+                  cookies: Optional[list[dict]] = None) -> BrowserContext:
+    """
+    Configure stealth, timeout, cookies and request routing once for every page of a context
+
+    Pages opened later (new tabs, popups) inherit all of it, pages already open
+    get the stealth script from their next navigation on. The asset cache is
+    routed before the network policy, so the policy sees every request first.
+
+    Args:
+        cookies: Cookies to add, e.g. set_cookies.business_cookies(...)
+    """
+    with timed('setup_context'):
+        if context not in _configured:
+            _configured.add(context)
+            context.add_init_script(stealth_script())
+            context.set_default_timeout(DEFAULT_TIMEOUT)
+            if asset_cache := get_asset_cache():
+                asset_cache.apply(context)
+        if cookies:
+            context.add_cookies(cookies)
+        if network_policy:
+            network_policy.apply(context)
+    return context
+
+
+async def setup_context_async(context: AsyncBrowserContext, network_policy: Optional[NetworkPolicy] = None,
+                              cookies: Optional[list[dict]] = None) -> AsyncBrowserContext:
+    """Async counterpart of setup_context"""
+    with timed('setup_context'):
+        if context not in _configured:
+            _configured.add(context)
+            await context.add_init_script(stealth_script())
+            context.set_default_timeout(DEFAULT_TIMEOUT)
+            if asset_cache := get_asset_cache():
+                await asset_cache.apply_async(context)
+        if cookies:
+            await context.add_cookies(cookies)
+        if network_policy:
+            await network_policy.apply_async(context)
+    return context
+
+
+def new_bot_context(browser: Browser, storage_state: Optional[str] = None,
+                    network_policy: Optional[NetworkPolicy] = None,
+                    cookies: Optional[list[dict]] = None, **options) -> BrowserContext:
+    """
+    Open a context configured for the bot, see setup_context
+
+    Args:
+        storage_state: Cached session to start from (session_cache.SessionCache.load)
+        options: Other Browser.new_context options, e.g. viewport
+    """
+    context = browser.new_context(storage_state=storage_state, locale=BROWSER_LOCALE, **options)
+    return setup_context(context, network_policy, cookies)
+
+
+async def new_bot_context_async(browser: AsyncBrowser, storage_state: Optional[str] = None,
+                                network_policy: Optional[NetworkPolicy] = None,
+                                cookies: Optional[list[dict]] = None, **options) -> AsyncBrowserContext:
+    """Async counterpart of new_bot_context"""
+    context = await browser.new_context(storage_state=storage_state, locale=BROWSER_LOCALE, **options)
+    return await setup_context_async(context, network_policy, cookies)
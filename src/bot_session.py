@@ -0,0 +1,131 @@
+from typing import Optional
+
+from playwright.sync_api import Browser, BrowserContext, Error
+from playwright.async_api import Browser as AsyncBrowser, BrowserContext as AsyncBrowserContext
+from outreach_bot import OutreachMessageBot
+from async_outreach_bot import AsyncOutreachMessageBot
+from creator_index import CreatorIndex
+from sent_ledger import SentLedger
+from network_policy import NetworkPolicy
+from bot_context import new_bot_context, new_bot_context_async
+from lifecycle import ContextRecycler
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def session_key(job: dict, storage_state: Optional[str] = None) -> str:
+    """Identity of the seller session a job runs in: its account when cached, else its session cookie"""
+    if storage_state:
+        return f"account:{job['account']}"
+    return f"cookie:{job['sessionid_cookie']}"
+
+
+def keep_context(result: dict) -> bool:
+    """Whether a job left its context fit for the next one, a failed job's tabs are not trusted"""
+    return bool(result.get('success') or result.get('not_found') or result.get('ambiguous'))
+
+
+class BotSession:
+    """
+    A context and bot kept open across consecutive jobs of the same seller session
+
+    The bot's IM tab stays on the last conversation, so the next creator of the
+    shop is opened inside the IM app instead of loading the page again
+    (OutreachMessageBot.switch_conversation). The context is replaced when the
+    session changes, after a failed job and when ContextRecycler says so.
+    """
+
+    def __init__(self, browser: Browser, network_policy: Optional[NetworkPolicy] = None,
+                 recycler: Optional[ContextRecycler] = None):
+        self.browser = browser
+        self.network_policy = network_policy
+        self.recycler = recycler or ContextRecycler()
+        self.key = None
+        self.context: Optional[BrowserContext] = None
+        self.bot: Optional[OutreachMessageBot] = None
+
+    def bot_for(self, key: str, storage_state: Optional[str] = None, cookies: Optional[list[dict]] = None,
+                creator_index: Optional[CreatorIndex] = None,
+                ledger: Optional[SentLedger] = None) -> OutreachMessageBot:
+        """
+        Bot of the open context if it runs the session `key`, else of a new context
+
+        Args:
+            key: session_key of the job
+            storage_state, cookies: Login of a new context, see bot_context.new_bot_context
+        """
+        if self.bot and key != self.key:
+            self.close('another session')
+        elif self.bot and self.bot.page.is_closed():
+            self.close('its tab was closed')
+        if not self.bot:
+            self.context = new_bot_context(self.browser, storage_state, self.network_policy, cookies)
+            self.bot = OutreachMessageBot(self.context.new_page(), creator_index, ledger=ledger)
+            self.key = key
+        return self.bot
+
+    def job_done(self, result: dict) -> None:
+        """Keep the context for the next job, or close it"""
+        if not self.context:
+            return
+        reason = self.recycler.job_done() if keep_context(result) else f"{result.get('phase')} failed"
+        if reason:
+            self.close(reason)
+
+    def close(self, reason: Optional[str] = None) -> None:
+        if self.context:
+            if reason:
+                logger.info(f'Replacing the reused browser context: {reason}')
+                self.recycler.reset()
+            try:
+                self.context.close()
+            except Error as e:
+                logger.warning(f'Could not close the reused browser context: {e}')
+        self.key = self.context = self.bot = None
+
+
+class AsyncBotSession:
+    """Async counterpart of BotSession, for one job at a time"""
+
+    def __init__(self, browser: AsyncBrowser, network_policy: Optional[NetworkPolicy] = None,
+                 recycler: Optional[ContextRecycler] = None):
+        self.browser = browser
+        self.network_policy = network_policy
+        self.recycler = recycler or ContextRecycler()
+        self.key = None
+        self.context: Optional[AsyncBrowserContext] = None
+        self.bot: Optional[AsyncOutreachMessageBot] = None
+
+    async def bot_for(self, key: str, storage_state: Optional[str] = None, cookies: Optional[list[dict]] = None,
+                      creator_index: Optional[CreatorIndex] = None,
+                      ledger: Optional[SentLedger] = None) -> AsyncOutreachMessageBot:
+        """Async counterpart of BotSession.bot_for"""
+        if self.bot and key != self.key:
+            await self.close('another session')
+        elif self.bot and self.bot.page.is_closed():
+            await self.close('its tab was closed')
+        if not self.bot:
+            self.context = await new_bot_context_async(self.browser, storage_state, self.network_policy, cookies)
+            self.bot = AsyncOutreachMessageBot(await self.context.new_page(), creator_index, ledger=ledger)
+            self.key = key
+        return self.bot
+
+    async def job_done(self, result: dict) -> None:
+        """Keep the context for the next job, or close it"""
+        if not self.context:
+            return
+        reason = self.recycler.job_done() if keep_context(result) else f"{result.get('phase')} failed"
+        if reason:
+            await self.close(reason)
+
+    async def close(self, reason: Optional[str] = None) -> None:
+        if self.context:
+            if reason:
+                logger.info(f'Replacing the reused browser context: {reason}')
+                self.recycler.reset()
+            try:
+                await self.context.close()
+            except Error as e:
+                logger.warning(f'Could not close the reused browser context: {e}')
+        self.key = self.context = self.bot = None
@@ -0,0 +1,353 @@
+import base64
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from os import getenv
+from typing import Callable, Optional
+
+from metrics import registry, CAPTCHA_SOLVE_DURATION
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+CAPTCHA_CACHE_FILE = getenv('CAPTCHA_CACHE_FILE', 'captcha_cache.db')
+# Solutions kept, the least recently used ones are evicted past it; 0 disables the cache
+CAPTCHA_CACHE_SIZE = int(getenv('CAPTCHA_CACHE_SIZE', '5000'))
+# Directory the images of the captchas sent to the API are saved to, to build fixtures from
+CAPTCHA_FIXTURE_DIR = getenv('CAPTCHA_FIXTURE_DIR')
+
+# Side of the difference hash grid, 16 gives 256 bits: re-encoded or resized copies of an
+# image hash the same, puzzles whose gap is somewhere else don't
+HASH_SIZE = 16
+# Bits two perceptual hashes may differ by and still be the same image: lossy re-encoding
+# flips a bit or two where neighbouring pixels are almost equal, a puzzle gap moved by a few
+# pixels flips more
+CAPTCHA_HASH_TOLERANCE = int(getenv('CAPTCHA_HASH_TOLERANCE', '2'))
+# Solution model of each solver API call, in tiktok_captcha_solver.models
+SOLUTION_MODELS = {
+    'shapes': 'ShapesCaptchaResponse',
+    'rotate': 'RotateCaptchaResponse',
+    'puzzle': 'PuzzleCaptchaResponse',
+    'icon': 'IconCaptchaResponse',
+}
+IMAGE_EXTENSIONS = {b'\x89PNG': 'png', b'\xff\xd8\xff': 'jpg', b'RIFF': 'webp'}
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def image_hash(data: bytes) -> str:
+    """
+    Fingerprint of a captcha image
+
+    A perceptual (difference) hash with Pillow, so the same puzzle served again
+    in another encoding still matches. Without Pillow, or for an image Pillow
+    can't read, a sha256 of the bytes: only identical files match.
+    """
+    if Image is not None:
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                pixels = list(image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS).getdata())
+        except (OSError, ValueError):
+            pass
+        else:
+            bits = 0
+            for row in range(HASH_SIZE):
+                for column in range(HASH_SIZE):
+                    index = row * (HASH_SIZE + 1) + column
+                    bits = bits << 1 | (pixels[index] > pixels[index + 1])
+            return f'dhash:{bits:0{HASH_SIZE * HASH_SIZE // 4}x}'
+    return f'sha256:{hashlib.sha256(data).hexdigest()}'
+
+
+def solution_key(kind: str, images_b64: tuple, challenge: Optional[str] = None) -> str:
+    """Cache key of a captcha: its type, challenge text and the fingerprint of each of its images"""
+    hashes = [image_hash(base64.b64decode(image)) for image in images_b64]
+    return '|'.join([kind, challenge or '', *hashes])
+
+
+def key_distance(key: str, other: str) -> Optional[int]:
+    """
+    Largest number of bits an image fingerprint of `key` differs by from `other`'s
+
+    Returns:
+        Optional[int]: None if the keys are of another type, challenge or number of
+        images, or if a sha256 fingerprint differs
+    """
+    parts, other_parts = key.split('|'), other.split('|')
+    if len(parts) != len(other_parts) or parts[:2] != other_parts[:2]:
+        return None
+    distance = 0
+    for fingerprint, other_fingerprint in zip(parts[2:], other_parts[2:]):
+        if fingerprint.startswith('dhash:') and other_fingerprint.startswith('dhash:'):
+            bits = int(fingerprint[6:], 16) ^ int(other_fingerprint[6:], 16)
+            distance = max(distance, bin(bits).count('1'))
+        elif fingerprint != other_fingerprint:
+            return None
+    return distance
+
+
+def image_extension(data: bytes) -> str:
+    return next((extension for magic, extension in IMAGE_EXTENSIONS.items() if data.startswith(magic)), 'bin')
+
+
+class CaptchaCache:
+    """
+    Persistent captcha fingerprint -> accepted solution store, shared by every run on this machine
+
+    A solution from the API is stored unconfirmed, and only served once the
+    captcha it answered went away (confirm). A served solution that fails is
+    dropped (reject), so a wrong answer is never replayed.
+    """
+
+    def __init__(self, db_file: str = CAPTCHA_CACHE_FILE, max_size: int = CAPTCHA_CACHE_SIZE,
+                 tolerance: int = CAPTCHA_HASH_TOLERANCE):
+        """
+        Open (and create if needed) the cache database
+
+        Args:
+            db_file: Path of the SQLite database
+            max_size: Solutions kept, the least recently used are evicted past it
+            tolerance: Bits a perceptual fingerprint may differ by from a stored one, 0 for exact matches only
+        """
+        self.db_file = db_file
+        self.max_size = max_size
+        self.tolerance = tolerance
+        self.counts = Counter()  # hits, misses, confirmed, rejected, evicted, of this process
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            db_file, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS captcha_solutions (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                solution TEXT NOT NULL,
+                confirmed INTEGER NOT NULL DEFAULT 0,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS captcha_solutions_used_at ON captcha_solutions (used_at)')
+        self.connection.commit()
+
+    def lookup(self, key: str) -> Optional[tuple[str, str]]:
+        """
+        Confirmed solution of a captcha, counting a hit or a miss
+
+        Returns:
+            Optional[tuple[str, str]]: Key the solution is stored under, which is `key` or
+            one within the tolerance, and the solution (JSON)
+        """
+        with self._lock, self.connection:
+            row = self.connection.execute(
+                'SELECT key, solution FROM captcha_solutions WHERE key = ? AND confirmed = 1', (key,)).fetchone()
+            if not row and self.tolerance > 0 and 'dhash:' in key:
+                row = self._nearest(key)
+            if row:
+                self.connection.execute(
+                    'UPDATE captcha_solutions SET hits = hits + 1, used_at = ? WHERE key = ?', (time.time(), row[0]))
+            self.counts['hits' if row else 'misses'] += 1
+        return (row[0], row[1]) if row else None
+
+    def _nearest(self, key: str) -> Optional[tuple[str, str]]:
+        """Confirmed solution whose fingerprints are the closest to `key`'s, within the tolerance"""
+        best = None
+        for stored, solution in self.connection.execute(
+                'SELECT key, solution FROM captcha_solutions WHERE kind = ? AND confirmed = 1', (key.split('|')[0],)):
+            distance = key_distance(key, stored)
+            if distance is not None and distance <= self.tolerance and (best is None or distance < best[0]):
+                best = (distance, stored, solution)
+        return best[1:] if best else None
+
+    def put(self, key: str, kind: str, solution: str) -> None:
+        """Store a solution from the API, unconfirmed until confirm, evicting past max_size"""
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO captcha_solutions (key, kind, solution, confirmed, hits, created_at, used_at) '
+                'VALUES (?, ?, ?, 0, 0, ?, ?)', (key, kind, solution, now, now))
+            excess = self.connection.execute('SELECT COUNT(*) FROM captcha_solutions').fetchone()[0] - self.max_size
+            if excess > 0:
+                self.connection.execute(
+                    'DELETE FROM captcha_solutions WHERE key IN '
+                    '(SELECT key FROM captcha_solutions ORDER BY used_at LIMIT ?)', (excess,))
+                self.counts['evicted'] += excess
+
+    def confirm(self, key: str) -> None:
+        """The solution made its captcha go away"""
+        with self._lock, self.connection:
+            self.connection.execute('UPDATE captcha_solutions SET confirmed = 1 WHERE key = ?', (key,))
+            self.counts['confirmed'] += 1
+
+    def reject(self, key: str) -> None:
+        """The solution didn't solve its captcha"""
+        with self._lock, self.connection:
+            self.connection.execute('DELETE FROM captcha_solutions WHERE key = ?', (key,))
+            self.counts['rejected'] += 1
+
+    def stats(self) -> dict:
+        """Counters of this process, and the solutions stored"""
+        with self._lock:
+            stored, confirmed = self.connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(confirmed), 0) FROM captcha_solutions').fetchone()
+            counts = dict(self.counts)
+        lookups = counts.get('hits', 0) + counts.get('misses', 0)
+        return {
+            **counts,
+            'hit_rate': round(counts.get('hits', 0) / lookups, 3) if lookups else None,
+            'stored': stored,
+            'stored_confirmed': confirmed,
+        }
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class CachingClient:
+    """
+    Stands in for a solver's tiktok_captcha_solver ApiClient, answering repeated captchas from the cache
+
+    Keeps the keys of the solutions it handed to the solver; finish() then
+    confirms the one that solved the captcha and rejects the others.
+    """
+
+    def __init__(self, client, cache: CaptchaCache, fixture_dir: Optional[str] = CAPTCHA_FIXTURE_DIR):
+        """
+        Args:
+            client: The solver's ApiClient, called on cache misses
+            fixture_dir: Directory to save the images of cache misses to, None to not save them
+        """
+        self.client = client
+        self.cache = cache
+        self.fixture_dir = fixture_dir
+        self.served = []
+
+    def rotate(self, outer_b64: str, inner_b64: str):
+        return self._solve('rotate', (outer_b64, inner_b64), None, lambda: self.client.rotate(outer_b64, inner_b64))
+
+    def puzzle(self, puzzle_b64: str, piece_b64: str):
+        return self._solve('puzzle', (puzzle_b64, piece_b64), None, lambda: self.client.puzzle(puzzle_b64, piece_b64))
+
+    def shapes(self, image_b64: str):
+        return self._solve('shapes', (image_b64,), None, lambda: self.client.shapes(image_b64))
+
+    def icon(self, challenge_text: str, image_b64: str):
+        return self._solve('icon', (image_b64,), challenge_text, lambda: self.client.icon(challenge_text, image_b64))
+
+    def finish(self, solved: bool) -> None:
+        """Confirm the last solution if the captcha is gone, reject the ones that didn't solve it"""
+        final = self.served[-1] if solved and self.served else None
+        for key in dict.fromkeys(self.served):
+            if key != final:
+                self.cache.reject(key)
+        if final:
+            self.cache.confirm(final)
+        self.served = []
+
+    def _solve(self, kind: str, images_b64: tuple, challenge: Optional[str], call: Callable):
+        from tiktok_captcha_solver import models
+        model = getattr(models, SOLUTION_MODELS[kind])
+        started = time.perf_counter()
+        key = solution_key(kind, images_b64, challenge)
+        cached = self.cache.lookup(key)
+        if cached is not None:
+            # finish() confirms or rejects the stored solution, not the key of this image
+            key, cached_solution = cached
+            solution, source = model.model_validate_json(cached_solution), 'cache'
+        else:
+            solution, source = call(), 'api'
+            self.cache.put(key, kind, solution.model_dump_json())
+            if self.fixture_dir:
+                self._save_fixture(kind, images_b64)
+        elapsed = time.perf_counter() - started
+        registry.observe(CAPTCHA_SOLVE_DURATION, elapsed, kind=kind, source=source)
+        logger.info(f'{kind} captcha answered from the {source} in {elapsed:.2f}s')
+        self.served.append(key)
+        return solution
+
+    def _save_fixture(self, kind: str, images_b64: tuple) -> None:
+        try:
+            os.makedirs(self.fixture_dir, exist_ok=True)
+            name = f'{kind}-{int(time.time() * 1000)}'
+            for index, image_b64 in enumerate(images_b64):
+                data = base64.b64decode(image_b64)
+                with open(os.path.join(self.fixture_dir, f'{name}-{index}.{image_extension(data)}'), 'wb') as f:
+                    f.write(data)
+        except OSError as e:
+            logger.warning(f'Could not save the captcha fixture: {e}')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_captcha_cache() -> Optional[CaptchaCache]:
+    """Process-wide captcha cache, created on first use; None when CAPTCHA_CACHE_SIZE is 0"""
+    global _cache
+    if CAPTCHA_CACHE_SIZE <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CaptchaCache()
+        return _cache
+
+
+def fingerprint_fixtures(fixture_dir: str, tolerance: int = CAPTCHA_HASH_TOLERANCE) -> dict:
+    """
+    Fingerprint every image of a directory of saved captchas
+
+    Args:
+        tolerance: Bits a fingerprint may differ by from its group's, as in CaptchaCache
+
+    Returns:
+        dict: fingerprint of the group's first file -> file names, a group of several
+        files is an image served again
+    """
+    groups = {}
+    for name in sorted(os.listdir(fixture_dir)):
+        path = os.path.join(fixture_dir, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                fingerprint = image_hash(f.read())
+            distances = {known: key_distance(f'||{fingerprint}', f'||{known}') for known in groups}
+            group = next((known for known, distance in distances.items()
+                          if distance is not None and distance <= tolerance), fingerprint)
+            groups.setdefault(group, []).append(name)
+    return groups
+
+
+if __name__ == "__main__":
+    """_summary_ Check the captcha fingerprints on saved captcha images, or show the cache's content.
+    Args:
+        fixtures (str): Directory of captcha images, e.g. saved with CAPTCHA_FIXTURE_DIR
+        stats (bool): Print the solutions stored in CAPTCHA_CACHE_FILE
+
+    Usage example: python captcha_cache.py --fixtures captcha-fixtures
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Fingerprint saved captcha images, or show the captcha cache.')
+    parser.add_argument('--fixtures', default=None,
+                        help='Directory of captcha images')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print the solutions stored in the cache')
+    args = parser.parse_args()
+    print(f"Fingerprints: {'perceptual (Pillow)' if Image is not None else 'sha256 (Pillow not installed)'}")
+    if args.fixtures:
+        groups = fingerprint_fixtures(args.fixtures)
+        images = sum(len(names) for names in groups.values())
+        print(f'{images} images, {len(groups)} distinct, {images - len(groups)} repeats')
+        for fingerprint, names in groups.items():
+            if len(names) > 1:
+                print(f"    {', '.join(names)}")
+    if args.stats:
+        print(CaptchaCache().stats())
@@ -0,0 +1,132 @@
+from functools import partial
+from os import getenv
+from typing import Callable, Optional
+from weakref import WeakSet
+
+from playwright.sync_api import Page, Response, Error
+from playwright.async_api import Page as AsyncPage
+from solve_captcha import main as solve_captcha, main_async as solve_captcha_async, CAPTCHA_SELECTOR
+from metrics import timed
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Request the captcha widget makes to fetch a challenge (verification-*.tiktok.com/captcha/get)
+CAPTCHA_URL_MARKERS = ('/captcha/get',)
+# How long a captcha announced by the network gets to show up before it is dismissed as not shown
+CAPTCHA_RENDER_TIMEOUT = float(getenv('CAPTCHA_RENDER_TIMEOUT', '3000'))  # ms
+
+
+class CaptchaWatcher:
+    """
+    Solves captchas as soon as they get in the bot's way
+
+    A locator handler on the captcha containers pauses whatever action the bot
+    is performing when a captcha covers the page, solves it, and lets the
+    action resume, so an attempt is not thrown away. Captcha network calls are
+    tracked as well, so a challenge that is still rendering can be solved at
+    the next phase boundary with solve_pending.
+    """
+
+    def __init__(self, solve: Callable = solve_captcha, solve_async: Callable = solve_captcha_async):
+        """
+        Args:
+            solve: Solves a captcha on a sync page, solve_captcha.main by default
+            solve_async: Solves a captcha on an async page, solve_captcha.main_async by default
+        """
+        self.solve = solve
+        self.solve_async = solve_async
+        self.detected = 0
+        self.pending = False
+        self._pages = WeakSet()
+
+    def attach(self, page: Page) -> None:
+        """Watch a page for captchas, once per page"""
+        if page in self._pages:
+            return
+        self._pages.add(page)
+        page.add_locator_handler(
+            page.locator(CAPTCHA_SELECTOR).first, partial(self._on_captcha, page))
+        page.on('response', self._on_response)
+
+    def solve_pending(self, page: Page) -> bool:
+        """
+        Solve a captcha that is visible, without waiting for one
+
+        A captcha announced by the network gets CAPTCHA_RENDER_TIMEOUT to show
+        up; the challenge fetch alone is not solved nor counted, since the
+        widget may have passed it without showing anything.
+        """
+        captcha = page.locator(CAPTCHA_SELECTOR).first
+        try:
+            if self.pending:
+                captcha.wait_for(state='visible', timeout=CAPTCHA_RENDER_TIMEOUT)
+            elif not captcha.is_visible():
+                return False
+        except Error:
+            self.pending = False
+            return False
+        self._on_captcha(page)
+        return True
+
+    def wait_and_solve(self, page: Page, done_selector: Optional[str] = None, timeout: float = 10000) -> bool:
+        """
+        Wait until either a captcha shows up or the page moves on, and solve the captcha if there is one
+
+        Args:
+            done_selector: CSS selector whose appearance means no captcha is coming
+            timeout: Maximum wait in milliseconds
+        """
+        try:
+            page.wait_for_function(
+                """([captcha, done, url]) =>
+                    document.querySelector(captcha) ||
+                    (done && document.querySelector(done)) ||
+                    location.href !== url""",
+                arg=[CAPTCHA_SELECTOR, done_selector, page.url],
+                timeout=timeout)
+        except Error:
+            # timed out, or the page navigated away while waiting
+            pass
+        return self.solve_pending(page)
+
+    def _on_captcha(self, page: Page) -> None:
+        self.detected += 1
+        self.pending = False
+        logger.info('Captcha detected, pausing to solve it')
+        with timed('captcha_solve'):
+            self.solve(page)
+
+    def _on_response(self, response: Response) -> None:
+        if any(marker in response.url for marker in CAPTCHA_URL_MARKERS):
+            self.pending = True
+
+    async def attach_async(self, page: AsyncPage) -> None:
+        """Async counterpart of attach"""
+        if page in self._pages:
+            return
+        self._pages.add(page)
+        await page.add_locator_handler(
+            page.locator(CAPTCHA_SELECTOR).first, partial(self._on_captcha_async, page))
+        page.on('response', self._on_response)
+
+    async def solve_pending_async(self, page: AsyncPage) -> bool:
+        """Async counterpart of solve_pending"""
+        captcha = page.locator(CAPTCHA_SELECTOR).first
+        try:
+            if self.pending:
+                await captcha.wait_for(state='visible', timeout=CAPTCHA_RENDER_TIMEOUT)
+            elif not await captcha.is_visible():
+                return False
+        except Error:
+            self.pending = False
+            return False
+        await self._on_captcha_async(page)
+        return True
+
+    async def _on_captcha_async(self, page: AsyncPage) -> None:
+        self.detected += 1
+        self.pending = False
+        logger.info('Captcha detected, pausing to solve it')
+        with timed('captcha_solve'):
+            await self.solve_async(page)
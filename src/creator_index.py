@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+import time
+from os import getenv
+from typing import Optional
+from urllib.parse import urlparse, parse_qs, urlencode
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Origin of the affiliate seller center, overridden to point the bot at a local mock (see benchmark.py)
+SELLER_CENTER_URL = getenv('SELLER_CENTER_URL', 'https://affiliate-us.tiktok.com').rstrip('/')
+IM_URL = f'{SELLER_CENTER_URL}/seller/im'
+CREATOR_INDEX_FILE = getenv('CREATOR_INDEX_FILE', 'creator_index.db')
+
+
+def normalize_handle(handle: str) -> str:
+    """Key of a creator handle in the stores: '@Name ' and 'name' are the same creator"""
+    return handle.strip().lstrip('@').lower()
+
+
+def parse_im_url(url: str) -> Optional[tuple[str, str]]:
+    """
+    Extract the conversation IDs from a seller IM url
+
+    Args:
+        url (str): URL of the IM tab, e.g. .../seller/im?shop_id=1&creator_id=2&...
+
+    Returns:
+        tuple[str, str]: (shop_id, creator_id), or None if the url is not an IM conversation
+    """
+    parsed = urlparse(url)
+    if not parsed.path.endswith('/seller/im'):
+        return None
+    query = parse_qs(parsed.query)
+    shop_id = query.get('shop_id', [None])[0]
+    creator_id = query.get('creator_id', [None])[0]
+    if not shop_id or not creator_id:
+        return None
+    return shop_id, creator_id
+
+
+def build_im_url(shop_id: str, creator_id: str) -> str:
+    """Build the seller IM url of the conversation with a creator"""
+    return f"{IM_URL}?" + urlencode({
+        'shop_id': shop_id,
+        'creator_id': creator_id,
+        'enter_from': 'affiliate_creator_details',
+        'shop_region': 'US',
+    })
+
+
+class CreatorIndex:
+    """
+    Persistent creator handle -> (shop_id, creator_id) lookup, so repeat creators skip the search
+
+    Entries are scoped by the seller account (or the shop when the job has no
+    account): a creator's conversation ids belong to the shop that found them,
+    another account's job must not open that shop's IM page.
+    """
+
+    def __init__(self, db_file: str = CREATOR_INDEX_FILE):
+        """
+        Open (and create if needed) the index database
+
+        Args:
+            db_file: Path of the SQLite database, shared by every run on this machine
+        """
+        self.db_file = db_file
+        # the connection is shared by the threads of a worker process
+        self._lock = threading.Lock()
+        # timeout lets concurrent runs wait on each other's writes instead of failing
+        self.connection = sqlite3.connect(
+            db_file, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(creators)')}
+        if columns and 'scope' not in columns:
+            # entries of an unscoped index can't be told apart by account, the next searches index them again
+            logger.info('Dropping the creator index entries recorded without their account')
+            self.connection.execute('DROP TABLE creators')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS creators (
+                scope TEXT NOT NULL,
+                creator TEXT NOT NULL,
+                shop_id TEXT NOT NULL,
+                creator_id TEXT NOT NULL,
+                resolved_at REAL NOT NULL,
+                PRIMARY KEY (scope, creator)
+            )
+        """)
+        self.connection.commit()
+
+    def get(self, scope: str, creator: str) -> Optional[tuple[str, str]]:
+        """
+        Return the (shop_id, creator_id) recorded for a creator handle, if any
+
+        Args:
+            scope: Account (or shop_id) the creator was indexed for
+        """
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT shop_id, creator_id FROM creators WHERE scope = ? AND creator = ?',
+                (scope, normalize_handle(creator))).fetchone()
+        return tuple(row) if row else None
+
+    def record(self, scope: str, creator: str, shop_id: str, creator_id: str) -> None:
+        """Store or refresh the IDs of a creator"""
+        with self._lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO creators (scope, creator, shop_id, creator_id, resolved_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (scope, normalize_handle(creator), shop_id, creator_id, time.time()))
+
+    def record_im_url(self, scope: str, creator: str, url: str) -> bool:
+        """
+        Store the IDs found in the url of the creator's IM tab
+
+        Returns:
+            bool: False if the url did not contain the conversation IDs
+        """
+        ids = parse_im_url(url)
+        if not ids:
+            logger.warning(
+                f"Could not index creator '{creator}', unexpected IM url: {url}")
+            return False
+        self.record(scope, creator, *ids)
+        logger.info(f"Indexed creator '{creator}': shop_id={
+                    ids[0]}, creator_id={ids[1]}")
+        return True
+
+    def invalidate(self, scope: str, creator: str) -> None:
+        """Forget a creator whose recorded IM url no longer works"""
+        with self._lock, self.connection:
+            self.connection.execute(
+                'DELETE FROM creators WHERE scope = ? AND creator = ?', (scope, normalize_handle(creator)))
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
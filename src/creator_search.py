@@ -0,0 +1,134 @@
+import fnmatch
+from os import getenv
+from typing import Any, Iterator, Optional
+from urllib.parse import urlencode
+
+from creator_index import SELLER_CENTER_URL, normalize_handle
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Request the "Find creators" search box sends; the table is rendered from its JSON response
+CREATOR_SEARCH_API_PATTERN = getenv(
+    'CREATOR_SEARCH_API_PATTERN', '*/api/v1/oec/affiliate/creator/marketplace/find*')
+CREATOR_DETAIL_URL = f'{SELLER_CENTER_URL}/connection/creator/detail'
+
+# Keys the creator entries of the response use for the handle and the creator id.
+# Values are either plain or wrapped as {"value": ...}.
+HANDLE_KEYS = ('handle', 'unique_id', 'user_name', 'username')
+ID_KEYS = ('creator_oecuid', 'creator_id', 'oec_uid', 'cid')
+
+# Searches in a row whose response was not captured before a bot gives up interception,
+# e.g. when the site moved the endpoint away from CREATOR_SEARCH_API_PATTERN
+MAX_CONSECUTIVE_MISSES = 3
+
+RESOLVED = 'resolved'
+NOT_FOUND = 'not_found'
+AMBIGUOUS = 'ambiguous'
+
+
+class Resolution:
+    def __init__(self, handle: str, status: str, creator_id: Optional[str] = None, candidates: int = 0):
+        """
+        Outcome of matching a handle against a creator search response
+
+        Args:
+            status: RESOLVED, NOT_FOUND or AMBIGUOUS (several creator ids share the handle)
+            creator_id: Id of the creator when resolved
+            candidates: Number of creators the search returned
+        """
+        self.handle = handle
+        self.status = status
+        self.creator_id = creator_id
+        self.candidates = candidates
+
+    def __repr__(self) -> str:
+        return f'Resolution({self.handle!r}, {self.status}, creator_id={self.creator_id!r})'
+
+
+class SearchInterception:
+    """Whether a bot still waits for the creator search response, each bot of a session keeps its own"""
+
+    def __init__(self):
+        self.consecutive_misses = 0
+
+    def enabled(self) -> bool:
+        return self.consecutive_misses < MAX_CONSECUTIVE_MISSES
+
+    def record(self, captured: bool) -> None:
+        """Count searches whose response was (not) captured, see MAX_CONSECUTIVE_MISSES"""
+        self.consecutive_misses = 0 if captured else self.consecutive_misses + 1
+        if self.consecutive_misses == MAX_CONSECUTIVE_MISSES:
+            logger.warning(f'No response matched {CREATOR_SEARCH_API_PATTERN} in {MAX_CONSECUTIVE_MISSES} '
+                           'searches, picking creators from the results table from now on')
+
+
+def is_creator_search_response(response) -> bool:
+    """Predicate for page.expect_response"""
+    return response.request.method in ('GET', 'POST') and fnmatch.fnmatch(response.url, CREATOR_SEARCH_API_PATTERN)
+
+
+def _unwrap(value: Any) -> Any:
+    if isinstance(value, dict):
+        value = value.get('value')
+    return value
+
+
+def _field(entry: dict, keys: tuple) -> Optional[str]:
+    for key in keys:
+        value = _unwrap(entry.get(key))
+        if isinstance(value, (str, int)) and str(value):
+            return str(value)
+    return None
+
+
+def creator_entries(payload: Any) -> Iterator[tuple[str, str]]:
+    """(handle, creator id) of every creator found anywhere in a search response"""
+    if isinstance(payload, dict):
+        handle, creator_id = _field(payload, HANDLE_KEYS), _field(payload, ID_KEYS)
+        if handle and creator_id:
+            yield handle, creator_id
+            return
+        payload = list(payload.values())
+    if isinstance(payload, list):
+        for item in payload:
+            yield from creator_entries(item)
+
+
+def match_creator(payload: Any, handle: str) -> Resolution:
+    """Find the creator with exactly this handle (case-insensitive, without @) in a search response"""
+    entries = list(creator_entries(payload))
+    wanted = normalize_handle(handle)
+    ids = {creator_id for entry_handle, creator_id in entries
+           if normalize_handle(entry_handle) == wanted}
+    if not ids:
+        return Resolution(handle, NOT_FOUND, candidates=len(entries))
+    if len(ids) > 1:
+        return Resolution(handle, AMBIGUOUS, candidates=len(entries))
+    return Resolution(handle, RESOLVED, ids.pop(), len(entries))
+
+
+class CreatorNotFoundError(Exception):
+    """
+    The creator search returned no creator with exactly this handle, or several of them
+
+    Retrying won't tell them apart, and picking one could message the wrong
+    creator. The status of `resolution` is NOT_FOUND or AMBIGUOUS.
+    """
+
+    def __init__(self, resolution: Resolution):
+        if resolution.status == AMBIGUOUS:
+            message = f"Several of the {resolution.candidates} creators the search returned are '{resolution.handle}'"
+        else:
+            message = f"The search returned {resolution.candidates} creators, none of them is '{resolution.handle}'"
+        super().__init__(message)
+        self.resolution = resolution
+
+
+def build_detail_url(creator_id: str) -> str:
+    """Creator details page of a creator id"""
+    return f'{CREATOR_DETAIL_URL}?' + urlencode({
+        'cid': creator_id,
+        'enter_from': 'affiliate_find_creators',
+        'shop_region': 'US',
+    })
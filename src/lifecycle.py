@@ -0,0 +1,110 @@
+import os
+from os import getenv
+from typing import Optional
+
+# A browser context reused for several jobs is replaced by a fresh one once it passes either limit
+MAX_CONTEXT_JOBS = int(getenv('MAX_CONTEXT_JOBS', '50'))
+# Growth of the resident memory since the context's first job
+MAX_CONTEXT_RSS_GROWTH_MB = float(getenv('MAX_CONTEXT_RSS_GROWTH_MB', '500'))
+# Jobs between two memory reads, a read walks /proc
+CONTEXT_RSS_SAMPLE_JOBS = int(getenv('CONTEXT_RSS_SAMPLE_JOBS', '10'))
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def process_tree(pid: int) -> list[int]:
+    """pid and the pids of all its descendants, from /proc (Linux only, [pid] elsewhere)"""
+    children = {}
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return [pid]
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # the command name may contain spaces, the fields after it don't
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, ()))
+    return tree
+
+
+def tree_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """
+    Resident memory of a process and its descendants (the Playwright driver and Chromium) in MB
+
+    Args:
+        pid: Root of the tree, this process by default
+
+    Returns:
+        float: None where /proc is not available
+    """
+    pid = os.getpid() if pid is None else pid
+    total = 0
+    for member in process_tree(pid):
+        try:
+            with open(f'/proc/{member}/statm') as f:
+                total += int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            if member == pid:
+                return None
+    return round(total / 1024 / 1024, 1)
+
+
+class ContextRecycler:
+    """
+    Decides when a browser context reused across jobs should be replaced
+
+    Closed tabs give most of their memory back, but a long-lived context still
+    accumulates cache, service workers and renderer state. Chromium doesn't
+    break its memory down per context, so the memory of this process and its
+    browser is read after the context's first job and then every few jobs: the
+    context is recycled once it grew past the limit. Comparing the whole tree to
+    an absolute limit would recycle a fresh context over and over on a machine
+    where the browser alone is past it.
+    """
+
+    def __init__(self, max_jobs: int = MAX_CONTEXT_JOBS, max_rss_growth_mb: float = MAX_CONTEXT_RSS_GROWTH_MB,
+                 sample_jobs: int = CONTEXT_RSS_SAMPLE_JOBS):
+        """
+        Args:
+            max_jobs: Jobs after which the context is recycled, 0 for no limit
+            max_rss_growth_mb: Growth of the resident memory (MB) since the context's first job past which
+                it is recycled, 0 for no limit
+            sample_jobs: Jobs between two memory reads
+        """
+        self.max_jobs = max_jobs
+        self.max_rss_growth_mb = max_rss_growth_mb
+        self.sample_jobs = max(sample_jobs, 1)
+        self.jobs = 0
+        self.baseline_mb = None  # memory after the context's first job
+        self.recycled = 0
+
+    def job_done(self) -> Optional[str]:
+        """Count a finished job, returning why the context should be recycled now if it should"""
+        self.jobs += 1
+        if self.max_jobs and self.jobs >= self.max_jobs:
+            return f'{self.jobs} jobs'
+        if self.max_rss_growth_mb and (self.baseline_mb is None or self.jobs % self.sample_jobs == 0):
+            rss = tree_rss_mb()
+            if rss is None:
+                return None
+            if self.baseline_mb is None:
+                self.baseline_mb = rss
+            elif rss - self.baseline_mb >= self.max_rss_growth_mb:
+                return f'{rss - self.baseline_mb:.0f}MB more resident memory'
+        return None
+
+    def reset(self) -> None:
+        """The context was replaced"""
+        self.jobs = 0
+        self.baseline_mb = None
+        self.recycled += 1
@@ -1,10 +1,169 @@
+import atexit
+import contextvars
+import json
 import logging
+import os
+import queue
+import threading
+import uuid
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows, appends are not locked across processes there
+    fcntl = None
+
+# text (default) or json, one JSON object per line
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(job)s%(message)s'
+
+# Id of the job being worked on, added to every record logged while it is set
+correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+_queue_handlers = {}  # log file -> QueueHandler shared by every logger writing to it
+_listeners = {}  # log file -> QueueListener writing its records
+_setup_lock = threading.Lock()
+
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+@contextmanager
+def log_context(job_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Tag the records logged inside the block with a correlation id
+
+    Contextvars follow threads and asyncio tasks, so concurrent jobs keep their own id.
+
+    Args:
+        job_id: Id to use, by default the current one is kept or a new one is generated
+    """
+    current = correlation_id.get()
+    if job_id is None and current is not None:
+        yield current
+        return
+    token = correlation_id.set(job_id or new_correlation_id())
+    try:
+        yield correlation_id.get()
+    finally:
+        correlation_id.reset(token)
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamps records with the correlation id of the thread/task logging them"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class RenderingQueueHandler(QueueHandler):
+    """Queues records with their message rendered, leaving formatting to the writer thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        job_id = getattr(record, 'correlation_id', None)
+        record.job = f'[{job_id}] ' if job_id else ''
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+        }
+        if getattr(record, 'correlation_id', None):
+            entry['correlation_id'] = record.correlation_id
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LockedFileHandler(logging.FileHandler):
+    """Appends each record under an exclusive flock, so processes sharing the file don't interleave lines"""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.stream is None:
+            self.stream = self._open()
+        if fcntl is None:
+            super().emit(record)
+            return
+        fcntl.flock(self.stream.fileno(), fcntl.LOCK_EX)
+        try:
+            super().emit(record)  # writes and flushes
+        finally:
+            fcntl.flock(self.stream.fileno(), fcntl.LOCK_UN)
+
+
+def _queue_handler(log_file: str) -> QueueHandler:
+    """Queue handler of a log file, starting its writer thread on first use"""
+    with _setup_lock:
+        if log_file not in _queue_handlers:
+            file_handler = LockedFileHandler(log_file, delay=True)
+            file_handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter(TEXT_FORMAT))
+            queue_handler = RenderingQueueHandler(queue.SimpleQueue())
+            queue_handler.addFilter(CorrelationFilter())
+            listener = QueueListener(queue_handler.queue, file_handler)
+            listener.start()
+            _queue_handlers[log_file] = queue_handler
+            _listeners[log_file] = listener
+        return _queue_handlers[log_file]
+
+
+def stop_logging() -> None:
+    """Write out queued records and stop the writer threads"""
+    with _setup_lock:
+        for listener in _listeners.values():
+            listener.stop()
+        _listeners.clear()
+
+
+def _restart_in_child() -> None:
+    # The writer threads don't survive a fork: give the child its own queues,
+    # writer threads and file descriptions (flock is shared by inherited descriptions)
+    global _setup_lock
+    _setup_lock = threading.Lock()
+    for log_file, listener in _listeners.items():
+        file_handler = listener.handlers[0]
+        if file_handler.stream is not None:
+            file_handler.stream.close()
+            file_handler.stream = None
+        queue_handler = _queue_handlers[log_file]
+        queue_handler.queue = queue.SimpleQueue()
+        listener = QueueListener(queue_handler.queue, file_handler)
+        listener.start()
+        _listeners[log_file] = listener
+
+
+atexit.register(stop_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_in_child)
 
 
 def get_logger(name: str, log_file: str = 'app.log', level: int = logging.DEBUG) -> logging.Logger:
     """
     Get a configured logger instance.
 
+    Records are handed to a queue and written to the log file by a background
+    thread, so logging never blocks the bot on disk I/O.
+
     Args:
         name (str): Name of the logger.
         log_file (str): File to log messages to.
@@ -16,25 +175,10 @@ def get_logger(name: str, log_file: str = 'app.log', level: int = logging.DEBUG)
     logger = logging.getLogger(name)
     logger.setLevel(level)
 
-    # Remove all existing handlers (don't want to print to console)
-    for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
-
-    # Remove all handlers from the root logger to prevent propagation
-    root_logger = logging.getLogger()
-    for handler in root_logger.handlers[:]:
-        root_logger.removeHandler(handler)
-
-    # Create file handler
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(level)
-
-    # Create formatter and add it to the handler
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-
-    # Add the handler to the logger
-    logger.addHandler(file_handler)
+    queue_handler = _queue_handler(log_file)
+    if queue_handler not in logger.handlers:
+        logger.addHandler(queue_handler)
+    # Don't print to console through the root logger
+    logger.propagate = False
 
     return logger
@@ -1,96 +1,111 @@
-from .solve_captcha import main as solve_captcha
-from playwright.sync_api import sync_playwright, Page
-from playwright_stealth import stealth_sync, StealthConfig
-import time
-import logging
-from playwright.sync_api import Page
+from captcha_watcher import CaptchaWatcher
+from playwright.sync_api import sync_playwright, Page, BrowserContext
+from bot_context import new_bot_context, setup_context
+from session_cache import SessionCache
+from typing import Optional
+from logger import get_logger
 
-
-LOGIN_URL = "https://seller-us-accounts.tiktok.com/account/login"
+logger = get_logger(__name__)
 
 
-def setup_page(page: Page) -> None:
-    """Configure stealth settings and timeout"""
-    config = StealthConfig(
-        navigator_languages=False,
-        navigator_vendor=False,
-        navigator_user_agent=False
-    )
-    stealth_sync(page, config)
-    page.set_default_timeout(30000)  # 30 second timeout
+LOGIN_URL = "https://seller-us-accounts.tiktok.com/account/login"
 
 
 def login_to_tiktok(page: Page, email: str, password: str) -> None:
     """Perform login sequence"""
     try:
+        # Solve captchas whenever they block one of the steps below
+        captcha_watcher = CaptchaWatcher()
+        captcha_watcher.attach(page)
+
         # Navigate to login page
         page.goto(LOGIN_URL)
-        logging.info("✓ Navigated to login page")
+        logger.info("✓ Navigated to login page")
 
         # Wait for and click email tab using role
         email_tab = page.get_by_role("tab", name="Email")
         email_tab.click()
-        logging.info("✓ Clicked email tab")
+        logger.info("✓ Clicked email tab")
 
         # Find input fields by type and placeholder text
         email_input = page.get_by_role(
             "textbox", name="Enter your email address")
         email_input.fill(email)
-        logging.info("✓ Entered email")
+        logger.info("✓ Entered email")
 
         password_input = page.get_by_role(
             "textbox", name="Enter your password")
         password_input.fill(password)
-        logging.info("✓ Entered password")
+        logger.info("✓ Entered password")
 
         # Click login button by role
         login_button = page.get_by_role("button", name="Log in", exact=True)
         login_button.click()
-        logging.info("✓ Clicked login button")
+        logger.info("✓ Clicked login button")
 
-        # Wait a moment for captcha to appear and solve if present
-        time.sleep(2)  # Give time for captcha to appear
-        solve_captcha(Page)
-        logging.info("✓ Handled potential captcha")
+        # Return as soon as a captcha appears (and solve it) or the login page is left
+        captcha_watcher.wait_and_solve(page)
+        logger.info("✓ Handled potential captcha")
 
         # Wait for navigation after successful login
         page.wait_for_load_state('networkidle')
-        logging.info("✓ Login sequence completed")
+        logger.info("✓ Login sequence completed")
 
         # TODO: Get auth code from email and fill it in
-        # TODO: Save and return cookies
 
     except Exception as e:
-        logging.info(f"✗ Error during login: {str(e)}")
+        logger.error(f"✗ Error during login: {str(e)}")
         raise
 
 
-def main(email: str, password: str):
+def refresh_session(context: BrowserContext, email: str, password: str,
+                    session_cache: Optional[SessionCache] = None) -> Optional[str]:
+    """Log in within an existing context and cache its storage state
+
+    The context's cookies are updated in place, so pages of the context can
+    carry on with the new session.
+
+    Returns:
+        str: Path of the cached storage state, or None if no session was obtained
+    """
+    page = setup_context(context).new_page()
+    try:
+        login_to_tiktok(page, email, password)
+        return (session_cache or SessionCache()).save(email, context.storage_state())
+    finally:
+        page.close()
+
+
+def main(email: str, password: str) -> Optional[str]:
+    """Log in and cache the account's storage state
+
+    Returns:
+        str: Path of the cached storage state, or None if login failed
+    """
     playwright = sync_playwright().start()
     browser = playwright.chromium.launch(
         # headless=False,  # Show the browser
         # slow_mo=100,     # Slow down actions for debugging
     )
 
-    context = browser.new_context(viewport={'width': 1280, 'height': 800})
-
-    page = context.new_page()
-    setup_page(page)
+    context = new_bot_context(browser, viewport={'width': 1280, 'height': 800})
 
     try:
-        login_to_tiktok(page, email, password)
+        session_path = refresh_session(context, email, password)
 
         # Keep the browser open for inspection
         # input("Press Enter to close the browser...")
+        return session_path
     except Exception as e:
-        logging.info(f"Fatal error: {str(e)}")
+        logger.error(f"Fatal error: {str(e)}")
+        return None
     finally:
         browser.close()
         playwright.stop()
 
 
 if __name__ == "__main__":
-    """_summary_ Login to TikTok seller center and fetch cookies.
+    """_summary_ Login to TikTok seller center and cache the session's storage state for send_message.py.
     Args:
         email (str): Seller center email
         password (str): Seller center password
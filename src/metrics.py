@@ -0,0 +1,167 @@
+import json
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from os import getenv
+from typing import Iterator, Optional
+
+# Share of jobs sent to Sentry as a transaction with one span per step, 0 disables it
+METRICS_SENTRY_SAMPLE_RATE = float(getenv('METRICS_SENTRY_SAMPLE_RATE', '0'))
+# Upper bounds (seconds) of the histogram buckets
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120)
+# Recent observations kept per series to compute percentiles from
+MAX_SAMPLES = 1024
+
+STEP_DURATION = 'outreach_step_duration_seconds'
+JOB_DURATION = 'outreach_job_duration_seconds'
+CAPTCHA_SOLVE_DURATION = 'outreach_captcha_solve_seconds'
+DESCRIPTIONS = {
+    STEP_DURATION: 'Duration of the outreach bot steps (goto, search, fill, send, ...)',
+    JOB_DURATION: 'Duration of whole outreach jobs, retries included',
+    CAPTCHA_SOLVE_DURATION: 'Time to get a captcha solution, from the cache or the solver API',
+}
+
+
+def percentile(sorted_values: list, fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 3)
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram, plus a window of recent values for percentiles"""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def summary(self) -> dict:
+        values = sorted(self.samples)
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 3),
+            'p50': percentile(values, 0.5),
+            'p95': percentile(values, 0.95),
+            'max': round(values[-1], 3) if values else None,
+        }
+
+
+class MetricsRegistry:
+    """In-process timing histograms, exported as Prometheus text or a JSON summary"""
+
+    def __init__(self, sentry_sample_rate: float = METRICS_SENTRY_SAMPLE_RATE):
+        self.sentry_sample_rate = sentry_sample_rate
+        self.histograms = {}  # (name, sorted label items) -> Histogram
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """
+        Time the block into the `name` histogram, with an outcome label of ok or error
+
+        Inside a sampled Sentry transaction the block is also recorded as a span.
+        """
+        with ExitStack() as stack:
+            # Only an initialized SDK can have a span open, a run that never imported it has none
+            sentry_sdk = sys.modules.get('sentry_sdk')
+            if sentry_sdk is not None and sentry_sdk.get_current_span() is not None:
+                stack.enter_context(sentry_sdk.start_span(op=name, description=labels.get('step', name)))
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                yield
+                outcome = 'ok'
+            finally:
+                self.observe(name, time.perf_counter() - started, outcome=outcome, **labels)
+
+    @contextmanager
+    def transaction(self, name: str, op: str = 'outreach.job') -> Iterator[None]:
+        """Open a Sentry transaction for a sample of the jobs, so their step timers become spans"""
+        if self.sentry_sample_rate <= 0 or random.random() >= self.sentry_sample_rate:
+            yield
+            return
+        import sentry_sdk
+        with sentry_sdk.start_transaction(name=name, op=op, sampled=True):
+            yield
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+
+    def summary(self) -> dict:
+        """{metric name: {label string: count, sum, p50, p95, max}}"""
+        with self._lock:
+            items = [(key, histogram.summary()) for key, histogram in self.histograms.items()]
+        result = {}
+        for (name, labels), summary in sorted(items):
+            label_string = ','.join(f'{key}={value}' for key, value in labels)
+            result.setdefault(name, {})[label_string] = summary
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(self.summary(), indent=2)
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        with self._lock:
+            items = sorted(
+                (key, list(histogram.bucket_counts), histogram.count, histogram.sum, histogram.buckets)
+                for key, histogram in self.histograms.items())
+
+        lines = []
+        described = set()
+        for (name, labels), bucket_counts, count, total, buckets in items:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {DESCRIPTIONS.get(name, name)}')
+                lines.append(f'# TYPE {name} histogram')
+            label_pairs = [f'{key}="{value}"' for key, value in labels]
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = ','.join(label_pairs + [f'le="{bound}"'])
+                lines.append(f'{name}_bucket{{{bucket_labels}}} {cumulative}')
+            bucket_labels = ','.join(label_pairs + ['le="+Inf"'])
+            lines.append(f'{name}_bucket{{{bucket_labels}}} {count}')
+            label_string = '{' + ','.join(label_pairs) + '}' if label_pairs else ''
+            lines.append(f'{name}_sum{label_string} {total}')
+            lines.append(f'{name}_count{label_string} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry the bots report to
+registry = MetricsRegistry()
+
+
+def timed(step: str):
+    """Time one step of the outreach bot"""
+    return registry.timer(STEP_DURATION, step=step)
+
+
+def write_metrics(path: str) -> None:
+    """Save the registry to a file, as Prometheus text for .prom files and as a JSON summary otherwise"""
+    with open(path, 'w') as f:
+        f.write(registry.prometheus() if path.endswith('.prom') else registry.to_json())
@@ -0,0 +1,353 @@
+import json
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from os import getenv
+from typing import Optional
+from urllib.parse import urlparse, parse_qs, quote
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+MOCK_HOST = getenv('MOCK_SELLER_CENTER_HOST', '127.0.0.1')
+MOCK_PORT = int(getenv('MOCK_SELLER_CENTER_PORT', '8766'))
+
+# Versioned stylesheet of every page, served like the seller center's static bundles
+STATIC_STYLESHEET = '/static/mock.3f9a1c2e.css'
+STYLESHEET = b'.im-sidebar { float: right; } .im-conversation-header { font-size: 18px; }'
+
+# Shared by every page: the mock reads its settings from window.MOCK
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<link rel="stylesheet" href="""" + STATIC_STYLESHEET + """">
+<style>
+  body {{ font-family: sans-serif; margin: 0; padding: 16px; }}
+  .arco-modal-mask {{ position: fixed; inset: 0; z-index: 1000; background: rgba(0, 0, 0, .5); }}
+  .mock-guide {{ position: fixed; inset: 0; z-index: 1000; background: rgba(0, 0, 0, .3); }}
+  .mock-guide button {{ position: absolute; top: 50%; left: 50%; }}
+  .captcha-verify-container {{ position: fixed; inset: 0; z-index: 2000; background: #fff; }}
+  textarea {{ width: 400px; height: 100px; display: block; }}
+  td {{ padding: 8px; cursor: pointer; }}
+</style>
+</head>
+<body>
+<div id="app"></div>
+<script>
+window.MOCK = {settings};
+const after = (ms, fn) => setTimeout(fn, ms);
+const chance = (rate) => Math.random() < rate;
+function showModal() {{
+  document.body.insertAdjacentHTML('beforeend',
+    '<div class="arco-modal-wrapper"><div class="arco-modal-mask"></div></div>');
+}}
+function showGuide() {{
+  document.body.insertAdjacentHTML('beforeend',
+    '<div class="mock-guide"><button type="button"><span>Skip</span></button></div>');
+  document.querySelector('.mock-guide button').addEventListener('click',
+    () => document.querySelector('.mock-guide').remove());
+}}
+function showCaptcha() {{
+  document.body.insertAdjacentHTML('beforeend',
+    '<div class="captcha-verify-container"><button id="mock-captcha-verify" type="button">Verify</button></div>');
+  document.getElementById('mock-captcha-verify').addEventListener('click',
+    () => document.querySelector('.captcha-verify-container').remove());
+}}
+function interstitials(guide) {{
+  if (chance(MOCK.modal_rate)) after(MOCK.modal_ms, showModal);
+  if (guide && chance(MOCK.guide_rate)) after(MOCK.modal_ms, showGuide);
+  if (chance(MOCK.captcha_rate)) after(MOCK.modal_ms, showCaptcha);
+}}
+</script>
+<script>
+{script}
+</script>
+</body>
+</html>
+"""
+
+CREATORS_SCRIPT = """
+after(MOCK.page_ms, () => {
+  document.getElementById('app').innerHTML = `
+    <div class="m4b-page-header"><span class="m4b-page-header-title-text">Find creators</span></div>
+    <input placeholder="Search names, products, hashtags, or keywords">
+    <div class="arco-table"><div class="arco-table-body"><table><tbody>
+      <tr class="arco-table-tr arco-table-empty-row"><td>No data</td></tr>
+    </tbody></table></div></div>`;
+  const input = document.querySelector('input');
+  input.addEventListener('keydown', (event) => {
+    if (event.key !== 'Enter') return;
+    // Like the real site, the table is rendered from the JSON of the search API
+    fetch('/api/v1/oec/affiliate/creator/marketplace/find', {
+      method: 'POST', body: JSON.stringify({query: input.value}),
+    }).then((response) => response.json()).then((payload) => {
+      const tbody = document.querySelector('.arco-table-body tbody');
+      tbody.innerHTML = '';
+      for (const profile of payload.data.creator_profile_list) {
+        tbody.insertAdjacentHTML('beforeend', '<tr class="arco-table-tr"><td></td><td>Creator</td></tr>');
+        const cell = tbody.lastElementChild.querySelector('td');
+        cell.textContent = profile.handle.value;
+        cell.addEventListener('click', () => window.open(
+          '/connection/creator/detail?cid=' + encodeURIComponent(profile.creator_oecuid.value)));
+      }
+    });
+  });
+  interstitials(false);
+});
+"""
+
+DETAIL_SCRIPT = """
+after(MOCK.detail_ms, () => {
+  document.getElementById('app').innerHTML = `
+    <h1></h1>
+    <button type="button" class="mock-message"><svg class="alliance-icon-Message" width="16" height="16"></svg>Message</button>`;
+  document.querySelector('h1').textContent = MOCK.creator;
+  // The bot calls the React onClick handler directly, like on the real site
+  document.querySelector('.mock-message')['__reactProps$mock'] = {
+    onClick: () => window.open(MOCK.im_url),
+  };
+  interstitials(false);
+});
+"""
+
+IM_SCRIPT = """
+function showConversation(creator) {
+  document.querySelector('.im-conversation-header').textContent = creator;
+  document.querySelector('textarea').value = '';
+}
+after(MOCK.im_ms, () => {
+  document.getElementById('app').innerHTML = `
+    <nav>Inbox</nav><nav>Target collaborations</nav>
+    <ul class="im-sidebar"></ul>
+    <h2 class="im-conversation-header"></h2>
+    <textarea></textarea>
+    <button type="button" class="arco-btn arco-btn-primary">Send</button>`;
+  // Like the real inbox list, the handles of the other conversations are on the page too
+  for (const handle of MOCK.conversations) {
+    document.querySelector('.im-sidebar').insertAdjacentHTML('beforeend', '<li></li>');
+    document.querySelector('.im-sidebar').lastElementChild.textContent = handle;
+  }
+  showConversation(MOCK.creator);
+  document.querySelector('.arco-btn-primary').addEventListener('click', () => {
+    fetch('/api/sent', {method: 'POST', body: document.querySelector('textarea').value});
+  });
+  interstitials(true);
+});
+// Like the real IM app, another conversation is opened through the history, without a page load
+window.addEventListener('popstate', () => {
+  if (!MOCK.im_switch) return;
+  const creatorId = new URLSearchParams(location.search).get('creator_id');
+  document.querySelector('.im-conversation-header').textContent = '';
+  fetch('/api/im/conversation?creator_id=' + encodeURIComponent(creatorId))
+    .then((response) => response.json())
+    .then((conversation) => showConversation(conversation.creator));
+});
+"""
+
+
+class MockSettings:
+    def __init__(self, latency_ms: float = 50, page_ms: float = 300, search_ms: float = 500,
+                 detail_ms: float = 300, im_ms: float = 500, modal_ms: float = 200,
+                 modal_rate: float = 0.3, guide_rate: float = 0.3, captcha_rate: float = 0.0,
+                 im_switch: bool = True):
+        """
+        Delays and interstitial rates of the mock seller center
+
+        Args:
+            latency_ms: Server delay before every response
+            page_ms: Delay before the creators page renders its header, search input and table
+            search_ms: Delay of the search API, which returns the creator and a lookalike ranked first
+            detail_ms: Delay before the creator details page renders its message button
+            im_ms: Delay before the IM page renders its textarea
+            modal_ms: Delay before a modal, guide or captcha shows up on a page
+            modal_rate: Share of the creators/details/IM pages showing an arco modal
+            guide_rate: Share of the IM pages showing a "Skip" guide
+            captcha_rate: Share of pages showing a captcha, cleared by clicking #mock-captcha-verify
+            im_switch: Whether the IM page opens another conversation on history navigation
+        """
+        self.latency_ms = latency_ms
+        self.page_ms = page_ms
+        self.search_ms = search_ms
+        self.detail_ms = detail_ms
+        self.im_ms = im_ms
+        self.modal_ms = modal_ms
+        self.modal_rate = modal_rate
+        self.guide_rate = guide_rate
+        self.captcha_rate = captcha_rate
+        self.im_switch = im_switch
+
+    def scaled(self, factor: float) -> 'MockSettings':
+        """Same settings with every delay multiplied by factor"""
+        settings = MockSettings(**vars(self))
+        for name, value in vars(settings).items():
+            if name.endswith('_ms'):
+                setattr(settings, name, value * factor)
+        return settings
+
+
+def render(title: str, script: str, settings: MockSettings, **page_settings) -> bytes:
+    # </ is escaped so that creator names can't close the script tag
+    settings_json = json.dumps({**vars(settings), **page_settings}).replace('</', '<\\/')
+    return PAGE_TEMPLATE.format(title=title, settings=settings_json, script=script).encode()
+
+
+class MockSellerCenter:
+    """
+    Local stand-in for the parts of the affiliate seller center the bot relies on
+
+    Serves the "Find creators" page, the creator details page with its React
+    message button and the IM page, with configurable delays, modals, "Skip"
+    guides and captchas. Point the bot at it with SELLER_CENTER_URL.
+    """
+
+    def __init__(self, settings: Optional[MockSettings] = None, host: str = MOCK_HOST, port: int = MOCK_PORT):
+        self.settings = settings or MockSettings()
+        self.sent = 0
+        self.creators = {}  # creator id -> handle, of the creators the search returned
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), make_handler(self))
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name='mock-seller-center', daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockSellerCenter':
+        self._thread.start()
+        logger.info(f'Mock seller center listening on {self.url}')
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def record_sent(self) -> None:
+        with self._lock:
+            self.sent += 1
+
+    def search(self, query: str) -> dict:
+        """
+        Search API response for a query
+
+        A lookalike handle is ranked before the exact match, so a bot clicking
+        the first row opens the wrong creator.
+        """
+        profiles = []
+        for handle in (f'{query}.official', query):
+            creator_id = creator_id_of(handle)
+            with self._lock:
+                self.creators[creator_id] = handle
+            profiles.append({'handle': {'value': handle}, 'creator_oecuid': {'value': creator_id}})
+        return {'code': 0, 'data': {'creator_profile_list': profiles}}
+
+    def conversation(self, creator_id: str) -> dict:
+        """IM API response the IM page switches conversations with"""
+        with self._lock:
+            return {'creator_id': creator_id, 'creator': self.creators.get(creator_id, '')}
+
+    def page(self, path: str, query: dict) -> Optional[bytes]:
+        creator = query.get('creator', [''])[0]
+        if path == '/connection/creator':
+            return render('Find creators', CREATORS_SCRIPT, self.settings)
+        if path == '/connection/creator/detail':
+            creator_id = query.get('cid', [''])[0] or creator_id_of(creator)
+            with self._lock:
+                creator = self.creators.get(creator_id, creator)
+            im_url = f'/seller/im?shop_id=1&creator_id={creator_id}&creator={quote(creator)}'
+            return render('Creator details', DETAIL_SCRIPT, self.settings, creator=creator, im_url=im_url)
+        if path == '/seller/im':
+            # The bot opens IM pages of known ids without the handle
+            with self._lock:
+                creator = self.creators.get(query.get('creator_id', [''])[0], creator)
+                conversations = sorted(self.creators.values())
+            return render('Messages', IM_SCRIPT, self.settings, creator=creator, conversations=conversations)
+        return None
+
+
+def creator_id_of(handle: str) -> str:
+    """Stable fake id per handle, so the creator index can be exercised too"""
+    return str(zlib.crc32(handle.encode()))
+
+
+def make_handler(mock: MockSellerCenter):
+    class MockRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            time.sleep(mock.settings.latency_ms / 1000)
+            if url.path == '/api/im/conversation':
+                creator_id = parse_qs(url.query).get('creator_id', [''])[0]
+                self._send(200, json.dumps(mock.conversation(creator_id)).encode(), 'application/json')
+                return
+            if url.path == STATIC_STYLESHEET:
+                self._send(200, STYLESHEET, 'text/css', {'Cache-Control': 'public, max-age=31536000, immutable'})
+                return
+            body = mock.page(url.path, parse_qs(url.query))
+            if body is None:
+                self._send(404, b'Not found', 'text/plain')
+            else:
+                self._send(200, body, 'text/html; charset=utf-8')
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            path = urlparse(self.path).path
+            if path == '/api/sent':
+                mock.record_sent()
+                self._send(200, b'{}', 'application/json')
+            elif path == '/api/v1/oec/affiliate/creator/marketplace/find':
+                time.sleep(mock.settings.search_ms / 1000)
+                try:
+                    query = json.loads(body).get('query', '')
+                except ValueError:
+                    query = ''
+                self._send(200, json.dumps(mock.search(query)).encode(), 'application/json')
+            else:
+                self._send(404, b'Not found', 'text/plain')
+
+        def _send(self, status: int, payload: bytes, content_type: str, headers: Optional[dict] = None) -> None:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(f'{self.address_string()} {format % args}')
+
+    return MockRequestHandler
+
+
+def solve_mock_captcha(page) -> None:
+    """Captcha solver for the mock's captchas, which only need their verify button clicked"""
+    page.locator('#mock-captcha-verify').click()
+
+
+if __name__ == "__main__":
+    """_summary_ Serve the mock seller center, to look at its pages or to point a bot at it by hand.
+    Args:
+        port (int): Port to listen on
+
+    Usage example: python mock_seller_center.py --port 8766
+        then SELLER_CENTER_URL=http://127.0.0.1:8766 python send_message.py ...
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Serve a local mock of the affiliate seller center.')
+    parser.add_argument('--port', type=int, default=MOCK_PORT,
+                        help='Port to listen on')
+    args = parser.parse_args()
+    mock = MockSellerCenter(port=args.port).start()
+    print(f'Serving {mock.url}/connection/creator, press Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
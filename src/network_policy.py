@@ -0,0 +1,145 @@
+import fnmatch
+from collections import Counter
+from os import getenv
+from typing import Optional
+from weakref import WeakSet
+
+from playwright.sync_api import BrowserContext, Route, Request, Response
+from playwright.async_api import BrowserContext as AsyncBrowserContext, Route as AsyncRoute
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+NETWORK_POLICY = getenv('NETWORK_POLICY', 'default')
+
+# Stylesheets stay allowed: the bot relies on elements being visible/hidden,
+# which depends on the page's CSS.
+DEFAULT_BLOCKED_RESOURCE_TYPES = ('image', 'media', 'font')
+DEFAULT_BLOCKED_URL_PATTERNS = (
+    '*google-analytics.com*',
+    '*googletagmanager.com*',
+    '*doubleclick.net*',
+    '*facebook.net*',
+    '*connect.facebook.*',
+    '*/monitor_browser/collect/*',
+    '*mon.tiktokv.com*',
+    '*mcs.tiktokw.us*',
+    '*/slardar/*',
+    '*/web/report*',
+)
+# Never blocked: captcha images have to load for the solver, and the stealth
+# scripts are injected as init scripts so they are not affected by routing.
+# The captcha widget fetches and verifies its challenges on verification-*.tiktok.com
+# (or tiktokv.com), its images are served from paths containing "captcha".
+DEFAULT_ALLOWED_URL_PATTERNS = (
+    '*captcha*',
+    '*://verification*.tiktok*.com/*',
+)
+
+
+class NetworkPolicy:
+    """
+    Request routing rules for bot contexts
+
+    A request is aborted when it matches a blocked resource type or url pattern
+    and no allowed url pattern. Everything else falls through to the network
+    (or to the next route handler registered on the context).
+
+    An aborted request downloads nothing, so its size is unknown: in measure
+    mode the requests the policy would block are let through instead, and
+    their bytes counted as blocked_bytes, to see what the policy saves.
+    """
+
+    def __init__(self,
+                 blocked_resource_types: tuple = DEFAULT_BLOCKED_RESOURCE_TYPES,
+                 blocked_url_patterns: tuple = DEFAULT_BLOCKED_URL_PATTERNS,
+                 allowed_url_patterns: tuple = DEFAULT_ALLOWED_URL_PATTERNS,
+                 measure: bool = False):
+        """
+        Args:
+            blocked_resource_types: Playwright resource types to abort, e.g. 'image', 'font'
+            blocked_url_patterns: fnmatch patterns of urls to abort
+            allowed_url_patterns: fnmatch patterns of urls that are never aborted
+            measure: Count the requests the policy would block, and their bytes, without aborting them
+        """
+        self.blocked_resource_types = set(blocked_resource_types)
+        self.blocked_url_patterns = blocked_url_patterns
+        self.allowed_url_patterns = allowed_url_patterns
+        self.measure = measure
+        self.requests = Counter()  # 'allowed' / 'blocked'
+        self.blocked_by_type = Counter()
+        self.allowed_bytes = 0
+        self.blocked_bytes = 0
+        self._contexts = WeakSet()
+
+    @classmethod
+    def from_env(cls) -> Optional['NetworkPolicy']:
+        """Policy selected by the NETWORK_POLICY env var: 'default', 'measure', or 'off' for no routing"""
+        if NETWORK_POLICY == 'off':
+            return None
+        return cls(measure=NETWORK_POLICY == 'measure')
+
+    def is_blocked(self, request: Request) -> bool:
+        url = request.url
+        if any(fnmatch.fnmatch(url, pattern) for pattern in self.allowed_url_patterns):
+            return False
+        return request.resource_type in self.blocked_resource_types or any(
+            fnmatch.fnmatch(url, pattern) for pattern in self.blocked_url_patterns)
+
+    def apply(self, context: BrowserContext) -> None:
+        """Route every request of the context (all its pages and popups) through the policy"""
+        if context in self._contexts:
+            return
+        self._contexts.add(context)
+        context.route('**/*', self._handle)
+        context.on('response', self._count_response)
+
+    async def apply_async(self, context: AsyncBrowserContext) -> None:
+        """Async counterpart of apply"""
+        if context in self._contexts:
+            return
+        self._contexts.add(context)
+        await context.route('**/*', self._handle_async)
+        context.on('response', self._count_response)
+
+    def stats(self) -> dict:
+        """Counters of this run, for logs and job results"""
+        return {
+            'allowed_requests': self.requests['allowed'],
+            'blocked_requests': self.requests['blocked'],
+            'allowed_bytes': self.allowed_bytes,
+            # only known in measure mode, an aborted request downloads nothing
+            'blocked_bytes': self.blocked_bytes if self.measure else None,
+            'blocked_by_type': dict(self.blocked_by_type),
+        }
+
+    def _handle(self, route: Route) -> None:
+        if self._block(route.request) and not self.measure:
+            route.abort('blockedbyclient')
+        else:
+            route.fallback()
+
+    async def _handle_async(self, route: AsyncRoute) -> None:
+        if self._block(route.request) and not self.measure:
+            await route.abort('blockedbyclient')
+        else:
+            await route.fallback()
+
+    def _block(self, request: Request) -> bool:
+        blocked = self.is_blocked(request)
+        self.requests['blocked' if blocked else 'allowed'] += 1
+        if blocked:
+            self.blocked_by_type[request.resource_type] += 1
+        return blocked
+
+    def _count_response(self, response: Response) -> None:
+        # content-length is already in the headers, so this costs no extra round trip.
+        # Outside of measure mode blocked requests get no response, so this only sees allowed ones.
+        length = response.headers.get('content-length')
+        if not length or not length.isdigit():
+            return
+        if self.measure and self.is_blocked(response.request):
+            self.blocked_bytes += int(length)
+        else:
+            self.allowed_bytes += int(length)
+
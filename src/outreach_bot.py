@@ -1,95 +1,366 @@
 from os import getenv
+from typing import Optional
+from urllib.parse import urlparse
 
 from playwright.sync_api import Page, TimeoutError, Error
+from creator_index import CreatorIndex, build_im_url, parse_im_url, normalize_handle, SELLER_CENTER_URL
+from creator_search import Resolution, RESOLVED, build_detail_url, is_creator_search_response
+
+from overlays import OverlayGuard
+from captcha_watcher import CaptchaWatcher
+from sent_ledger import SentLedger
+from metrics import timed
+from timeout_policy import TimeoutPolicy
+from phases import FIND_CREATOR, OPEN_CONVERSATION, PROCESS_MESSAGES
+from outreach_bot_base import OutreachBotBase
+from sentry import take_debug_screenshot as save_debug_screenshot
 from logger import get_logger
 
 logger = get_logger(__name__)
 
-FIND_CREATOR_URL = 'https://affiliate-us.tiktok.com/connection/creator?shop_region=US'
+FIND_CREATOR_URL = f'{SELLER_CENTER_URL}/connection/creator?shop_region=US'
 TAKE_DEBUG_SCREENS = True
+# 'off' loads the IM page for every creator instead of switching conversations inside the IM app
+IM_SPA_NAVIGATION = getenv('IM_SPA_NAVIGATION', 'on')
+
+PAGE_TITLE_SELECTOR = '.m4b-page-header-title-text'
+SEARCH_INPUT_SELECTOR = 'input[placeholder="Search names, products, hashtags, or keywords"]'
+EMPTY_ROW_SELECTOR = '.arco-table-tr.arco-table-empty-row'
+FIRST_ROW_CELL_SELECTOR = '.arco-table-body tbody tr:first-child td:first-child'
+MESSAGE_ICON_SELECTOR = 'svg.alliance-icon-Message'
+SEND_BUTTON_SELECTOR = 'button.arco-btn-primary'
+MESSAGE_INPUT_SELECTOR = 'textarea'
+# Name of the creator at the top of the open conversation, unlike the handles of the inbox list
+IM_HEADER_SELECTOR = '.im-conversation-header'
+IM_URL_PATTERN = '**/seller/im**'
+DETAIL_URL_PATTERN = '**/connection/creator/detail**'
+
+# The message button only reacts to its React onClick handler, so call it directly
+CLICK_MESSAGE_BUTTON_JS = """
+    const messageButton = document.querySelector('.alliance-icon-Message').closest('button, a, [onclick]');
+    if (messageButton) {
+        const reactPropsKey = Object.keys(messageButton).find(key => key.startsWith('__reactProps$'));
+        const reactProps = messageButton[reactPropsKey];
+        if (reactProps && typeof reactProps.onClick === 'function') {
+            reactProps.onClick({
+                preventDefault: () => {},
+                stopPropagation: () => {}
+            });
+        }
+    }
+"""
+
+# The IM page is a single-page app whose router follows the history, like for its own links
+SWITCH_CONVERSATION_JS = """
+    url => {
+        window.history.pushState({}, '', url);
+        window.dispatchEvent(new PopStateEvent('popstate', {state: {}}));
+    }
+"""
+# True once the IM app shows the conversation of `creatorId`: the app kept its id in the url
+# and the conversation header names the handle
+CONVERSATION_SHOWN_JS = """
+    ([selector, handle, creatorId]) => {
+        const header = document.querySelector(selector);
+        return new URLSearchParams(location.search).get('creator_id') === creatorId
+            && header !== null
+            && header.textContent.trim().replace(/^@/, '').toLowerCase() === handle;
+    }
+"""
+
+
+class SessionExpiredError(Exception):
+    """The seller center redirected away from the creators page, the session cookies are no longer valid"""
+
+
+def is_find_creator_url(url: str) -> bool:
+    expected, actual = urlparse(FIND_CREATOR_URL), urlparse(url)
+    return (actual.netloc, actual.path) == (expected.netloc, expected.path)
 
 
-class OutreachMessageBot:
-    def __init__(self, page: Page):
-        self.page = page
+class OutreachMessageBot(OutreachBotBase):
+    def __init__(self, page: Page, creator_index: Optional[CreatorIndex] = None,
+                 overlay_guard: Optional[OverlayGuard] = None,
+                 captcha_watcher: Optional[CaptchaWatcher] = None,
+                 timeout_policy: Optional[TimeoutPolicy] = None,
+                 ledger: Optional[SentLedger] = None):
+        super().__init__(page, creator_index, overlay_guard or OverlayGuard(
+            screenshot=save_debug_screenshot if TAKE_DEBUG_SCREENS else None),
+            captcha_watcher, timeout_policy, ledger)
+
+    def watch_page(self, page: Page) -> None:
+        """Handle overlays and captchas on a page the bot works on, and keep track of it"""
+        self.track_page(page)
+        self.overlays.attach(page)
+        self.captcha_watcher.attach(page)
 
     def execute(self, config: dict) -> dict:
-        """Execute the outreach message task"""
+        """Execute the outreach message task
+
+        Calling it again for the same creator after a failure resumes from the
+        last checkpoint instead of searching the creator again.
+        """
+        creator = config['creator']
+        failed_phase, resume_phase = self.start_attempt(config)
         logger.info(f"Run OutreachMessageBot for creator: '{
-            config['creator']}'")
+            creator}' from phase {resume_phase}")
+        # attached once per page, like in AsyncOutreachMessageBot which can't do it in __init__
+        self.watch_page(self.page)
 
-        self.find_creator(config['creator'])
+        if resume_phase == FIND_CREATOR:
+            # if we already know the shop_id, creator_id of this creator we can skip the find_creator step and go right to the IM
+            if not self.open_indexed_conversation(creator):
+                self.phase = FIND_CREATOR
+                if config.get('creator_id'):
+                    # resolved ahead of time by resolve_creators.py, no search needed
+                    self.open_resolved_creator(creator, config['creator_id'])
+                else:
+                    self.find_creator(creator)
+                resume_phase = self.phase_after_search()
+            self.close_finished_pages()
+        if resume_phase == OPEN_CONVERSATION:
+            self.phase = OPEN_CONVERSATION
+            self.open_conversation(creator, reload=failed_phase == OPEN_CONVERSATION)
+            self.close_finished_pages()
 
-        # if we already have started a convo, and we know the shop_id, creator_id we can skip the find_creator step and go right to the IM
-        # im_url = 'https://affiliate-us.tiktok.com/seller/im?shop_id=7495466131724601870&creator_id=7495121012934281660&enter_from=affiliate_creator_details&shop_region=US'
-        # self.page.goto(im_url)
-        self.process_messages(config['message'], config['creator'])
+        # a captcha announced by the network but not rendered yet during the last phase
+        self.captcha_watcher.solve_pending(self.page)
+        self.phase = PROCESS_MESSAGES
+        if self.checkpoint.im_url:
+            self.resume_at(self.checkpoint.im_url, reload=failed_phase == PROCESS_MESSAGES)
+            self.im_page = self.page
+        self.process_messages(config['message'], creator,
+                              config.get('agency_campaign_id'), config.get('account'))
 
         return {}
 
+    def resume_at(self, url: str, reload: bool = False) -> None:
+        """
+        Make sure the bot works on the page of a checkpoint
+
+        Switches to the tab showing it, since tab hopping may have left the bot
+        elsewhere, and only loads it when no tab shows it or reload is set.
+        """
+        if self.page.is_closed() or self.page.url != url:
+            for page in reversed(self.page.context.pages):
+                if page.url == url:
+                    self.page = page
+                    self.watch_page(page)
+                    break
+        if not self.page.is_closed() and self.page.url == url and not reload:
+            return
+
+        logger.info(f'Loading checkpoint {url}')
+        if self.page.is_closed():
+            self.page = self.page.context.new_page()
+            self.watch_page(self.page)
+        with timed('resume'), self.timeouts.measure('goto') as timeout:
+            self.page.goto(url, timeout=timeout)
+
     def find_creator(self, creator: str) -> None:
-        """Find and navigate to creator's page"""
+        """Search the creator and open their details tab"""
         if not creator:
             logger.warning(
                 'Encountered a creator without a tiktok_username, this task will not be executed')
             return
 
         logger.info('findCreator ...')
-        self.page.goto(FIND_CREATOR_URL)
+        self.open_search()
+        resolution = self.search(creator)
+        if resolution and resolution.status == RESOLVED:
+            self.open_resolved_creator(creator, resolution.creator_id)
+            return
+
+        # Wait for and click first result
+        with timed('row_click'):
+            with self.timeouts.measure('empty_row_hidden') as timeout:
+                self.page.wait_for_selector(
+                    EMPTY_ROW_SELECTOR, state='hidden', timeout=timeout)
+            first_cell = self.page.locator(FIRST_ROW_CELL_SELECTOR)
+            first_cell.click()
+            self.move_to_next_plan()
+            # the new tab starts on about:blank, a retry must resume at the creator's page
+            with self.timeouts.measure('details_url') as timeout:
+                self.page.wait_for_url(DETAIL_URL_PATTERN, timeout=timeout)
+        self.details_opened()
+
+    def open_search(self) -> None:
+        """Load the "Find creators" page, making sure it is the English one"""
+        if self.page is self.im_page and not self.page.is_closed():
+            # searched in a tab of its own, the IM tab stays open for a resolved creator
+            self.page = self.page.context.new_page()
+            self.watch_page(self.page)
+        with timed('goto'), self.timeouts.measure('goto') as timeout:
+            self.page.goto(FIND_CREATOR_URL, timeout=timeout)
         self.skip_modal()
 
         try:
             if not self.check_language():
-                self.page.reload()
+                with timed('reload'):
+                    self.page.reload()
                 if not self.check_language():
+                    self.check_redirect()
                     raise Exception(
                         'Oops! This is not the English page, please try again later')
         except TimeoutError:
-            current_url = self.page.url
-            if current_url != FIND_CREATOR_URL:
-                cookies = self.page.context.cookies()
-                raise Exception(f'Detected an incorrect redirect to: {
-                                current_url}. cookies: {cookies}')
+            self.check_redirect()
 
         logger.info('Successfully entered the creators page.')
 
-        # Search for creator
-        self.page.wait_for_selector(
-            'input[placeholder="Search names, products, hashtags, or keywords"]', timeout=10000)
-        search_input = self.page.locator(
-            'input[placeholder="Search names, products, hashtags, or keywords"]')
-        search_input.fill(creator)
-        search_input.press('Enter')
+    def search(self, creator: str) -> Optional[Resolution]:
+        """Search the creator on the creators page, see search_creator"""
+        with timed('search'):
+            with self.timeouts.measure('search_input') as timeout:
+                self.page.wait_for_selector(SEARCH_INPUT_SELECTOR, timeout=timeout)
+            search_input = self.page.locator(SEARCH_INPUT_SELECTOR)
+            search_input.fill(creator)
+            return self.search_creator(search_input, creator)
 
-        # Wait for and click first result
-        self.page.wait_for_selector(
-            '.arco-table-tr.arco-table-empty-row', state='hidden', timeout=10000)
-        first_cell = self.page.locator(
-            '.arco-table-body tbody tr:first-child td:first-child')
-        first_cell.click()
-        self.move_to_next_plan()
-        logger.info('Successfully entered the creator details page.')
+    def search_creator(self, search_input, creator: str) -> Optional[Resolution]:
+        """Submit the search and match the creator in the JSON response the results table is rendered from
+
+        Returns:
+            Resolution: None if the response could not be captured or read, the
+                caller then picks the creator from the results table
+
+        Raises:
+            CreatorNotFoundError: The search returned creators, none or several with exactly this handle
+        """
+        if not self.interception.enabled():
+            search_input.press('Enter')
+            return None
+        try:
+            with self.timeouts.measure('search_api') as timeout, \
+                    self.page.expect_response(is_creator_search_response, timeout=timeout) as response_info:
+                search_input.press('Enter')
+            payload = response_info.value.json()
+        except TimeoutError:
+            self.interception.record(False)
+            logger.warning(f"No creator search response captured for '{creator}'")
+            return None
+        except (Error, ValueError) as e:
+            self.interception.record(True)
+            logger.warning(f"Unreadable creator search response for '{creator}': {e}")
+            return None
+        self.interception.record(True)
+        return self.match_search(payload, creator)
+
+    def open_resolved_creator(self, creator: str, creator_id: str) -> None:
+        """Open the IM page of a creator resolved by the search when the shop is known, else its details page"""
+        if self.shop_id:
+            try:
+                self.open_im(creator, self.shop_id, creator_id)
+                self.resolved_conversation_opened(creator, creator_id)
+                return
+            except Error as e:
+                logger.warning(f"IM page of resolved creator '{creator}' did not load, opening its details: {e}")
+
+        with timed('open_details'), self.timeouts.measure('goto') as timeout:
+            self.page.goto(build_detail_url(creator_id), timeout=timeout)
+        logger.info('Successfully entered the creator details page from the search.')
+        self.checkpoint.details_url = self.page.url
+
+    def open_conversation(self, creator: str, reload: bool = False) -> None:
+        """Open the IM tab from the creator details tab"""
+        logger.info('openConversation ...')
+        if self.checkpoint.details_url:
+            self.resume_at(self.checkpoint.details_url, reload)
 
         # Find and click message icon
-        self.page.wait_for_selector('svg.alliance-icon-Message', timeout=15000)
-        self.page.evaluate("""
-            const messageButton = document.querySelector('.alliance-icon-Message').closest('button, a, [onclick]');
-            if (messageButton) {
-                const reactPropsKey = Object.keys(messageButton).find(key => key.startsWith('__reactProps$'));
-                const reactProps = messageButton[reactPropsKey];
-                if (reactProps && typeof reactProps.onClick === 'function') {
-                    reactProps.onClick({
-                        preventDefault: () => {},
-                        stopPropagation: () => {}
-                    });
-                }
-            }
-        """)
-
-        self.move_to_next_plan()
-
-    def process_messages(self, message: str, creator: str) -> None:
-        """Process and send messages to creator"""
+        with timed('message_button'):
+            with self.timeouts.measure('message_icon') as timeout:
+                self.page.wait_for_selector(MESSAGE_ICON_SELECTOR, timeout=timeout)
+            self.page.evaluate(CLICK_MESSAGE_BUTTON_JS)
+
+            self.move_to_next_plan()
+        self.index_conversation(creator)
+
+    def check_redirect(self) -> None:
+        """Raise SessionExpiredError if the site sent us away from the creators page"""
+        current_url = self.page.url
+        if not is_find_creator_url(current_url):
+            cookies = self.page.context.cookies()
+            raise SessionExpiredError(f'Detected an incorrect redirect to: {
+                current_url}. cookies: {cookies}')
+
+    def open_indexed_conversation(self, creator: str) -> bool:
+        """Go straight to the IM page of an already indexed creator
+
+        Returns:
+            bool: False if the creator is not indexed or its IM page did not load
+        """
+        ids = self.indexed_ids(creator)
+        if not ids:
+            return False
+        try:
+            self.open_im(creator, *ids)
+        except Error as e:
+            self.indexed_conversation_failed(creator, e)
+            return False
+        self.indexed_conversation_opened(ids[0])
+        return True
+
+    def open_im(self, creator: str, shop_id: str, creator_id: str) -> None:
+        """Open the conversation with a creator, inside the open IM app if it can, else by loading its IM page"""
+        url = build_im_url(shop_id, creator_id)
+        if self.switch_conversation(creator, shop_id, url):
+            return
+        with timed('open_im'):
+            self.page.goto(url)
+            with self.timeouts.measure('im_textarea') as timeout:
+                self.page.wait_for_selector(MESSAGE_INPUT_SELECTOR, timeout=timeout)
+
+    def switch_conversation(self, creator: str, shop_id: str, url: str) -> bool:
+        """
+        Switch the IM tab of the last conversation to another creator of the same shop, without a page load
+
+        The switch only counts once the url still has the creator's id and the
+        header of the open conversation names their handle. The inbox list
+        shows other handles, so matching the handle anywhere on the page could
+        pass while the previous conversation is still open.
+
+        Returns:
+            bool: False if there is no IM tab of the shop or the app didn't switch, the page is then loaded
+                (in the IM tab, whose url no longer matches its conversation)
+        """
+        im_page = self.im_page
+        if IM_SPA_NAVIGATION == 'off' or not creator or not im_page or im_page.is_closed():
+            return False
+        ids = parse_im_url(im_page.url)
+        if not ids or ids[0] != shop_id:
+            return False
+        try:
+            with timed('switch_im'):
+                im_page.evaluate(SWITCH_CONVERSATION_JS, url)
+                with self.timeouts.measure('im_switch') as timeout:
+                    im_page.wait_for_function(
+                        CONVERSATION_SHOWN_JS,
+                        arg=[IM_HEADER_SELECTOR, normalize_handle(creator), parse_im_url(url)[1]],
+                        timeout=timeout)
+                    im_page.wait_for_selector(MESSAGE_INPUT_SELECTOR, timeout=timeout)
+        except Error as e:
+            logger.info(f"IM app did not switch to '{creator}', loading the page: {e}")
+            self.page = im_page
+            return False
+        self.page = im_page
+        if im_page not in self.pages:
+            self.pages.append(im_page)
+        logger.info(f"Switched the IM app to '{creator}'")
+        return True
+
+    def index_conversation(self, creator: str) -> None:
+        """Checkpoint the IM tab open_conversation ended on, and record its IDs in the creator index"""
+        try:
+            with timed('wait_im'), self.timeouts.measure('im_url') as timeout:
+                self.page.wait_for_url(IM_URL_PATTERN, timeout=timeout)
+        except TimeoutError:
+            logger.warning(f"IM tab of '{creator}' did not load, not indexing it")
+            return
+        self.conversation_opened(creator)
+
+    def process_messages(self, message: str, creator: str, agency_campaign_id: Optional[str] = None,
+                         account: Optional[str] = None) -> None:
+        """Process and send messages to creator, recording the send in the ledger"""
         logger.info('processMessages ...')
 
         self.page.get_by_text('Inbox')
@@ -98,53 +369,65 @@ class OutreachMessageBot:
         self.page.get_by_text(creator)
 
         self.skip_tip()
-        textarea = self.page.locator('textarea')
-        textarea.fill(message)
+        with timed('fill'):
+            textarea = self.page.locator(MESSAGE_INPUT_SELECTOR)
+            textarea.fill(message)
 
         # Only click send in production
         if self.is_production():
-            self.page.locator('button.arco-btn-primary').first.click()
+            if not self.claim_send(agency_campaign_id, creator, account):
+                return
+            try:
+                with timed('send'):
+                    self.page.locator(SEND_BUTTON_SELECTOR).first.click()
+            except Exception:
+                self.send_failed(agency_campaign_id, creator)
+                raise
+            self.send_confirmed(agency_campaign_id, creator)
 
         logger.info('Mission accomplished!')
 
     def skip_modal(self) -> None:
-        """Skip modal if present"""
-        try:
-            modal = self.page.wait_for_selector(
-                '.arco-modal-mask', timeout=10000)
-            logger.info('Catch the modal!')
-            self.page.evaluate(
-                '(element) => element.parentNode.remove()', modal)
-        except Error:
-            pass
+        """Skip modal if present
+            Does not wait for it: a modal showing up later is removed by the overlay guard
+            before the next action it would block.
+        """
+        with timed('skip_modal'):
+            self.overlays.dismiss_visible(self.page, 'modal')
 
     def skip_tip(self) -> None:
         """Skip tutorial/welcome tip if present
-            TODO: the problem with this is that it will make every request always wait these 10 seconds
+            Does not wait for it: a tip showing up later is skipped by the overlay guard
+            before the next action it would block.
         """
-        try:
-            skip_button = self.page.wait_for_selector('//span[text()="Skip"]/parent::button',
-                                                      timeout=10000)
-            if TAKE_DEBUG_SCREENS:
-                self.take_debug_screenshot('ENCOUNTERING-SKIP-GUIDE')
-            if skip_button:
-                skip_button.click()
-        except TimeoutError:
-            pass
+        with timed('skip_tip'):
+            self.overlays.dismiss_visible(self.page, 'skip_guide')
+
+    def close_finished_pages(self) -> None:
+        """Close the tabs the bot moved away from, the finished phase won't resume on them"""
+        for page in self.pages:
+            if page is not self.page and not page.is_closed():
+                try:
+                    page.close()
+                except Error as e:
+                    logger.warning(f'Could not close a finished tab: {e}')
+        self.pages = [self.page]
 
     def move_to_next_plan(self) -> None:
         """Switch to the latest browser window/tab"""
         pages = self.page.context.pages
         if pages:
             self.page = pages[-1]
+            self.watch_page(self.page)
 
     def check_language(self) -> bool:
         """Check if page is in English"""
         logger.info('checkLanguage ...')
         try:
-            title_element = self.page.wait_for_selector(
-                '.m4b-page-header-title-text')
-            title_text = title_element.text_content()
+            with timed('check_language'), self.timeouts.measure('page_title') as timeout:
+                title_element = self.page.wait_for_selector(
+                    PAGE_TITLE_SELECTOR, timeout=timeout)
+                title_text = title_element.text_content()
             is_english = title_text == 'Find creators'
 
             if not is_english and TAKE_DEBUG_SCREENS:
@@ -154,7 +437,7 @@ class OutreachMessageBot:
         except Error:
             return False
 
-    @staticmethod
-    def is_production() -> bool:
-        """Check if running in production environment"""
-        return getenv('ENVIRONMENT') == 'production'
+    def take_debug_screenshot(self, name: str) -> Optional[str]:
+        """Take a debug screenshot of the current page"""
+        return save_debug_screenshot(self.page, name)
+
@@ -0,0 +1,171 @@
+from os import getenv
+from typing import Optional
+
+from creator_index import CreatorIndex, parse_im_url
+from creator_search import CreatorNotFoundError, Resolution, RESOLVED, match_creator, SearchInterception
+from overlays import OverlayGuard
+from captcha_watcher import CaptchaWatcher
+from sent_ledger import SentLedger
+from timeout_policy import TimeoutPolicy, get_timeout_policy
+from phases import Checkpoint, OPEN_INDEXED_CONVERSATION, OPEN_CONVERSATION, PROCESS_MESSAGES
+from logger import get_logger, correlation_id
+
+logger = get_logger(__name__)
+
+
+class OutreachBotBase:
+    """
+    Page independent part of the outreach bots: checkpoints, phase selection, creator index and ledger
+
+    OutreachMessageBot and AsyncOutreachMessageBot only add the page work, with
+    the sync and the async Playwright API, and report what it reached here.
+    """
+
+    def __init__(self, page, creator_index: Optional[CreatorIndex], overlay_guard: OverlayGuard,
+                 captcha_watcher: Optional[CaptchaWatcher] = None,
+                 timeout_policy: Optional[TimeoutPolicy] = None,
+                 ledger: Optional[SentLedger] = None):
+        self.page = page
+        self.pages = [page]  # tabs the bot worked on since its last close_finished_pages
+        self.tabs_opened = 0
+        self.phase = None
+        self.checkpoint = None
+        self.shop_id = None  # learned from the first IM URL, lets a resolved search go straight to the IM
+        self.account = None  # of the job, the creator index is scoped by it
+        self.im_page = None  # tab of the last conversation, the next one of the shop is opened inside it
+        self.creator_index = creator_index
+        self.overlays = overlay_guard
+        self.captcha_watcher = captcha_watcher or CaptchaWatcher()
+        self.timeouts = timeout_policy or get_timeout_policy()
+        self.ledger = ledger
+        self.already_sent = False  # the ledger had the message, it was not sent again
+        self.interception = SearchInterception()
+
+    def new_job(self) -> None:
+        """Start another job on the tabs of the previous one, so its IM tab can be switched to the next creator"""
+        self.checkpoint = None
+        self.phase = None
+        self.already_sent = False
+        self.overlays.hits.clear()
+        self.captcha_watcher.detected = 0
+
+    def index_scope(self) -> Optional[str]:
+        """Scope of the creator index entries of this bot: the job's account, else the shop it works on"""
+        return self.account or self.shop_id
+
+    def track_page(self, page) -> None:
+        """Keep track of a tab the bot works on, counting the ones it opened"""
+        if page not in self.pages:
+            self.pages.append(page)
+            self.tabs_opened += 1
+
+    def start_attempt(self, config: dict) -> tuple[Optional[str], str]:
+        """
+        Begin an attempt of execute, keeping the checkpoint of an earlier attempt for the same creator
+
+        Returns:
+            tuple: (phase the last attempt failed in, whose page is loaded again rather than trusted,
+                phase to resume from)
+        """
+        creator = config['creator']
+        self.account = config.get('account')
+        if not self.checkpoint or self.checkpoint.creator != creator:
+            self.checkpoint = Checkpoint(creator)
+            self.phase = None
+            self.tabs_opened = 0
+        return self.phase, self.checkpoint.resume_phase()
+
+    def phase_after_search(self) -> str:
+        """Phase following find_creator: a creator resolved from the search API may already be on its IM page"""
+        return PROCESS_MESSAGES if self.checkpoint.im_url else OPEN_CONVERSATION
+
+    def match_search(self, payload, creator: str) -> Resolution:
+        """
+        Match the creator in the creator search response
+
+        Raises:
+            CreatorNotFoundError: The search returned creators, none or several with exactly this handle
+        """
+        resolution = match_creator(payload, creator)
+        logger.info(f'Creator search: {resolution}, {resolution.candidates} candidates')
+        # no candidates at all may as well be a response shape we don't know, let the table decide
+        if resolution.status != RESOLVED and resolution.candidates:
+            raise CreatorNotFoundError(resolution)
+        return resolution
+
+    def indexed_ids(self, creator: str) -> Optional[tuple[str, str]]:
+        """(shop_id, creator_id) of an already indexed creator, entering OPEN_INDEXED_CONVERSATION if there is one"""
+        if not self.creator_index or not creator or not self.index_scope():
+            return None
+        ids = self.creator_index.get(self.index_scope(), creator)
+        if ids:
+            self.phase = OPEN_INDEXED_CONVERSATION
+            logger.info(f"openIndexedConversation ... shop_id={ids[0]}, creator_id={ids[1]}")
+        return ids
+
+    def indexed_conversation_opened(self, shop_id: str) -> None:
+        self.checkpoint.im_url = self.page.url
+        self.shop_id = shop_id
+
+    def indexed_conversation_failed(self, creator: str, error: Exception) -> None:
+        """Drop the index entry of a conversation that did not load"""
+        # A redirect away from the IM page is a session problem, not a stale entry
+        if '/seller/im' in self.page.url:
+            logger.warning(f"Indexed conversation of '{creator}' is stale, searching again: {error}")
+            self.creator_index.invalidate(self.index_scope(), creator)
+
+    def resolved_conversation_opened(self, creator: str, creator_id: str) -> None:
+        """Checkpoint the IM page of a creator resolved by the search, and index it"""
+        self.checkpoint.im_url = self.page.url
+        if self.creator_index:
+            self.creator_index.record(self.index_scope(), creator, self.shop_id, creator_id)
+        logger.info('Successfully entered the chat page from the search.')
+
+    def details_opened(self) -> None:
+        logger.info('Successfully entered the creator details page.')
+        self.checkpoint.details_url = self.page.url
+
+    def conversation_opened(self, creator: str) -> None:
+        """Checkpoint the IM tab open_conversation ended on, and record its IDs in the creator index"""
+        self.checkpoint.im_url = self.page.url
+        ids = parse_im_url(self.page.url)
+        if ids:
+            self.shop_id = ids[0]
+        if self.creator_index and creator and self.index_scope():
+            self.creator_index.record_im_url(self.index_scope(), creator, self.page.url)
+
+    def records_send(self, agency_campaign_id: Optional[str]) -> bool:
+        """Whether the send of this message goes through the ledger"""
+        return bool(self.ledger and agency_campaign_id and self.is_production())
+
+    def claim_send(self, agency_campaign_id: Optional[str], creator: str, account: Optional[str]) -> bool:
+        """
+        Reserve the send in the ledger, atomically, so a run or worker racing this one can't send it too
+
+        Returns:
+            bool: False if the message was already sent, it must not be sent again
+        """
+        if not self.records_send(agency_campaign_id) \
+                or self.ledger.reserve(agency_campaign_id, creator, account, correlation_id.get()):
+            return True
+        logger.info(f"Message to '{creator}' was already sent, not sending it again")
+        self.already_sent = True
+        return False
+
+    def send_failed(self, agency_campaign_id: Optional[str], creator: str) -> None:
+        """Release the reservation of a send that failed, a retry may claim it again"""
+        if self.records_send(agency_campaign_id):
+            self.ledger.release(agency_campaign_id, creator)
+
+    def send_confirmed(self, agency_campaign_id: Optional[str], creator: str) -> None:
+        if self.records_send(agency_campaign_id):
+            self.ledger.confirm(agency_campaign_id, creator)
+
+    def tab_stats(self) -> dict:
+        """Tabs the current job opened, and tabs still open in the context"""
+        return {'tabs_opened': self.tabs_opened, 'tabs_open': len(self.page.context.pages)}
+
+    @staticmethod
+    def is_production() -> bool:
+        """Check if running in production environment"""
+        return getenv('ENVIRONMENT') == 'production'
@@ -0,0 +1,140 @@
+from collections import Counter
+from functools import partial
+from typing import Any, Callable, Optional
+from weakref import WeakSet
+
+from playwright.sync_api import Page, Locator, Error
+from playwright.async_api import Page as AsyncPage, Locator as AsyncLocator
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+REMOVE = 'remove'  # detach the overlay's container from the DOM
+CLICK = 'click'    # click the overlay, e.g. its "Skip" button
+
+REMOVE_CONTAINER_JS = '(element) => element.parentNode && element.parentNode.remove()'
+
+
+class Overlay:
+    def __init__(self, name: str, selector: str, action: str, screenshot_name: Optional[str] = None):
+        """
+        An interstitial that can cover the elements the bot works with
+
+        Args:
+            name: Key used in the hit counts
+            selector: Selector of the overlay element
+            action: REMOVE or CLICK
+            screenshot_name: Debug screenshot to take when the overlay shows up, if any
+        """
+        self.name = name
+        self.selector = selector
+        self.action = action
+        self.screenshot_name = screenshot_name
+
+
+MODAL_MASK_SELECTOR = '.arco-modal-mask'
+SKIP_BUTTON_SELECTOR = '//span[text()="Skip"]/parent::button'
+
+DEFAULT_OVERLAYS = [
+    Overlay('modal', MODAL_MASK_SELECTOR, REMOVE),
+    Overlay('skip_guide', SKIP_BUTTON_SELECTOR,
+            CLICK, 'ENCOUNTERING-SKIP-GUIDE'),
+]
+
+
+class OverlayGuard:
+    """
+    Dismisses overlays only when they actually appear
+
+    Each overlay is registered as a Playwright locator handler, which runs right
+    before an action (fill, click, ...) that the overlay would otherwise block,
+    so pages without the overlay pay no waiting time at all.
+    """
+
+    def __init__(self, overlays: Optional[list[Overlay]] = None,
+                 screenshot: Optional[Callable[[Any, str], Any]] = None):
+        """
+        Args:
+            overlays: Overlays to handle (default: DEFAULT_OVERLAYS)
+            screenshot: Called with (page, name) when an overlay with a screenshot_name is hit.
+                For async pages it must be a coroutine function.
+        """
+        self.overlays = overlays if overlays is not None else DEFAULT_OVERLAYS
+        self.screenshot = screenshot
+        self.hits = Counter()
+        self._pages = WeakSet()
+
+    def attach(self, page: Page) -> None:
+        """Register the overlay handlers on a page, once per page"""
+        if page in self._pages:
+            return
+        self._pages.add(page)
+        for overlay in self.overlays:
+            page.add_locator_handler(
+                page.locator(overlay.selector), partial(self._dismiss, page, overlay))
+
+    def dismiss_visible(self, page: Page, name: str) -> bool:
+        """Dismiss an overlay right away if it is showing, without waiting for it"""
+        for overlay in self.overlays:
+            if overlay.name != name:
+                continue
+            locator = page.locator(overlay.selector)
+            if locator.first.is_visible():
+                self._dismiss(page, overlay, locator)
+                return True
+        return False
+
+    def _dismiss(self, page: Page, overlay: Overlay, locator: Locator) -> None:
+        self._record_hit(overlay)
+        if overlay.screenshot_name and self.screenshot:
+            try:
+                self.screenshot(page, overlay.screenshot_name)
+            except Exception as e:
+                logger.warning(f"Overlay screenshot failed: {e}")
+        try:
+            if overlay.action == REMOVE:
+                locator.first.evaluate(REMOVE_CONTAINER_JS)
+            else:
+                locator.first.click()
+        except Error as e:
+            logger.warning(f"Could not dismiss overlay '{overlay.name}': {e}")
+
+    async def attach_async(self, page: AsyncPage) -> None:
+        """Async counterpart of attach"""
+        if page in self._pages:
+            return
+        self._pages.add(page)
+        for overlay in self.overlays:
+            await page.add_locator_handler(
+                page.locator(overlay.selector), partial(self._dismiss_async, page, overlay))
+
+    async def dismiss_visible_async(self, page: AsyncPage, name: str) -> bool:
+        """Async counterpart of dismiss_visible"""
+        for overlay in self.overlays:
+            if overlay.name != name:
+                continue
+            locator = page.locator(overlay.selector)
+            if await locator.first.is_visible():
+                await self._dismiss_async(page, overlay, locator)
+                return True
+        return False
+
+    async def _dismiss_async(self, page: AsyncPage, overlay: Overlay, locator: AsyncLocator) -> None:
+        self._record_hit(overlay)
+        if overlay.screenshot_name and self.screenshot:
+            try:
+                await self.screenshot(page, overlay.screenshot_name)
+            except Exception as e:
+                logger.warning(f"Overlay screenshot failed: {e}")
+        try:
+            if overlay.action == REMOVE:
+                await locator.first.evaluate(REMOVE_CONTAINER_JS)
+            else:
+                await locator.first.click()
+        except Error as e:
+            logger.warning(f"Could not dismiss overlay '{overlay.name}': {e}")
+
+    def _record_hit(self, overlay: Overlay) -> None:
+        self.hits[overlay.name] += 1
+        logger.info(f"Catch the {overlay.name}! (hit {
+                    self.hits[overlay.name]} times)")
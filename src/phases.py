@@ -0,0 +1,64 @@
+import random
+from os import getenv
+from typing import Optional
+
+# Phases of the outreach flow, in order. A retry resumes at the first phase whose checkpoint is missing.
+OPEN_INDEXED_CONVERSATION = 'open_indexed_conversation'  # straight to a known IM page
+FIND_CREATOR = 'find_creator'            # creators page -> search -> creator details tab
+OPEN_CONVERSATION = 'open_conversation'  # message button -> IM tab
+PROCESS_MESSAGES = 'process_messages'    # fill and send on the IM page
+
+
+class Checkpoint:
+    """Progress of one creator's outreach, kept across retries so they don't start over"""
+
+    def __init__(self, creator: str):
+        self.creator = creator
+        self.details_url = None  # creator details tab reached by find_creator
+        self.im_url = None       # IM tab reached by open_conversation or the creator index
+
+    def resume_phase(self) -> str:
+        """First phase that still has to run"""
+        if self.im_url:
+            return PROCESS_MESSAGES
+        if self.details_url:
+            return OPEN_CONVERSATION
+        return FIND_CREATOR
+
+    def to_dict(self) -> dict:
+        return {'details_url': self.details_url, 'im_url': self.im_url}
+
+
+class RetryPolicy:
+    def __init__(self, attempts: int, backoff: float = 1.0, max_backoff: float = 30.0):
+        """
+        How often a phase may fail before the job gives up, and how long to wait before retrying it
+
+        Args:
+            attempts: Failures of the phase after which no retry is made
+            backoff: Seconds to wait after the first failure, doubled after each further one
+            max_backoff: Upper bound of the wait
+        """
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, failures: int) -> float:
+        """Seconds to wait before retrying after the phase failed `failures` times, with jitter"""
+        delay = min(self.max_backoff, self.backoff * 2 ** (failures - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+
+# Searching again is the costliest retry and most often fails because the site is slow, so it
+# waits the longest; the IM page is reloaded by itself so it is retried sooner.
+DEFAULT_RETRY_POLICIES = {
+    FIND_CREATOR: RetryPolicy(attempts=int(getenv('FIND_CREATOR_ATTEMPTS', '3')), backoff=2.0),
+    OPEN_CONVERSATION: RetryPolicy(attempts=int(getenv('OPEN_CONVERSATION_ATTEMPTS', '3')), backoff=1.0),
+    PROCESS_MESSAGES: RetryPolicy(attempts=int(getenv('PROCESS_MESSAGES_ATTEMPTS', '3')), backoff=1.0),
+}
+
+
+def retry_policy(phase: Optional[str], policies: Optional[dict] = None) -> RetryPolicy:
+    """Policy of a phase, failures outside the known phases count as find_creator ones"""
+    policies = policies or DEFAULT_RETRY_POLICIES
+    return policies.get(phase, policies[FIND_CREATOR])
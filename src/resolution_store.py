@@ -0,0 +1,123 @@
+import sqlite3
+import time
+from collections import Counter
+from os import getenv
+from typing import Optional
+
+from creator_index import normalize_handle
+from creator_search import Resolution, RESOLVED, NOT_FOUND, AMBIGUOUS
+
+RESOLUTION_STORE_FILE = getenv('RESOLUTION_STORE_FILE', 'creator_resolutions.db')
+
+# The search errored (page, network, captcha), a later run resolves the creator again
+FAILED = 'failed'
+# Resolutions the send phase acts on, a creator with any other status is searched as usual
+SKIPPED_STATUSES = (NOT_FOUND, AMBIGUOUS)
+
+
+def skipped_result(job: dict, resolution: dict) -> dict:
+    """Result of a job whose creator resolve_creators.py could not tell apart, or did not find"""
+    status = resolution['status']
+    return {
+        'creator': job.get('creator'),
+        'agency_campaign_id': job.get('agency_campaign_id'),
+        'success': False,
+        'attempts': 0,
+        'phase': 'resolve',
+        # searching again would end the same way, the creator id has to be set by hand
+        'error': f'Creator is {status}, set their id with resolve_creators.py --set_creator_id',
+        status: True,
+    }
+
+
+class ResolutionStore:
+    """Outcome of resolving each creator of a campaign ahead of the send, see resolve_creators.py"""
+
+    def __init__(self, db_file: str = RESOLUTION_STORE_FILE):
+        """
+        Open (and create if needed) the resolution database
+
+        Args:
+            db_file: Path of the SQLite database, shared by the resolve and send runs
+        """
+        self.db_file = db_file
+        self.connection = sqlite3.connect(
+            db_file, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS resolutions (
+                agency_campaign_id TEXT NOT NULL,
+                creator TEXT NOT NULL,
+                status TEXT NOT NULL,
+                creator_id TEXT,
+                candidates INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                resolved_at REAL NOT NULL,
+                PRIMARY KEY (agency_campaign_id, creator)
+            )
+        """)
+        self.connection.commit()
+
+    def get(self, agency_campaign_id: str, creator: str) -> Optional[dict]:
+        """Return the status, creator_id, candidates and error recorded for a creator of a campaign"""
+        row = self.connection.execute(
+            'SELECT status, creator_id, candidates, error FROM resolutions '
+            'WHERE agency_campaign_id = ? AND creator = ?',
+            (agency_campaign_id, normalize_handle(creator))).fetchone()
+        if not row:
+            return None
+        return dict(zip(('status', 'creator_id', 'candidates', 'error'), row))
+
+    def record(self, agency_campaign_id: str, resolution: Resolution) -> None:
+        """Store the outcome of a search"""
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO resolutions '
+                '(agency_campaign_id, creator, status, creator_id, candidates, error, resolved_at) '
+                'VALUES (?, ?, ?, ?, ?, NULL, ?)',
+                (agency_campaign_id, normalize_handle(resolution.handle), resolution.status,
+                 resolution.creator_id, resolution.candidates, time.time()))
+
+    def assign(self, agency_campaign_id: str, creator: str, creator_id: str) -> None:
+        """Resolve a creator by hand, e.g. an ambiguous one whose id was looked up on their profile"""
+        self.record(agency_campaign_id, Resolution(creator, RESOLVED, creator_id))
+
+    def record_failure(self, agency_campaign_id: str, creator: str, error: str) -> None:
+        """Store a search that errored, unless the creator was already resolved by an earlier run"""
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO resolutions (agency_campaign_id, creator, status, error, resolved_at) '
+                'VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (agency_campaign_id, creator) DO UPDATE SET '
+                'error = excluded.error, resolved_at = excluded.resolved_at WHERE status = ?',
+                (agency_campaign_id, normalize_handle(creator), FAILED, error, time.time(), FAILED))
+
+    def unresolved(self, agency_campaign_id: str, creators: list[str]) -> list[str]:
+        """Creators of the list that have no final status yet (never searched or failed)"""
+        final = {row[0] for row in self.connection.execute(
+            'SELECT creator FROM resolutions WHERE agency_campaign_id = ? AND status != ?',
+            (agency_campaign_id, FAILED))}
+        return [creator for creator in creators if normalize_handle(creator) not in final]
+
+    def counts(self, agency_campaign_id: str) -> Counter:
+        """Number of creators per status"""
+        return Counter(dict(self.connection.execute(
+            'SELECT status, COUNT(*) FROM resolutions WHERE agency_campaign_id = ? GROUP BY status',
+            (agency_campaign_id,))))
+
+    def failed(self, agency_campaign_id: str) -> dict:
+        """creator -> error of the creators whose search errored"""
+        return dict(self.connection.execute(
+            'SELECT creator, error FROM resolutions WHERE agency_campaign_id = ? AND status = ?',
+            (agency_campaign_id, FAILED)))
+
+    def skipped(self, agency_campaign_id: str) -> dict:
+        """creator -> status of the creators the send skips, until their id is assigned"""
+        return dict(self.connection.execute(
+            f'SELECT creator, status FROM resolutions WHERE agency_campaign_id = ? '
+            f'AND status IN ({", ".join("?" * len(SKIPPED_STATUSES))})',
+            (agency_campaign_id, *SKIPPED_STATUSES)))
+
+    def close(self) -> None:
+
+        self.connection.close()
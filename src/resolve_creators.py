@@ -0,0 +1,310 @@
+import asyncio
+import json
+import time
+from typing import Optional
+
+from playwright.async_api import async_playwright, BrowserContext
+from async_outreach_bot import AsyncOutreachMessageBot
+from outreach_bot import SessionExpiredError
+from creator_search import CreatorNotFoundError, RESOLVED, NOT_FOUND, AMBIGUOUS
+from creator_index import CreatorIndex, normalize_handle
+
+from resolution_store import ResolutionStore, FAILED
+from sent_ledger import SentLedger
+from network_policy import NetworkPolicy
+from bot_context import new_bot_context_async
+from session_cache import SessionCache
+from send_batch import read_jobs
+from lifecycle import ContextRecycler
+from send_message import IS_PROD
+from set_cookies import business_cookies
+from sentry import init_sentry
+from metrics import registry
+from logger import get_logger, log_context
+
+logger = get_logger(__name__)
+
+# Pages searching at the same time, all in the account's one context
+DEFAULT_CONCURRENCY = 3
+
+
+def read_creators(creators_file: str) -> list[str]:
+    """
+    Read the creator handles of a campaign, without duplicates
+
+    Args:
+        creators_file: Text file with one handle per line, or a jobs file (.jsonl/.csv) of send_batch.py
+    """
+    if creators_file.endswith(('.jsonl', '.csv')):
+        handles = [job.get('creator') or '' for job in read_jobs(creators_file)]
+    else:
+        with open(creators_file) as f:
+            handles = list(f)
+    creators = {}
+    for handle in handles:
+        handle = handle.strip().lstrip('@')
+        if handle:
+            creators.setdefault(handle.lower(), handle)
+    return list(creators.values())
+
+
+async def resolve_on_page(bot: AsyncOutreachMessageBot, agency_campaign_id: str, pending: asyncio.Queue,
+                          store: ResolutionStore, counts: dict, stop: asyncio.Event,
+                          creator_index: Optional[CreatorIndex] = None,
+                          recycler: Optional[ContextRecycler] = None) -> Optional[str]:
+    """
+    Resolve creators from the queue one after the other on a single creators page
+
+    Returns:
+        str: Why the page's context should be recycled, None once the queue is empty or the run stopped
+    """
+    on_search_page = False
+    searched = False
+    while not stop.is_set():
+        if recycler and searched:
+            reason = recycler.job_done()
+            if reason:
+                return reason
+        try:
+            creator = pending.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+        searched = True
+        with log_context():
+            try:
+                # The search input stays on the page, so later searches skip loading it again
+                if not on_search_page:
+                    await bot.open_search()
+                    on_search_page = True
+                resolution = await bot.search(creator)
+                if resolution is None:
+                    raise Exception('The search response could not be captured or read')
+            except CreatorNotFoundError as e:
+                resolution = e.resolution
+            except Exception as e:
+                logger.warning(f"Could not resolve '{creator}': {e}")
+                store.record_failure(agency_campaign_id, creator, str(e))
+                counts[FAILED] += 1
+                on_search_page = False
+                if isinstance(e, SessionExpiredError):
+                    # Every other page would fail the same way
+                    stop.set()
+                else:
+                    await bot.captcha_watcher.solve_pending_async(bot.page)
+                continue
+
+            store.record(agency_campaign_id, resolution)
+            counts[resolution.status] += 1
+            if resolution.status == RESOLVED and creator_index and bot.shop_id:
+                # The send then goes straight to the IM page
+                creator_index.record(bot.index_scope(), creator, bot.shop_id, resolution.creator_id)
+
+
+async def run_resolution(context: BrowserContext, agency_campaign_id: str, creators: list[str],
+                         store: ResolutionStore, concurrency: int = DEFAULT_CONCURRENCY,
+                         creator_index: Optional[CreatorIndex] = None, shop_id: Optional[str] = None,
+                         network_policy: Optional[NetworkPolicy] = None, account: Optional[str] = None) -> dict:
+    """
+    Resolve the creators with `concurrency` pages searching in parallel, each in a context
+    logged in like `context` and replaced as ContextRecycler decides
+
+    Args:
+        shop_id: Shop of the account, lets resolved creators be recorded in the creator index
+        account: Account the creator index entries are scoped by, the shop_id's when None
+
+    Returns:
+        dict: Creator count per status, elapsed seconds, creators resolved per minute and
+            the creators whose search errored, with their error
+    """
+    pending = asyncio.Queue()
+    for creator in creators:
+        pending.put_nowait(creator)
+    counts = {RESOLVED: 0, NOT_FOUND: 0, AMBIGUOUS: 0, FAILED: 0}
+    stop = asyncio.Event()
+
+    # Each page gets a context of its own, so one can be replaced without disturbing the others
+    storage_state = await context.storage_state()
+    recycled = []
+
+    async def worker() -> None:
+        recycler = ContextRecycler()
+        reason = 'start'
+        while reason and not stop.is_set():
+            own_context = await new_bot_context_async(context.browser, storage_state, network_policy)
+            try:
+                page = await own_context.new_page()
+                bot = AsyncOutreachMessageBot(page, creator_index)
+                bot.shop_id = shop_id
+                bot.account = account
+                await bot.watch_page(page)
+                reason = await resolve_on_page(bot, agency_campaign_id, pending, store, counts, stop,
+                                               creator_index, recycler)
+            finally:
+                await own_context.close()
+            if reason:
+                logger.info(f'Recycling a search context: {reason}')
+                recycler.reset()
+        recycled.append(recycler.recycled)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(creators)))))
+    elapsed = time.perf_counter() - started
+
+    searched = sum(counts.values())
+    failed = store.failed(agency_campaign_id)
+    # Creators left in the queue when the session expired count as failed too
+    while not pending.empty():
+        failed.setdefault(normalize_handle(pending.get_nowait()), 'not searched')
+    return {
+        'agency_campaign_id': agency_campaign_id,
+        'creators': len(creators),
+        **counts,
+        'elapsed': round(elapsed, 2),
+        'per_minute': round(searched / elapsed * 60, 1) if elapsed else None,
+        'failed_creators': failed,
+        'session_expired': stop.is_set(),
+        'contexts_recycled': sum(recycled),
+    }
+
+
+async def resolve_campaign(creators_file: str, agency_campaign_id: str, concurrency: int = DEFAULT_CONCURRENCY,
+                           account: Optional[str] = None, sessionid_cookie: Optional[str] = None,
+                           web_id_cookie: Optional[str] = None, shop_id: Optional[str] = None,
+                           retry_failed: bool = True, output_file: Optional[str] = None) -> dict:
+    """
+    Resolve every creator of a campaign ahead of its send
+
+    Args:
+        retry_failed: Search again the creators whose last search errored, the others are
+            never searched twice
+        output_file: JSON file to save the report to
+    """
+    session_cache = SessionCache()
+    storage_state = session_cache.load(account) if account else None
+    if not storage_state and not (sessionid_cookie and web_id_cookie):
+        raise ValueError(
+            'No cached session for this account, pass --sessionid_cookie and --web_id_cookie or run login.py first')
+
+    store = ResolutionStore()
+    creator_index = CreatorIndex()
+    network_policy = NetworkPolicy.from_env()
+    creators = read_creators(creators_file)
+    # Creators already messaged in the campaign need no search
+    ledger = SentLedger()
+    todo = ledger.unsent(agency_campaign_id, store.unresolved(agency_campaign_id, creators))
+    ledger.close()
+    if not retry_failed:
+        failed = store.failed(agency_campaign_id)
+        todo = [creator for creator in todo if normalize_handle(creator) not in failed]
+    logger.info(f'Resolving {len(todo)} of the {len(creators)} creators of campaign {agency_campaign_id}')
+
+    try:
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=IS_PROD)
+            context = await new_bot_context_async(
+                browser, storage_state,
+                cookies=None if storage_state else business_cookies(sessionid_cookie, web_id_cookie))
+            report = await run_resolution(context, agency_campaign_id, todo, store, concurrency,
+                                          creator_index, shop_id, network_policy, account)
+            await browser.close()
+        if report['session_expired'] and account:
+            session_cache.invalidate(account)
+    finally:
+        totals = store.counts(agency_campaign_id)
+        skipped = store.skipped(agency_campaign_id)
+        store.close()
+        creator_index.close()
+
+    report['totals'] = dict(totals)
+    report['skipped_creators'] = skipped
+    logger.info(f"Resolved {report[RESOLVED]}, not found {report[NOT_FOUND]}, ambiguous {report[AMBIGUOUS]}, "
+                f"failed {report[FAILED]} in {report['elapsed']}s ({report['per_minute']} creators/min)")
+    if report['failed_creators']:
+        logger.warning(f"Failed creators: {', '.join(sorted(report['failed_creators']))}")
+    if skipped:
+        # the send skips them until their id is assigned by hand, see assign_creator_ids
+        listed = ', '.join(f'{creator} ({status})' for creator, status in sorted(skipped.items()))
+        logger.warning(f'Creators the send will skip: {listed}')
+    logger.info(f'Step timings: {registry.summary()}')
+    if output_file:
+        with open(output_file, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def assign_creator_ids(agency_campaign_id: str, assignments: list[str]) -> None:
+    """
+    Resolve creators by hand, typically the ambiguous ones of the report whose id was looked up on the site
+
+    Args:
+        assignments: 'handle=creator_id' strings
+    """
+    store = ResolutionStore()
+    try:
+        for assignment in assignments:
+            creator, separator, creator_id = assignment.partition('=')
+            if not separator or not creator.strip() or not creator_id.strip():
+                raise ValueError(f'Expected handle=creator_id, got: {assignment}')
+            store.assign(agency_campaign_id, creator, creator_id.strip())
+            logger.info(f"Resolved '{normalize_handle(creator)}' to {creator_id.strip()} by hand")
+    finally:
+        store.close()
+
+
+def main(creators_file: str, agency_campaign_id: str, concurrency: int = DEFAULT_CONCURRENCY,
+         account: Optional[str] = None, sessionid_cookie: Optional[str] = None,
+         web_id_cookie: Optional[str] = None, shop_id: Optional[str] = None,
+         retry_failed: bool = True, output_file: Optional[str] = None) -> dict:
+    return asyncio.run(resolve_campaign(creators_file, agency_campaign_id, concurrency, account,
+                                        sessionid_cookie, web_id_cookie, shop_id, retry_failed, output_file))
+
+
+if __name__ == "__main__":
+    """_summary_ Resolve the creators of a campaign before sending it, so the send skips the search.
+    Args:
+        creators (str): Text file with one creator handle per line, or the campaign's jobs file (.jsonl/.csv)
+        agency_campaign_id (str): Agency campaign ID the resolutions are stored under
+        concurrency (int): Pages searching at the same time
+        account (str): Seller center email whose session was cached by login.py
+        sessionid_cookie (str): Session ID cookie value (not needed when the account's session is cached)
+        web_id_cookie (str): Web ID cookie value (not needed when the account's session is cached)
+        shop_id (str): Shop ID of the account, to index resolved creators so the send goes straight to IM
+        output (str): JSON file to save the report to
+        set_creator_id (str): handle=creator_id of a creator to resolve by hand instead of searching, repeatable
+
+    Usage example: python resolve_creators.py --creators creators.txt --agency_campaign_id <id> --account <email>
+    Usage example: python resolve_creators.py --agency_campaign_id <id> --set_creator_id <handle>=<creator_id>
+    """
+    init_sentry()
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Resolve the creators of a campaign ahead of its send.')
+    parser.add_argument('--creators',
+                        help='Text file with one handle per line, or a jobs file (.jsonl/.csv)')
+    parser.add_argument('--agency_campaign_id', required=True,
+                        help='Agency campaign ID')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Pages searching at the same time')
+    parser.add_argument('--account',
+                        help='Seller center email whose session was cached by login.py')
+    parser.add_argument('--sessionid_cookie',
+                        help='Session ID cookie value')
+    parser.add_argument('--web_id_cookie',
+                        help='Web ID cookie value')
+    parser.add_argument('--shop_id', default=None,
+                        help='Shop ID of the account, resolved creators are then indexed for a direct IM')
+    parser.add_argument('--skip_failed', action='store_true',
+                        help='Do not search again the creators whose last search errored')
+    parser.add_argument('--output', default=None,
+                        help='JSON file to save the report to')
+    parser.add_argument('--set_creator_id', action='append', default=[],
+                        help='handle=creator_id of a skipped creator whose id was looked up by hand, repeatable')
+    args = parser.parse_args()
+    if args.set_creator_id:
+        assign_creator_ids(args.agency_campaign_id, args.set_creator_id)
+    if args.creators:
+        main(args.creators, args.agency_campaign_id, args.concurrency, args.account,
+             args.sessionid_cookie, args.web_id_cookie, args.shop_id, not args.skip_failed, args.output)
+    elif not args.set_creator_id:
+        parser.error('--creators or --set_creator_id is required')
+
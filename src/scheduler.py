@@ -0,0 +1,393 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from os import getenv
+from typing import Optional
+
+from playwright.async_api import async_playwright
+from async_send_batch import run_job
+from bot_session import AsyncBotSession
+from send_batch import read_jobs, COOKIE_FIELDS
+from send_message import IS_PROD
+from creator_index import CreatorIndex
+from resolution_store import ResolutionStore
+from sent_ledger import SentLedger, already_sent_result
+from network_policy import NetworkPolicy
+from session_cache import SessionCache
+from sentry import init_sentry
+from metrics import registry, write_metrics
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Defaults of the accounts file fields
+ACCOUNT_MESSAGES_PER_HOUR = float(getenv('ACCOUNT_MESSAGES_PER_HOUR', '60'))
+ACCOUNT_BURST = int(getenv('ACCOUNT_BURST', '3'))
+ACCOUNT_CONCURRENCY = int(getenv('ACCOUNT_CONCURRENCY', '1'))
+# A job that ran into a captcha multiplies its account's rate by this factor and pauses the
+# account, doubling the pause for each further captcha in a row
+CAPTCHA_BACKOFF = float(getenv('CAPTCHA_BACKOFF', '0.5'))
+CAPTCHA_COOLDOWN = float(getenv('CAPTCHA_COOLDOWN', '120'))  # seconds
+MAX_CAPTCHA_COOLDOWN = 1800
+# Captcha-free jobs after which a backed off account gets this share of its rate back
+RECOVERY_JOBS = 5
+RECOVERY_STEP = 0.1
+# Floor of a backed off rate, as a share of the configured one
+MIN_RATE_SHARE = 0.1
+DEFAULT_CONCURRENCY = 8
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = 1, now: Optional[float] = None):
+        """
+        Args:
+            rate: Tokens added per second
+            burst: Most tokens the bucket holds, i.e. jobs started back to back after an idle time
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def refund(self) -> None:
+        """Give back the token of a job that ended up not sending"""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available"""
+        self.refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class Account:
+    def __init__(self, name: str, credentials: dict, messages_per_hour: float = ACCOUNT_MESSAGES_PER_HOUR,
+                 burst: int = ACCOUNT_BURST, concurrency: int = ACCOUNT_CONCURRENCY, now: Optional[float] = None):
+        """
+        A seller account jobs are sharded to
+
+        Args:
+            credentials: Job fields that log the account in, sessionid_cookie and web_id_cookie
+                unless login.py cached its session
+            messages_per_hour: Rate the account is allowed when no captchas show up
+            concurrency: Jobs the account runs at the same time
+        """
+        self.name = name
+        self.credentials = credentials
+        self.base_rate = messages_per_hour / 3600
+        self.bucket = TokenBucket(self.base_rate, burst, now)
+        self.concurrency = concurrency
+        self.running = 0
+        self.paused_until = 0.0
+        self.captcha_streak = 0
+        self.clean_jobs = 0
+        self.disabled = None  # reason the account no longer gets jobs
+        self.sent = self.failed = self.skipped = self.captchas = 0
+
+    @property
+    def messages_per_hour(self) -> float:
+        return round(self.bucket.rate * 3600, 1)
+
+    def ready_in(self, now: float) -> Optional[float]:
+        """Seconds until the account can start a job, None if it is busy or disabled"""
+        if self.disabled or self.running >= self.concurrency:
+            return None
+        return max(self.paused_until - now, self.bucket.wait_time(now))
+
+    def record(self, result: dict, now: float) -> None:
+        """Adapt the rate to a finished job: back off on captchas, recover slowly without"""
+        self.running -= 1
+        if not send_attempted(result):
+            # The rate paces messages, a job that stopped before sending one gives its token back
+            self.bucket.refund()
+            self.skipped += 1
+            return
+        if result.get('success'):
+            self.sent += 1
+        else:
+            self.failed += 1
+        if result.get('session_expired'):
+            self.disabled = 'session expired'
+            logger.warning(f"Account {self.name}: session expired, no more jobs are sent from it")
+            return
+
+        captchas = result.get('captchas') or 0
+        if captchas:
+            self.captchas += captchas
+            self.captcha_streak += 1
+            self.clean_jobs = 0
+            self.bucket.rate = max(self.base_rate * MIN_RATE_SHARE, self.bucket.rate * CAPTCHA_BACKOFF)
+            cooldown = min(MAX_CAPTCHA_COOLDOWN, CAPTCHA_COOLDOWN * 2 ** (self.captcha_streak - 1))
+            self.paused_until = now + cooldown
+            self.bucket.tokens = 0
+            logger.warning(f'Account {self.name}: {captchas} captchas, pausing {cooldown:.0f}s, '
+                           f'rate down to {self.messages_per_hour}/h')
+            return
+
+        self.captcha_streak = 0
+        self.clean_jobs += 1
+        if self.clean_jobs >= RECOVERY_JOBS and self.bucket.rate < self.base_rate:
+            self.clean_jobs = 0
+            self.bucket.rate = min(self.base_rate, self.bucket.rate + self.base_rate * RECOVERY_STEP)
+            logger.info(f'Account {self.name}: rate back up to {self.messages_per_hour}/h')
+
+    def stats(self) -> dict:
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'captchas': self.captchas,
+            'messages_per_hour': self.messages_per_hour,
+            'disabled': self.disabled,
+        }
+
+
+def send_attempted(result: dict) -> bool:
+    """
+    Whether a job got as far as trying to send its message
+
+    Jobs that failed to read, were sent by an earlier run, were skipped for their
+    resolution or crashed while setting up made no attempt; neither did a job whose
+    message the ledger claimed for another run in the meantime.
+    """
+    return bool(result.get('attempts')) and not result.get('already_sent')
+
+
+class Scheduler:
+    """
+    Shards outreach jobs across seller accounts
+
+    Each account starts jobs at its own token bucket rate, which captchas cut
+    down and captcha-free jobs slowly restore, so one account being pushed too
+    hard doesn't hold back the others. Campaigns are served round-robin, so a
+    large campaign can't starve the small ones. A job with an `account` field
+    only runs on that account, the others go to whichever account is free.
+    """
+
+    def __init__(self, accounts: list[Account]):
+        self.accounts = {account.name: account for account in accounts}
+        # campaign -> account name (None for any account) -> jobs
+        self.queues = OrderedDict()
+        self.pending = 0
+
+    def add(self, job: dict) -> None:
+        account = job.get('account') or None
+        campaign = self.queues.setdefault(job.get('agency_campaign_id'), {})
+        campaign.setdefault(account, deque()).append(job)
+        self.pending += 1
+
+    def next_job(self, now: Optional[float] = None) -> tuple[Optional[Account], Optional[dict], Optional[float]]:
+        """
+        Pick the next job to start and the account to run it on
+
+        Returns:
+            tuple: (account, job, None) when a job can start now, else (None, None, seconds until
+                one may start), with None seconds if only a running job finishing can free one
+        """
+        now = time.monotonic() if now is None else now
+        wait = None
+        for account in self.accounts.values():
+            account.bucket.refill(now)
+        # Fullest buckets first, so work spreads over the accounts
+        for account in sorted(self.accounts.values(), key=lambda a: -a.bucket.tokens):
+            ready_in = account.ready_in(now)
+            if ready_in is None or not self._has_job_for(account):
+                continue
+            if ready_in > 0 or not account.bucket.take(now):
+                wait = ready_in if wait is None else min(wait, ready_in)
+                continue
+            job = self._pop_job_for(account)
+            account.running += 1
+            return account, job, None
+        return None, None, wait
+
+    def drop_unrunnable(self) -> list[dict]:
+        """Remove the jobs no account can run any more (their account is unknown or disabled)"""
+        dropped = []
+        for campaign in self.queues.values():
+            for name in list(campaign):
+                if name is None and any(not a.disabled for a in self.accounts.values()):
+                    continue
+                if name in self.accounts and not self.accounts[name].disabled:
+                    continue
+                dropped.extend(campaign.pop(name))
+        self.pending -= len(dropped)
+        return dropped
+
+    def _has_job_for(self, account: Account) -> bool:
+        return any(campaign.get(account.name) or campaign.get(None) for campaign in self.queues.values())
+
+    def _pop_job_for(self, account: Account) -> dict:
+        for campaign_id, campaign in self.queues.items():
+            queue = campaign.get(account.name) or campaign.get(None)
+            if queue:
+                # The served campaign goes to the back of the round-robin
+                self.queues.move_to_end(campaign_id)
+                self.pending -= 1
+                return queue.popleft()
+        raise LookupError(f'No job for account {account.name}')
+
+
+def read_accounts(accounts_file: str) -> list[Account]:
+    """
+    Read the seller accounts jobs are sharded to
+
+    Args:
+        accounts_file: JSONL or CSV file with an `account` per line, its sessionid_cookie and
+            web_id_cookie unless login.py cached its session, and optionally messages_per_hour,
+            burst and concurrency
+    """
+    accounts = []
+    for row in read_jobs(accounts_file):
+        if not row.get('account'):
+            raise ValueError(f'Account without a name in {accounts_file}: {row}')
+        accounts.append(Account(
+            row['account'],
+            {field: row[field] for field in COOKIE_FIELDS if row.get(field)},
+            float(row.get('messages_per_hour') or ACCOUNT_MESSAGES_PER_HOUR),
+            int(row.get('burst') or ACCOUNT_BURST),
+            int(row.get('concurrency') or ACCOUNT_CONCURRENCY)))
+    return accounts
+
+
+async def run_scheduled(jobs_file: str, accounts_file: str, output_file: str,
+                        concurrency: int = DEFAULT_CONCURRENCY, metrics_file: Optional[str] = None) -> dict:
+    """
+    Send every job of jobs_file through the accounts of accounts_file
+
+    Args:
+        concurrency: Most jobs running at the same time over all accounts
+
+    Returns:
+        dict: Per account stats: sent, failed, captchas, current rate and why it was disabled
+    """
+    scheduler = Scheduler(read_accounts(accounts_file))
+    ledger = SentLedger()
+    already_sent = []
+    # Jobs of a rerun that were sent before take no account's turn
+    for job in ledger.filter_jobs(read_jobs(jobs_file), already_sent):
+        scheduler.add(job)
+    if already_sent:
+        logger.info(f'Skipping {len(already_sent)} jobs sent by an earlier run')
+    creator_index = CreatorIndex()
+    network_policy = NetworkPolicy.from_env()
+    session_cache = SessionCache()
+    resolutions = ResolutionStore()
+    running = set()
+    # Idle contexts of each account, kept open with their IM tab for the account's next jobs
+    idle_sessions = {}
+    started = time.monotonic()
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=IS_PROD)
+        with open(output_file, 'a') as output:
+
+            def write(result: dict) -> None:
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+
+            for job in already_sent:
+                write(already_sent_result(job))
+
+            async def run(account: Account, job: dict) -> None:
+                sessions = idle_sessions.setdefault(account.name, [])
+                session = sessions.pop() if sessions else AsyncBotSession(browser, network_policy)
+                try:
+                    result = await run_job(browser, {**job, **account.credentials, 'account': account.name},
+                                           creator_index, network_policy, session_cache, resolutions, ledger,
+                                           session)
+                except Exception as e:
+                    logger.error(f"Job for creator '{job.get('creator')}' crashed: {e}")
+                    result = {'creator': job.get('creator'), 'agency_campaign_id': job.get('agency_campaign_id'),
+                              'success': False, 'phase': 'setup_page', 'error': str(e)}
+                result['account'] = account.name
+                account.record(result, time.monotonic())
+                if account.disabled:
+                    await session.close()
+                else:
+                    sessions.append(session)
+                write(result)
+
+            while scheduler.pending or running:
+                for job in scheduler.drop_unrunnable():
+                    write({'creator': job.get('creator'), 'agency_campaign_id': job.get('agency_campaign_id'),
+                           'account': job.get('account'), 'success': False, 'attempts': 0,
+                           'phase': 'schedule', 'error': 'No usable account for this job'})
+                wait = None
+                while len(running) < concurrency:
+                    account, job, wait = scheduler.next_job()
+                    if not job:
+                        break
+                    running.add(asyncio.create_task(run(account, job)))
+                if not running and wait is None:
+                    break
+                # Wake up when a job finishes or the next account is ready, whichever comes first
+                if running:
+                    done, _ = await asyncio.wait(running, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                    running -= done
+                else:
+                    await asyncio.sleep(wait)
+
+            for sessions in idle_sessions.values():
+                for session in sessions:
+                    await session.close()
+        await browser.close()
+
+    elapsed = time.monotonic() - started
+    stats = {name: account.stats() for name, account in scheduler.accounts.items()}
+    sent = sum(account['sent'] for account in stats.values())
+    logger.info(f'Finished scheduled batch: {sent} sent in {elapsed:.0f}s '
+                f'({sent / elapsed * 3600 if elapsed else 0:.0f} messages/hour)')
+    for name, account_stats in stats.items():
+        logger.info(f'Account {name}: {account_stats}')
+    logger.info(f'Step timings: {registry.summary()}')
+    if metrics_file:
+        write_metrics(metrics_file)
+    return stats
+
+
+def main(jobs_file: str, accounts_file: str, output_file: str, concurrency: int = DEFAULT_CONCURRENCY,
+         metrics_file: Optional[str] = None) -> dict:
+    return asyncio.run(run_scheduled(jobs_file, accounts_file, output_file, concurrency, metrics_file))
+
+
+if __name__ == "__main__":
+    """_summary_ Send a batch of jobs through several seller accounts, each at its own captcha-aware rate.
+    Args:
+        jobs (str): JSONL or CSV file with creator, message and agency_campaign_id per job, and
+            optionally the account the job must be sent from
+        accounts (str): JSONL or CSV file with account, sessionid_cookie and web_id_cookie (unless
+            login.py cached the session), and optionally messages_per_hour, burst and concurrency
+        output (str): JSONL file the per-job results are appended to as each job finishes
+        concurrency (int): Most jobs running at the same time over all accounts
+        metrics (str): Optional file to save step timings to (.prom for Prometheus text, JSON otherwise)
+
+    Usage example: python scheduler.py --jobs jobs.jsonl --accounts accounts.jsonl --output results.jsonl
+    """
+    init_sentry()
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Shard outreach jobs across several seller accounts.')
+    parser.add_argument('--jobs', required=True,
+                        help='JSONL or CSV file with one job per line')
+    parser.add_argument('--accounts', required=True,
+                        help='JSONL or CSV file with one seller account per line')
+    parser.add_argument('--output', required=True,
+                        help='JSONL file to append per-job results to')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Most jobs running at the same time over all accounts')
+    parser.add_argument('--metrics', default=None,
+                        help='File to save step timings to, Prometheus text if it ends with .prom, JSON otherwise')
+    args = parser.parse_args()
+    main(args.jobs, args.accounts, args.output, args.concurrency, args.metrics)
@@ -0,0 +1,214 @@
+import atexit
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from typing import Optional
+from urllib.parse import quote, unquote
+
+from aws import ScreenshotStorage
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# jpeg and png are encoded by the browser, webp needs Pillow
+SCREENSHOT_FORMAT = getenv('SCREENSHOT_FORMAT', 'jpeg').lower()
+SCREENSHOT_QUALITY = int(getenv('SCREENSHOT_QUALITY', '70'))
+# Wider screenshots are downscaled before upload when Pillow is installed, 0 keeps the size
+SCREENSHOT_MAX_WIDTH = int(getenv('SCREENSHOT_MAX_WIDTH', '0'))
+SCREENSHOT_UPLOAD_WORKERS = int(getenv('SCREENSHOT_UPLOAD_WORKERS', '2'))
+# Screenshots whose upload failed wait here until the next service start
+SCREENSHOT_SPOOL_DIR = getenv('SCREENSHOT_SPOOL_DIR', '.screenshot-spool')
+
+CONTENT_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+
+def content_type(object_key: str) -> str:
+    extension = object_key.rsplit('.', 1)[-1]
+    return next((CONTENT_TYPES[image_format] for image_format, ext in EXTENSIONS.items()
+                 if ext == extension), 'application/octet-stream')
+
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ScreenshotService:
+    """
+    Captures debug screenshots into memory and uploads them in the background
+
+    capture() returns the screenshot's final URL right away, so failure paths
+    (retries, Sentry events) don't wait on S3. Uploads that fail are written
+    to a local spool directory and retried by flush_spool.
+    """
+
+    def __init__(self, storage: Optional[ScreenshotStorage] = None, image_format: str = SCREENSHOT_FORMAT,
+                 quality: int = SCREENSHOT_QUALITY, max_width: int = SCREENSHOT_MAX_WIDTH,
+                 spool_dir: str = SCREENSHOT_SPOOL_DIR, workers: int = SCREENSHOT_UPLOAD_WORKERS):
+        """
+        Args:
+            storage: S3 storage to upload to, ScreenshotStorage() by default
+            image_format: png, jpeg or webp (webp falls back to jpeg without Pillow)
+            quality: JPEG/WebP quality, 0-100
+            max_width: Downscale wider screenshots to this width (needs Pillow), 0 to keep the size
+            spool_dir: Directory keeping screenshots whose upload failed
+            workers: Number of upload threads
+        """
+        if image_format not in CONTENT_TYPES:
+            raise ValueError(f"Unsupported screenshot format '{image_format}'")
+        if image_format == 'webp' and Image is None:
+            logger.warning('Pillow is not installed, saving screenshots as JPEG instead of WebP')
+            image_format = 'jpeg'
+        if max_width and Image is None:
+            logger.warning('Pillow is not installed, screenshots will not be downscaled')
+            max_width = 0
+
+        self.storage = storage or ScreenshotStorage()
+        self.image_format = image_format
+        self.quality = quality
+        self.max_width = max_width
+        self.spool_dir = spool_dir
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='screenshot-upload')
+        self.uploaded = 0
+        self.spooled = 0
+        self._lock = threading.Lock()
+
+    def screenshot_options(self) -> dict:
+        """Keyword arguments for page.screenshot matching the service's format"""
+        # The browser encodes png/jpeg itself, webp is re-encoded from a png
+        if self.image_format == 'jpeg':
+            return {'type': 'jpeg', 'quality': self.quality, 'scale': 'css'}
+        return {'type': 'png', 'scale': 'css'}
+
+    def capture(self, page, name: str) -> Optional[str]:
+        """Screenshot a sync page and queue its upload"""
+        try:
+            screenshot_bytes = page.screenshot(**self.screenshot_options())
+        except Exception as e:
+            logger.warning(f"Could not take screenshot '{name}': {e}")
+            return None
+        return self.submit(screenshot_bytes, name)
+
+    async def capture_async(self, page, name: str) -> Optional[str]:
+        """Screenshot an async page and queue its upload"""
+        try:
+            screenshot_bytes = await page.screenshot(**self.screenshot_options())
+        except Exception as e:
+            logger.warning(f"Could not take screenshot '{name}': {e}")
+            return None
+        return self.submit(screenshot_bytes, name)
+
+    def submit(self, screenshot_bytes: bytes, name: str) -> str:
+        """
+        Queue the upload of a screenshot taken with screenshot_options()
+
+        Returns:
+            str: URL the screenshot will be available at once uploaded
+        """
+        object_key = self.storage.object_key(name, EXTENSIONS[self.image_format])
+        self.executor.submit(self._upload, object_key, screenshot_bytes)
+        return self.storage.object_url(object_key)
+
+    def flush_spool(self) -> int:
+        """Queue the uploads of spooled screenshots, returns how many were queued"""
+        try:
+            names = sorted(os.listdir(self.spool_dir))
+        except FileNotFoundError:
+            return 0
+
+        queued = 0
+        for file_name in names:
+            path = os.path.join(self.spool_dir, file_name)
+            if file_name.endswith('.tmp') or not os.path.isfile(path):
+                continue
+            # Spooled files are named after their percent-encoded object key
+            object_key = unquote(file_name)
+            self.executor.submit(self._upload_spooled, object_key, path)
+            queued += 1
+        if queued:
+            logger.info(f'Retrying {queued} spooled screenshot uploads')
+        return queued
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Wait for queued uploads, failed ones end up in the spool"""
+        self.executor.shutdown(wait=wait)
+
+    def _encode(self, screenshot_bytes: bytes) -> bytes:
+        if Image is None or (self.image_format != 'webp' and not self.max_width):
+            return screenshot_bytes
+
+        image = Image.open(io.BytesIO(screenshot_bytes))
+        if self.max_width and image.width > self.max_width:
+            height = round(image.height * self.max_width / image.width)
+            image = image.resize((self.max_width, height), Image.LANCZOS)
+        output = io.BytesIO()
+        if self.image_format == 'png':
+            image.save(output, format='PNG', optimize=True)
+        else:
+            image.convert('RGB').save(
+                output, format=self.image_format.upper(), quality=self.quality)
+        return output.getvalue()
+
+    def _upload(self, object_key: str, screenshot_bytes: bytes) -> None:
+        try:
+            body = self._encode(screenshot_bytes)
+        except Exception as e:
+            logger.warning(f'Could not re-encode screenshot {object_key}, uploading it as captured: {e}')
+            body = screenshot_bytes
+
+        try:
+            self.storage.upload(object_key, body, CONTENT_TYPES[self.image_format])
+        except Exception as e:
+            logger.error(f'Screenshot upload of {object_key} failed, spooling it: {e}')
+            self._spool(object_key, body)
+            return
+        with self._lock:
+            self.uploaded += 1
+        logger.info(f'Screenshot uploaded to {self.storage.object_url(object_key)}')
+
+    def _upload_spooled(self, object_key: str, path: str) -> None:
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+            self.storage.upload(object_key, body, content_type(object_key))
+            # a file that can't be removed is uploaded again on the next start, to the same key
+            os.remove(path)
+        except Exception as e:
+            logger.warning(f'Spooled screenshot {object_key} still could not be uploaded: {e}')
+            return
+        with self._lock:
+            self.uploaded += 1
+
+    def _spool(self, object_key: str, body: bytes) -> None:
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            path = os.path.join(self.spool_dir, quote(object_key, safe=''))
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f'Could not spool screenshot {object_key}: {e}')
+            return
+        with self._lock:
+            self.spooled += 1
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_screenshot_service() -> ScreenshotService:
+    """Process-wide screenshot service, created on first use"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ScreenshotService()
+            _service.flush_spool()
+            # Let queued uploads finish (or reach the spool) before the process exits
+            atexit.register(_service.shutdown)
+        return _service
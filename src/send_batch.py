@@ -0,0 +1,234 @@
+import csv
+import json
+import time
+from typing import Callable, Iterator, Optional
+
+from playwright.sync_api import sync_playwright, Browser, Page
+from send_message import retry_with_captchas, IS_PROD
+from outreach_bot import OutreachMessageBot
+from set_cookies import set_business_cookies, business_cookies
+from creator_index import CreatorIndex
+from creator_search import RESOLVED
+from resolution_store import ResolutionStore, SKIPPED_STATUSES, skipped_result
+from sent_ledger import SentLedger, already_sent_result
+from network_policy import NetworkPolicy
+from asset_cache import get_asset_cache
+from bot_context import new_bot_context
+from bot_session import BotSession, session_key
+from session_cache import SessionCache
+from sentry import init_sentry
+from metrics import registry, write_metrics
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+JOB_FIELDS = ('creator', 'message', 'agency_campaign_id')
+# Only needed when the job's `account` has no cached session
+COOKIE_FIELDS = ('sessionid_cookie', 'web_id_cookie')
+
+
+def read_jobs(jobs_file: str) -> Iterator[dict]:
+    """
+    Stream outreach jobs from a JSONL or CSV file
+
+    Args:
+        jobs_file (str): Path to a .jsonl or .csv file, one job per line/row
+
+    Yields:
+        dict: Job with the keys listed in JOB_FIELDS, and either an `account` whose
+            session is cached or the keys listed in COOKIE_FIELDS
+    """
+    with open(jobs_file, newline='') as f:
+        if jobs_file.endswith('.csv'):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def job_resolution(job: dict, resolutions: Optional[ResolutionStore]) -> Optional[dict]:
+    """Resolution stored ahead of time for the job's creator, if any"""
+    if not resolutions or not job.get('agency_campaign_id') or not job.get('creator'):
+        return None
+    return resolutions.get(job['agency_campaign_id'], job['creator'])
+
+
+def job_skip_result(job: dict, storage_state: Optional[str], resolution: Optional[dict],
+                    ledger: Optional[SentLedger]) -> Optional[dict]:
+    """
+    Result of a job that is not run at all
+
+    Args:
+        storage_state: Cached session of the job's account, the cookie fields aren't needed with one
+        resolution: The job's entry of the resolution store, see job_resolution
+
+    Returns:
+        dict: Result of a job missing fields, already sent or whose creator was not resolved; None to run it
+    """
+    required = JOB_FIELDS if storage_state else JOB_FIELDS + COOKIE_FIELDS
+    missing = [field for field in required if not job.get(field)]
+    if missing:
+        return {'success': False, 'attempts': 0, 'phase': 'read_job',
+                'error': f'Missing job fields: {", ".join(missing)}'}
+    if ledger and ledger.is_sent(job['agency_campaign_id'], job['creator']):
+        # A rerun of the campaign, the message went out before
+        return already_sent_result(job)
+    if resolution and resolution['status'] in SKIPPED_STATUSES:
+        return skipped_result(job, resolution)
+    return None
+
+
+def resolved_creator_id(resolution: Optional[dict]) -> Optional[str]:
+    """Creator id of a resolved creator, which lets the bot skip the search"""
+    return resolution['creator_id'] if resolution and resolution['status'] == RESOLVED else None
+
+
+def session_forgetter(session_cache: Optional[SessionCache], account: Optional[str]) -> Callable[..., bool]:
+    """on_session_expired callback dropping the account's cached session, which can't be renewed here"""
+    def forget_session(context) -> bool:
+        if session_cache and account:
+            session_cache.invalidate(account)
+        return False
+
+    return forget_session
+
+
+def new_job_page(browser: Browser, network_policy: Optional[NetworkPolicy] = None,
+                 storage_state: Optional[str] = None) -> Page:
+    """Open a page in a fresh context configured for the bot, logged in if a storage state is given"""
+    # A context per job keeps the session cookies of different accounts apart
+    return new_bot_context(browser, storage_state, network_policy).new_page()
+
+
+def run_job(browser: Browser, job: dict, creator_index: Optional[CreatorIndex] = None,
+            network_policy: Optional[NetworkPolicy] = None, page: Optional[Page] = None,
+            session_cache: Optional[SessionCache] = None,
+            resolutions: Optional[ResolutionStore] = None,
+            ledger: Optional[SentLedger] = None, session: Optional[BotSession] = None) -> dict:
+    """
+    Run a single outreach job in a fresh context of an already launched browser, or in the open context of `session`
+
+    Args:
+        page: Page prepared ahead of time by new_job_page, a new one is opened if not given.
+            Its context is closed when the job finishes. It is left untouched when the
+            job's account has a cached session, since that needs a context of its own.
+        session_cache: Cache to look the job's `account` session up in
+        resolutions: Creators resolved ahead of time, not found and ambiguous ones are skipped
+        ledger: Messages already sent, their jobs are skipped; the job's send is recorded in it
+        session: Context and bot kept open for the next job of the same seller session, `page` is then ignored
+    """
+    started = time.monotonic()
+    result = {
+        'creator': job.get('creator'),
+        'agency_campaign_id': job.get('agency_campaign_id'),
+    }
+
+    account = job.get('account')
+    storage_state = session_cache.load(account) if session_cache and account else None
+    resolution = job_resolution(job, resolutions)
+    skip = job_skip_result(job, storage_state, resolution, ledger)
+    if skip:
+        result.update(skip)
+    else:
+        bot = None
+        try:
+            if session:
+                bot = session.bot_for(
+                    session_key(job, storage_state), storage_state,
+                    None if storage_state else business_cookies(job['sessionid_cookie'], job['web_id_cookie']),
+                    creator_index, ledger)
+                page = bot.page
+            elif storage_state:
+                page = new_job_page(browser, network_policy, storage_state)
+            else:
+                page = page or new_job_page(browser, network_policy)
+                set_business_cookies(
+                    page, job['sessionid_cookie'], job['web_id_cookie'])
+            if not bot:
+                # created here rather than by retry_with_captchas, so a crash can be put down to its phase
+                bot = OutreachMessageBot(page, creator_index, ledger=ledger)
+            result.update(retry_with_captchas(
+                page, job['message'], job['creator'], job['agency_campaign_id'],
+                creator_index=creator_index, on_session_expired=session_forgetter(session_cache, account),
+                creator_id=resolved_creator_id(resolution),
+
+                ledger=ledger, account=account, bot=bot))
+        except Exception as e:
+            logger.error(f"Job for creator '{job['creator']}' crashed: {e}")
+            result.update(success=False, phase=bot and bot.phase or 'setup_page', error=str(e))
+        finally:
+            if session:
+                session.job_done(result)
+            elif page:
+                page.context.close()
+
+    result['duration'] = round(time.monotonic() - started, 3)
+    return result
+
+
+def main(jobs_file: str, output_file: str, metrics_file: Optional[str] = None) -> None:
+    """
+    Args:
+        metrics_file: File to save the step timings to, Prometheus text if it ends with .prom, JSON otherwise
+    """
+    succeeded = failed = 0
+    creator_index = CreatorIndex()
+    network_policy = NetworkPolicy.from_env()
+    session_cache = SessionCache()
+    resolutions = ResolutionStore()
+    ledger = SentLedger()
+    with sync_playwright() as p, open(output_file, 'a') as output:
+        browser = p.chromium.launch(
+            headless=IS_PROD
+        )
+        # Consecutive jobs of a seller session share its context and IM tab
+        session = BotSession(browser, network_policy)
+        try:
+            for job in read_jobs(jobs_file):
+                result = run_job(browser, job, creator_index, network_policy,
+                                 session_cache=session_cache, resolutions=resolutions, ledger=ledger,
+                                 session=session)
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+                if result['success']:
+                    succeeded += 1
+                else:
+                    failed += 1
+        finally:
+            session.close()
+            browser.close()
+
+    logger.info(f'Finished batch: {succeeded} sent, {failed} failed, '
+                f'{session.recycler.recycled} browser contexts replaced.')
+    if network_policy:
+        logger.info(f'Network policy stats: {network_policy.stats()}')
+    if asset_cache := get_asset_cache():
+        logger.info(f'Asset cache stats: {asset_cache.stats()}')
+    logger.info(f'Step timings: {registry.summary()}')
+    if metrics_file:
+        write_metrics(metrics_file)
+
+
+if __name__ == "__main__":
+    """_summary_ Send messages to many creators through one launched browser.
+    Args:
+        jobs (str): JSONL or CSV file with creator, message, agency_campaign_id, and either an account
+            whose session was cached by login.py or sessionid_cookie and web_id_cookie, per job
+        output (str): JSONL file the per-job results are appended to as each job finishes
+        metrics (str): Optional file to save step timings to (.prom for Prometheus text, JSON otherwise)
+
+    Usage example: python send_batch.py --jobs jobs.jsonl --output results.jsonl
+    """
+    init_sentry()
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Send messages for a batch of outreach jobs.')
+    parser.add_argument('--jobs', required=True,
+                        help='JSONL or CSV file with one job per line')
+    parser.add_argument('--output', required=True,
+                        help='JSONL file to append per-job results to')
+    parser.add_argument('--metrics', default=None,
+                        help='File to save step timings to, Prometheus text if it ends with .prom, JSON otherwise')
+    args = parser.parse_args()
+    main(args.jobs, args.output, args.metrics)
@@ -1,11 +1,27 @@
+import itertools
+import sys
+import time
+from collections import Counter
 from os import getenv
-from solve_captcha import main as solve_captcha
-from set_cookies import set_business_cookies
-from playwright.sync_api import sync_playwright, Page
-from playwright_stealth import stealth_sync, StealthConfig
+from typing import Callable, Optional
+from set_cookies import business_cookies
+from playwright.sync_api import sync_playwright, Page, BrowserContext
 from sentry import init_sentry, handle_scraper_exception
-from outreach_bot import OutreachMessageBot
-from logger import get_logger
+from outreach_bot import OutreachMessageBot, SessionExpiredError
+from outreach_bot_base import OutreachBotBase
+from creator_search import CreatorNotFoundError
+from overlays import OverlayGuard
+from captcha_watcher import CaptchaWatcher
+from phases import RetryPolicy, retry_policy
+from creator_index import CreatorIndex
+from sent_ledger import SentLedger
+from network_policy import NetworkPolicy
+from asset_cache import get_asset_cache
+from bot_context import new_bot_context
+from session_cache import SessionCache
+from lifecycle import tree_rss_mb
+from metrics import registry, JOB_DURATION
+from logger import get_logger, log_context
 
 logger = get_logger(__name__)
 
@@ -13,49 +29,178 @@ IS_PROD = getenv('ENVIRONMENT') == 'production'
 TAKE_DEBUG_SCREENS = IS_PROD
 
 
-def setup_page(page: Page):
-    """Configure stealth settings and timeout"""
-    config = StealthConfig(
-        navigator_languages=False,
-        navigator_vendor=False,
-        navigator_user_agent=False
-    )
-    stealth_sync(page, config)
-    page.set_default_timeout(30000)  # 30 second timeout
-
-
-def retry_with_captchas(page: Page, message: str, tiktok_account: str, agency_campaign_id: str, retries=3):
-    config = {
+def job_config(message: str, tiktok_account: str, agency_campaign_id: str,
+               creator_id: Optional[str] = None, account: Optional[str] = None) -> dict:
+    """Config the outreach bots execute"""
+    return {
         'creator': tiktok_account,
         'agency_campaign_id': agency_campaign_id,
-        'message': message
+        'message': message,
+        'creator_id': creator_id,
+        'account': account,
     }
-    bot = OutreachMessageBot(page)
 
-    for attempt in range(retries):
-        try:
-            bot.execute(config)
-            break  # Exit loop if message sent successfully
-        except Exception as e:
-            handle_scraper_exception(
-                e, page, {'creator': tiktok_account}, TAKE_DEBUG_SCREENS)
-            if attempt < retries - 1:
-                logger.info('Retrying...')
-                solve_captcha(page)
 
+def record_failure(e: Exception, bot: OutreachBotBase, result: dict, failures: Counter) -> bool:
+    """
+    Note a failed attempt in the job result
+
+    Returns:
+        bool: False if the job ends here, unreported: the creator search found no single match
+    """
+    result.update(phase=bot.phase, error=str(e))
+    if isinstance(e, CreatorNotFoundError):
+        # Not a scraper failure and no retry will find them, or tell them apart
+        logger.warning(str(e))
+        result[e.resolution.status] = True
+        return False
+    failures[bot.phase] += 1
+    return True
+
+
+def next_retry(e: Exception, bot: OutreachBotBase, result: dict, failures: Counter, attempt: int,
+               retries: Optional[int] = None,
+               on_session_expired: Optional[Callable[[BrowserContext], bool]] = None) -> Optional[RetryPolicy]:
+    """
+    Decide whether a reported failure is retried, see retry_with_captchas
+
+    Returns:
+        RetryPolicy: Policy of the failed phase, whose delay to wait before the retry; None to give up
+    """
+    if isinstance(e, SessionExpiredError):
+        result['session_expired'] = True
+        # Retrying with a logged out session can't succeed
+        if not on_session_expired or not on_session_expired(bot.page.context):
+            return None
+    policy = retry_policy(bot.phase)
+    if failures[bot.phase] >= policy.attempts:
+        logger.info(f'{bot.phase} failed {failures[bot.phase]} times, giving up')
+        return None
+    if retries and attempt >= retries:
+        return None
+    logger.info(f'Retrying from {bot.checkpoint.resume_phase()}...')
+    return policy
+
+
+def finish_result(bot: OutreachBotBase, result: dict, failures: Counter, started: float) -> dict:
+    """Complete the result of a job the bot ran with its duration metric, checkpoint and counters"""
+    registry.observe(JOB_DURATION, time.perf_counter() - started,
+                     outcome='ok' if result['success'] else 'error')
+    # Share the waits this job observed with later runs
+    bot.timeouts.save()
+    result['failures'] = dict(failures)
+    result['checkpoint'] = bot.checkpoint.to_dict() if bot.checkpoint else None
+    result['overlays'] = dict(bot.overlays.hits)
+    result['captchas'] = bot.captcha_watcher.detected
+    if bot.already_sent:
+        result['already_sent'] = True
+    result.update(bot.tab_stats(), rss_mb=tree_rss_mb())
+    logger.info(f"Job opened {result['tabs_opened']} tabs, {result['tabs_open']} still open, "
+                f"{result['rss_mb']}MB resident")
+    return result
+
+
+def retry_with_captchas(page: Page, message: str, tiktok_account: str, agency_campaign_id: str,
+                        retries: Optional[int] = None,
+                        creator_index: Optional[CreatorIndex] = None,
+                        on_session_expired: Optional[Callable[[BrowserContext], bool]] = None,
+                        overlay_guard: Optional[OverlayGuard] = None,
+                        captcha_watcher: Optional[CaptchaWatcher] = None,
+                        creator_id: Optional[str] = None,
+                        ledger: Optional[SentLedger] = None, account: Optional[str] = None,
+                        bot: Optional[OutreachMessageBot] = None) -> dict:
+    """Run the outreach bot, solving captchas between failed attempts
+
+    A retry resumes from the bot's last checkpoint, after the backoff of the
+    phase that failed. A phase that failed as often as its policy allows
+    ends the job early (phases.DEFAULT_RETRY_POLICIES).
+
+    Args:
+        retries: Cap on the attempts over all phases, None to leave it to the phases' retry
+            policies (phases.DEFAULT_RETRY_POLICIES), which are the job's retry budget
+        on_session_expired: Called with the page's context when the session turns out to be
+            logged out; retries only continue if it returns True (the session was renewed)
+        overlay_guard, captcha_watcher: Passed on to OutreachMessageBot, defaults are used if not given
+        creator_id: Id the creator was resolved to ahead of time (resolve_creators.py), skips the search
+        ledger: Records the send, and stops a message another run already sent from going out twice
+        account: Seller account sending the message, recorded in the ledger
+        bot: Bot of an earlier job of the same session to run this one on, `page` is then ignored
+            (bot_session.BotSession)
+
+    Returns:
+        dict: success flag, number of attempts, the phase and error of the last failure,
+            failures per phase and the reached checkpoint
+    """
+    config = job_config(message, tiktok_account, agency_campaign_id, creator_id, account)
+    if bot:
+        bot.new_job()
+    else:
+        bot = OutreachMessageBot(page, creator_index, overlay_guard, captcha_watcher, ledger=ledger)
+    result = {'success': False, 'attempts': 0, 'phase': None, 'error': None}
+
+    failures = Counter()
+    started = time.perf_counter()
+    # Every record logged for this job carries the same correlation id
+    with log_context() as job_id, registry.transaction('send_message'):
+        result['correlation_id'] = job_id
+        for attempt in itertools.count(1):
+            result['attempts'] = attempt
+            try:
+                bot.execute(config)
+                result.update(success=True, phase=None, error=None)
+                break  # Exit loop if message sent successfully
+            except Exception as e:
+                if not record_failure(e, bot, result, failures):
+                    break
+                handle_scraper_exception(
+                    e, bot.page, {'creator': tiktok_account}, TAKE_DEBUG_SCREENS)
+                policy = next_retry(e, bot, result, failures, attempt, retries, on_session_expired)
+                if not policy:
+                    break
+                if not bot.page.is_closed():
+                    bot.captcha_watcher.solve_pending(bot.page)
+                time.sleep(policy.delay(failures[bot.phase]))
+
+    return finish_result(bot, result, failures, started)
+
+
+
+def main(sessionid_cookie: Optional[str], web_id_cookie: Optional[str], message: str, tiktok_account: str,
+         agency_campaign_id: str, account: Optional[str] = None, password: Optional[str] = None):
+    session_cache = SessionCache()
+    storage_state = session_cache.load(account) if account else None
+    if not storage_state and not (sessionid_cookie and web_id_cookie):
+        raise ValueError(
+            'No cached session for this account, pass --sessionid_cookie and --web_id_cookie or run login.py first')
+
+    def renew_session(context: BrowserContext) -> bool:
+        """Log in again, only once the bot has seen the session is no longer valid"""
+        if account:
+            session_cache.invalidate(account)
+        if not (account and password):
+            return False
+        from login import refresh_session
+        return refresh_session(context, account, password, session_cache) is not None
 
-def main(sessionid_cookie: str, web_id_cookie: str, message: str, tiktok_account: str, agency_campaign_id: str):
     with sync_playwright() as p:
       # if a captcha error is encountered, use the captcha solver and try again
         browser = p.chromium.launch(
             headless=IS_PROD
         )
-        page = browser.new_page()
-        setup_page(page)
-        set_business_cookies(page, sessionid_cookie, web_id_cookie)
-        retry_with_captchas(page, message, tiktok_account, agency_campaign_id)
+        network_policy = NetworkPolicy.from_env()
+        context = new_bot_context(browser, storage_state, network_policy,
+                                  cookies=None if storage_state else business_cookies(sessionid_cookie, web_id_cookie))
+        page = context.new_page()
+        retry_with_captchas(page, message, tiktok_account,
+                            agency_campaign_id, creator_index=CreatorIndex(),
+                            on_session_expired=renew_session, ledger=SentLedger(), account=account)
         logger.info('Finished sending message.')
-        if (IS_PROD):
+        logger.info(f'Step timings: {registry.summary()}')
+        if network_policy:
+            logger.info(f'Network policy stats: {network_policy.stats()}')
+        if asset_cache := get_asset_cache():
+            logger.info(f'Asset cache stats: {asset_cache.stats()}')
+        if IS_PROD or not sys.stdin.isatty():
             browser.close()
         else:
             # keeps script running to leave open in debug to see results
@@ -66,27 +211,35 @@ def main(sessionid_cookie: str, web_id_cookie: str, message: str, tiktok_account
 if __name__ == "__main__":
     """_summary_ Send a message to creator from the affiliate/seller center.
     Args:
-        sessionid_cookie (str): Session ID cookie value
-        web_id_cookie (str): Web ID cookie value
+        sessionid_cookie (str): Session ID cookie value (not needed when the account's session is cached)
+        web_id_cookie (str): Web ID cookie value (not needed when the account's session is cached)
         message (str): Message to send
         tiktok_account (str): Name of the creator TikTok account not including @
         agency_campaign_id (str): Agency campaign ID
+        account (str): Seller center email whose session was cached by login.py
+        password (str): Seller center password, to log in again if the cached session was invalidated
 
     Usage example: python send_message.py --sessionid_cookie <sessionid> --web_id_cookie <web_id> --message <message> --tiktok_account <tiktok_account> --agency_campaign_id <agency_campaign_id>
+    Usage example: python send_message.py --account <email> --message <message> --tiktok_account <tiktok_account> --agency_campaign_id <agency_campaign_id>
     """
     init_sentry()
     import argparse
     parser = argparse.ArgumentParser(
         description='Send message using cookies.')
     parser.add_argument('--sessionid_cookie',
-                        required=True, help='Session ID cookie value')
-    parser.add_argument('--web_id_cookie', required=True,
+                        help='Session ID cookie value')
+    parser.add_argument('--web_id_cookie',
                         help='Web ID cookie value')
     parser.add_argument('--message', required=True, help='Message to send')
     parser.add_argument('--tiktok_account', required=True,
                         help='Name of the creator TikTok account not including @')
     parser.add_argument('--agency_campaign_id',
                         required=True, help='Agency campaign ID')
+    parser.add_argument('--account',
+                        help='Seller center email whose session was cached by login.py')
+    parser.add_argument('--password', default=getenv('SELLER_PASSWORD'),
+                        help='Seller center password, used to log in again when the session expires')
     args = parser.parse_args()
     main(args.sessionid_cookie, args.web_id_cookie,
-         args.message, args.tiktok_account, args.agency_campaign_id)
+         args.message, args.tiktok_account, args.agency_campaign_id,
+         args.account, args.password)
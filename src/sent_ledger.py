@@ -0,0 +1,149 @@
+import sqlite3
+import time
+from os import getenv
+from typing import Iterable, Iterator, Optional
+
+from creator_index import normalize_handle
+
+SENT_LEDGER_FILE = getenv('SENT_LEDGER_FILE', 'sent_messages.db')
+
+
+def already_sent_result(job: dict) -> dict:
+    """Result of a job whose message the ledger says was sent by an earlier run"""
+    return {
+        'creator': job.get('creator'),
+        'agency_campaign_id': job.get('agency_campaign_id'),
+        # the message is out, an orchestrator retrying failed jobs must not send it again
+        'success': True,
+        'attempts': 0,
+        'phase': 'ledger',
+        'already_sent': True,
+    }
+
+
+# A run reserved the creator and is about to click send (or crashed while doing so)
+SENDING = 'sending'
+SENT = 'sent'
+
+
+class SentLedger:
+    """
+    Record of the messages sent, one row per creator and campaign
+
+    A send is reserved before its button is clicked: the INSERT of the
+    'sending' row only succeeds for one run, thanks to the primary key, so two
+    runs or workers can't both send. The row is marked 'sent' once the click
+    went through, and deleted if it failed. A 'sending' row left by a crashed
+    run keeps blocking the creator, since the message may be out: see sending().
+    """
+
+    def __init__(self, db_file: str = SENT_LEDGER_FILE):
+        """
+        Open (and create if needed) the ledger database
+
+        Args:
+            db_file: Path of the SQLite database, shared by every run on this machine
+        """
+        self.db_file = db_file
+        self.connection = sqlite3.connect(
+            db_file, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # the primary key is the membership index the lookups below use
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS sent_messages (
+                agency_campaign_id TEXT NOT NULL,
+                creator TEXT NOT NULL,
+                account TEXT,
+                correlation_id TEXT,
+                sent_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'sent',
+                PRIMARY KEY (agency_campaign_id, creator)
+            ) WITHOUT ROWID
+        """)
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(sent_messages)')}
+        if 'status' not in columns:
+            # ledgers written before reservations only hold sent messages
+            self.connection.execute("ALTER TABLE sent_messages ADD COLUMN status TEXT NOT NULL DEFAULT 'sent'")
+        self.connection.commit()
+
+    def reserve(self, agency_campaign_id: str, creator: str, account: Optional[str] = None,
+                correlation_id: Optional[str] = None) -> bool:
+        """
+        Claim the send of a message, right before clicking send
+
+        Returns:
+            bool: False if the creator was already messaged or another run is sending to them
+        """
+        try:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT INTO sent_messages '
+                    '(agency_campaign_id, creator, account, correlation_id, sent_at, status) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (agency_campaign_id, normalize_handle(creator), account, correlation_id, time.time(), SENDING))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def confirm(self, agency_campaign_id: str, creator: str) -> None:
+        """The reserved message was sent"""
+        with self.connection:
+            self.connection.execute(
+                'UPDATE sent_messages SET status = ?, sent_at = ? '
+                'WHERE agency_campaign_id = ? AND creator = ? AND status = ?',
+                (SENT, time.time(), agency_campaign_id, normalize_handle(creator), SENDING))
+
+    def release(self, agency_campaign_id: str, creator: str) -> None:
+        """The reserved message could not be sent, a later run may send it"""
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM sent_messages WHERE agency_campaign_id = ? AND creator = ? AND status = ?',
+                (agency_campaign_id, normalize_handle(creator), SENDING))
+
+    def is_sent(self, agency_campaign_id: str, creator: str) -> bool:
+        """Whether the message was sent, or is reserved by a run sending it"""
+        return self.connection.execute(
+            'SELECT 1 FROM sent_messages WHERE agency_campaign_id = ? AND creator = ?',
+            (agency_campaign_id, normalize_handle(creator))).fetchone() is not None
+
+    def sending(self) -> list[tuple[str, str, Optional[str]]]:
+        """(campaign, creator, correlation id) of the reservations never confirmed nor released, to check by hand"""
+        return self.connection.execute(
+            'SELECT agency_campaign_id, creator, correlation_id FROM sent_messages WHERE status = ?',
+            (SENDING,)).fetchall()
+
+    def sent(self, agency_campaign_id: str) -> set[str]:
+        """Normalized handles of the creators of a campaign already messaged or being messaged"""
+        return {row[0] for row in self.connection.execute(
+            'SELECT creator FROM sent_messages WHERE agency_campaign_id = ?', (agency_campaign_id,))}
+
+    def unsent(self, agency_campaign_id: str, creators: list[str]) -> list[str]:
+        """Creators of the list not messaged yet in the campaign"""
+        sent = self.sent(agency_campaign_id)
+        return [creator for creator in creators if normalize_handle(creator) not in sent]
+
+    def filter_jobs(self, jobs: Iterable[dict], skipped: Optional[list] = None) -> Iterator[dict]:
+        """
+        Stream the jobs whose message was not sent yet
+
+        The sent creators of each campaign are loaded with one query the first
+        time the campaign comes up, so a large jobs file is filtered before any
+        browser work.
+
+        Args:
+            skipped: List the jobs that were already sent are appended to
+        """
+        sent = {}
+        for job in jobs:
+            campaign, creator = job.get('agency_campaign_id'), job.get('creator')
+            if campaign and creator:
+                if campaign not in sent:
+                    sent[campaign] = self.sent(campaign)
+                if normalize_handle(creator) in sent[campaign]:
+                    if skipped is not None:
+                        skipped.append(job)
+                    continue
+            yield job
+
+    def close(self) -> None:
+        self.connection.close()
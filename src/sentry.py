@@ -1,10 +1,11 @@
-import sentry_sdk
 import os
 from dotenv import load_dotenv
-import logging
 from playwright.sync_api import Page
 from typing import Optional
-from aws import ScreenshotStorage
+from screenshots import get_screenshot_service
+from logger import get_logger
+
+logger = get_logger(__name__)
 
 load_dotenv()
 SENTRY_DSN = os.getenv('SENTRY_DSN')
@@ -12,8 +13,10 @@ IS_PROD = os.getenv('ENVIRONMENT') == 'production'
 
 
 def init_sentry():
-    if (not IS_PROD):
+    if not IS_PROD or not SENTRY_DSN:
         return
+    # Imported here, so runs outside production never load the SDK
+    import sentry_sdk
     sentry_sdk.init(
         dsn=SENTRY_DSN,
         # Set traces_sample_rate to 1.0 to capture 100%
@@ -29,26 +32,33 @@ def init_sentry():
 
 def handle_scraper_exception(e, page: Page, config,  take_debug_screens: bool = True):
     if (not IS_PROD):
-        logging.error(f"Exception occurred: {e}")
+        logger.error(f"Exception occurred: {e}")
         return
 
-    picture_name = f"OutreachMessageBot-FAILED-{config.get(
-        'agency_campaign_id', 'unknown')}-{config['creator']}"
-    picture_url = ''
+    picture_url = None
     if take_debug_screens:
-        picture_url = take_debug_screenshot(page, picture_name)
-        logging.error(
+        picture_url = take_debug_screenshot(page, failure_screenshot_name(config))
+        logger.error(
             f"OutreachMessageBot interrupted due to a missing element. screenshot link: {picture_url}")
 
+    capture_scraper_exception(e, picture_url)
+
+
+def failure_screenshot_name(config) -> str:
+    return f"OutreachMessageBot-FAILED-{config.get(
+        'agency_campaign_id', 'unknown')}-{config['creator']}"
+
+
+def capture_scraper_exception(e, picture_url: Optional[str] = None):
+    """Send the exception to Sentry, with the failure screenshot link if one was taken"""
+    import sentry_sdk
     with sentry_sdk.push_scope() as scope:
-        if take_debug_screens:
+        if picture_url is not None:
             scope.set_extra('pictureURL', picture_url)
         sentry_sdk.capture_exception(e)
-        logging.error(f"Exception captured: {e}")
+        logger.error(f"Exception captured: {e}")
 
 
 def take_debug_screenshot(page: Page, name: str) -> Optional[str]:
-    """Take debug screenshot if enabled"""
-    screenshot_bytes = page.screenshot()
-    storage = ScreenshotStorage()
-    return storage.save_screenshot(screenshot_bytes, name)
+    """Take debug screenshot if enabled, its upload happens in the background"""
+    return get_screenshot_service().capture(page, name)
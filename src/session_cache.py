@@ -0,0 +1,88 @@
+import json
+import os
+import re
+import time
+from os import getenv
+from typing import Optional
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+SESSION_CACHE_DIR = getenv('SESSION_CACHE_DIR', '.sessions')
+# Sessions older than this are logged in again even if the cookie claims to be valid
+SESSION_MAX_AGE = int(getenv('SESSION_MAX_AGE', str(7 * 24 * 3600)))
+SESSION_COOKIE = 'sessionid_ss_tiktokseller'
+
+
+def has_session(storage_state: dict, now: Optional[float] = None) -> bool:
+    """Check that a storage state holds an unexpired seller session cookie"""
+    now = now or time.time()
+    for cookie in storage_state.get('cookies', []):
+        if cookie.get('name') == SESSION_COOKIE and cookie.get('value'):
+            expires = cookie.get('expires', -1)
+            # -1 marks a browser-session cookie, which the max age takes care of
+            return expires == -1 or expires > now
+    return False
+
+
+class SessionCache:
+    """Playwright storage states per seller account, saved by login.py and reused by send_message"""
+
+    def __init__(self, cache_dir: str = SESSION_CACHE_DIR, max_age: int = SESSION_MAX_AGE):
+        """
+        Args:
+            cache_dir: Directory holding one <account>.json storage state per account
+            max_age: Seconds after which a saved state is considered expired
+        """
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+
+    def path(self, account: str) -> str:
+        safe_name = re.sub(r'[^A-Za-z0-9@._-]', '_', account)
+        return os.path.join(self.cache_dir, f'{safe_name}.json')
+
+    def save(self, account: str, storage_state: dict) -> Optional[str]:
+        """
+        Save the storage state of a logged in context
+
+        Returns:
+            str: Path of the saved state, or None if it holds no seller session
+        """
+        if not has_session(storage_state):
+            logger.warning(
+                f"Not caching the session of '{account}', it has no {SESSION_COOKIE} cookie")
+            return None
+
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        path = self.path(account)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        # The state holds credentials, keep it private and never expose a partial file
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(storage_state, f)
+        os.replace(tmp_path, path)
+        logger.info(f"Cached session of '{account}' in {path}")
+        return path
+
+    def load(self, account: str) -> Optional[str]:
+        """Path of the account's storage state, or None if missing or expired"""
+        path = self.path(account)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            with open(path) as f:
+                storage_state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if age > self.max_age or not has_session(storage_state):
+            logger.info(f"Cached session of '{account}' has expired")
+            self.invalidate(account)
+            return None
+        return path
+
+    def invalidate(self, account: str) -> None:
+        """Drop the account's state, e.g. after the site logged it out"""
+        try:
+            os.remove(self.path(account))
+        except FileNotFoundError:
+            pass
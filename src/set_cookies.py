@@ -5,20 +5,18 @@ from logger import get_logger
 logger = get_logger(__name__)
 
 
-def set_business_cookies(page: Page, seller_session_id: str, web_id: str) -> None:
+def business_cookies(seller_session_id: str, web_id: str) -> list[dict]:
     """
-    Set required business cookies for TikTok scraping
+    Build the business cookies required for TikTok scraping
 
     Args:
-        page (Page): Playwright page instance
         seller_session_id (str): TikTok seller session ID
         web_id (str): TikTok web ID
-    """
-    logger.info('Starting setBusinessCookies...')
-    logger.debug(f'setBusinessCookies() params: seller_session_id={
-        seller_session_id}, web_id={web_id}')
 
-    saved_cookies = [
+    Returns:
+        list[dict]: Cookies in the format accepted by BrowserContext.add_cookies
+    """
+    return [
         {
             'name': 'sessionid_ss_tiktokseller',
             'value': seller_session_id,
@@ -39,11 +37,18 @@ def set_business_cookies(page: Page, seller_session_id: str, web_id: str) -> Non
         }
     ]
 
-    context = page.context
-    for cookie in saved_cookies:
-        context.add_cookies([{
-            'name': cookie['name'],
-            'value': cookie['value'],
-            'domain': cookie.get('domain'),
-            'path': cookie.get('path', '/'),
-        }])
+
+def set_business_cookies(page: Page, seller_session_id: str, web_id: str) -> None:
+    """
+    Set required business cookies for TikTok scraping
+
+    Args:
+        page (Page): Playwright page instance
+        seller_session_id (str): TikTok seller session ID
+        web_id (str): TikTok web ID
+    """
+    logger.info('Starting setBusinessCookies...')
+    logger.debug(f'setBusinessCookies() params: seller_session_id={
+        seller_session_id}, web_id={web_id}')
+
+    page.context.add_cookies(business_cookies(seller_session_id, web_id))
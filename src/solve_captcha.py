@@ -1,8 +1,7 @@
 import os
 from dotenv import load_dotenv
-from tiktok_captcha_solver import PlaywrightSolver
-from playwright.sync_api import Page
 from playwright.sync_api import Page
+from playwright.async_api import Page as AsyncPage
 from logger import get_logger
 
 logger = get_logger(__name__)
@@ -11,6 +10,26 @@ load_dotenv()
 
 SADCAPTCHA_API_KEY = os.getenv('SADCAPTCHA_API_KEY')
 
+# Containers of every captcha variant the solver handles (shapes, icon, rotate, puzzle, v1/v2, douyin).
+# The first two are tiktok_captcha_solver.selectors.Wrappers.V1/V2, written out because importing the
+# solver package loads selenium and undetected_chromedriver, over half a second spent by every run
+# that never sees a captcha.
+CAPTCHA_SELECTOR = ', '.join([
+    '.captcha-disable-scroll',
+    '.captcha-verify-container',
+    '#captcha_container',
+])
+
+
+def cached_client(solver):
+    """Put the captcha cache in front of the solver's API client, returning it (None if the cache is off)"""
+    from captcha_cache import CachingClient, get_captcha_cache
+    cache = get_captcha_cache()
+    if not cache:
+        return None
+    solver.client = CachingClient(solver.client, cache)
+    return solver.client
+
 
 def main(
     page: Page,
@@ -21,16 +40,54 @@ def main(
         logger.warning("Page is not visible, skipping captcha solving")
         return
 
-    if not page.is_visible("text=Select 2 objects that are the same shape"):
+    if not page.locator(CAPTCHA_SELECTOR).first.is_visible():
         logger.warning("Captcha not detected, skipping captcha solving")
         return
 
     logger.debug("Starting captcha solver")
     # Initialize captcha solver
+    from tiktok_captcha_solver import PlaywrightSolver
     solver = PlaywrightSolver(page, SADCAPTCHA_API_KEY)
+    client = cached_client(solver)
     logger.debug("Initialized captcha solver")
-    solver.solve_captcha_if_present(
-        captcha_detect_timeout=captcha_detect_timeout,
-        retries=retries
-    )
+    solved = False
+    try:
+        solver.solve_captcha_if_present(
+            captcha_detect_timeout=captcha_detect_timeout,
+            retries=retries
+        )
+        solved = not page.locator(CAPTCHA_SELECTOR).first.is_visible()
+    finally:
+        if client:
+            client.finish(solved)
+    logger.debug("✓ Handled potential captcha")
+
+
+async def main_async(
+    page: AsyncPage,
+    captcha_detect_timeout: int = 15,
+    retries: int = 2
+):
+    if not await page.is_visible('body'):
+        logger.warning("Page is not visible, skipping captcha solving")
+        return
+
+    if not await page.locator(CAPTCHA_SELECTOR).first.is_visible():
+        logger.warning("Captcha not detected, skipping captcha solving")
+        return
+
+    logger.debug("Starting captcha solver")
+    from tiktok_captcha_solver import AsyncPlaywrightSolver
+    solver = AsyncPlaywrightSolver(page, SADCAPTCHA_API_KEY)
+    client = cached_client(solver)
+    solved = False
+    try:
+        await solver.solve_captcha_if_present(
+            captcha_detect_timeout=captcha_detect_timeout,
+            retries=retries
+        )
+        solved = not await page.locator(CAPTCHA_SELECTOR).first.is_visible()
+    finally:
+        if client:
+            client.finish(solved)
     logger.debug("✓ Handled potential captcha")
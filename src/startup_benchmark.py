@@ -0,0 +1,129 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from statistics import median
+from typing import Optional
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_SCRIPTS = ('send_message', 'login')
+DEFAULT_RUNS = 5
+TOP_IMPORTS = 10
+# Only needed on failure paths or once a captcha shows up, a plain import must not load them
+LAZY_MODULES = ('boto3', 'sentry_sdk', 'tiktok_captcha_solver', 'selenium', 'undetected_chromedriver',
+                'playwright_stealth')
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_python(args: list[str]) -> tuple[float, str, str]:
+    """Run a fresh interpreter in src/, returning its wall time in seconds, stdout and stderr"""
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, *args], cwd=SRC_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if process.returncode:
+        raise RuntimeError(f'python {" ".join(args)} failed: {process.stderr.strip()[-500:]}')
+    return elapsed, process.stdout, process.stderr
+
+
+def parse_importtime(stderr: str, module: str) -> tuple[float, list[tuple[str, float]]]:
+    """
+    Read the output of python -X importtime
+
+    Returns:
+        tuple: Cumulative import time of `module` in seconds, and the packages it imported
+            directly with their cumulative time, slowest first
+    """
+    total = 0.0
+    children = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, depth, name = int(match.group(2)) / 1e6, len(match.group(3)) // 2, match.group(4)
+        if depth == 1:
+            children.append((name, cumulative))
+        elif depth == 0:
+            # the modules a module imported are printed before it
+            if name == module:
+                total = cumulative
+                break
+            children = []
+    return total, sorted(children, key=lambda child: -child[1])
+
+
+def measure(script: str, runs: int = DEFAULT_RUNS) -> dict:
+    """
+    Import time and cold start time of a script, each the median of `runs` fresh interpreters
+
+    The cold start is `python <script>.py --help`: the interpreter, every import and the
+    argument parsing, without any browser work.
+    """
+    import_times, startup_times = [], []
+    imports = []
+    for _ in range(runs):
+        _, _, stderr = run_python(['-X', 'importtime', '-c', f'import {script}'])
+        total, imports = parse_importtime(stderr, script)
+        import_times.append(total)
+        elapsed, _, _ = run_python([f'{script}.py', '--help'])
+        startup_times.append(elapsed)
+    _, stdout, _ = run_python(['-c', f'import sys, json, {script}; print(json.dumps(sorted(sys.modules)))'])
+    loaded = set(json.loads(stdout))
+    return {
+        'script': script,
+        'runs': runs,
+        'import': round(median(import_times), 3),
+        'cold_start': round(median(startup_times), 3),
+        'top_imports': [(name, round(seconds, 3)) for name, seconds in imports[:TOP_IMPORTS]],
+        'eager_heavy_modules': [module for module in LAZY_MODULES if module in loaded],
+    }
+
+
+def main(scripts: tuple = DEFAULT_SCRIPTS, runs: int = DEFAULT_RUNS, output_file: Optional[str] = None) -> list[dict]:
+    """
+    Measure how long the scripts take to start
+
+    Args:
+        output_file: JSON file to save the results to
+    """
+    results = []
+    for script in scripts:
+        result = measure(script, runs)
+        results.append(result)
+        logger.info(f"{result['script']}: import={result['import']}s cold_start={result['cold_start']}s, "
+                    f"slowest imports: {', '.join(f'{name} {seconds}s' for name, seconds in result['top_imports'])}")
+        if result['eager_heavy_modules']:
+            logger.warning(f"{result['script']} loads at import: {', '.join(result['eager_heavy_modules'])}")
+
+    if output_file:
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    """_summary_ Measure the import and cold start time of the CLI scripts, each in fresh interpreters.
+    Args:
+        scripts (str): Comma separated scripts of src/ to measure, without .py
+        runs (int): Interpreters started per script, the median is reported
+        output (str): JSON file to save the results to
+
+    Usage example: python startup_benchmark.py --scripts send_message,login --runs 5 --output startup.json
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Measure the import and cold start time of the CLI scripts.')
+    parser.add_argument('--scripts', default=','.join(DEFAULT_SCRIPTS),
+                        help='Comma separated scripts to measure, without .py')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS,
+                        help='Interpreters started per script')
+    parser.add_argument('--output', default=None,
+                        help='JSON file to save the results to')
+    args = parser.parse_args()
+    main(tuple(args.scripts.split(',')), args.runs, args.output)
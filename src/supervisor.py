@@ -0,0 +1,347 @@
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+from os import getenv
+from typing import Callable, Iterator, Optional
+
+from lifecycle import process_tree, tree_rss_mb
+from logger import get_logger, log_context
+
+logger = get_logger(__name__)
+
+DEFAULT_WORKERS = int(getenv('SUPERVISOR_WORKERS', str(os.cpu_count() or 1)))
+# A worker is recycled (after its current job) once it passes any of these
+MAX_WORKER_RSS_MB = float(getenv('MAX_WORKER_RSS_MB', '1500'))  # worker + driver + browser
+MAX_WORKER_AGE = float(getenv('MAX_WORKER_AGE', '3600'))  # seconds
+MAX_WORKER_JOBS = int(getenv('MAX_WORKER_JOBS', '200'))
+# A job running longer than this is considered hung, its worker is killed
+JOB_TIMEOUT = float(getenv('JOB_TIMEOUT', '600'))  # seconds
+# A worker not ready this long after it started is considered hung in the browser launch, it is killed
+WORKER_LAUNCH_TIMEOUT = float(getenv('WORKER_LAUNCH_TIMEOUT', '120'))  # seconds
+# How long a shutdown waits for the running jobs before killing their workers
+DRAIN_TIMEOUT = float(getenv('DRAIN_TIMEOUT', '300'))  # seconds
+POLL_INTERVAL = 1.0
+# How long a killed worker is waited for, a process stuck in the kernel may take a while to go
+KILL_JOIN_TIMEOUT = 10.0  # seconds
+# Workers exiting in a row without finishing a job (e.g. the browser can't launch) before the run is stopped
+MAX_CRASH_STREAK = 5
+
+
+def kill_tree(pid: int) -> None:
+    """SIGKILL a process and its descendants, so a hung browser doesn't outlive its worker"""
+    for member in reversed(process_tree(pid)):
+        try:
+            os.kill(member, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def worker_process(worker_id: int, inbox, events) -> None:
+    """
+    Body of a worker process: run the jobs the supervisor sends to its inbox on its own browser
+
+    Reports ('ready', worker_id) once its browser is up, ('done', worker_id, index, result)
+    after each job and ('exit', worker_id, reason) when it stops, on its own events pipe.
+    Stops when it gets None or when its browser disconnected.
+    """
+    # Shutdown is the supervisor's call, a Ctrl+C in the terminal reaches every process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from playwright.sync_api import sync_playwright
+    from send_batch import run_job
+    from bot_session import BotSession
+    from send_message import IS_PROD
+    from creator_index import CreatorIndex
+    from resolution_store import ResolutionStore
+    from sent_ledger import SentLedger
+    from network_policy import NetworkPolicy
+    from session_cache import SessionCache
+    from sentry import init_sentry
+
+    init_sentry()
+    creator_index = CreatorIndex()
+    network_policy = NetworkPolicy.from_env()
+    session_cache = SessionCache()
+    resolutions = ResolutionStore()
+    ledger = SentLedger()
+    reason = 'stopped'
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=IS_PROD)
+        session = BotSession(browser, network_policy)
+        events.send(('ready', worker_id))
+        try:
+            while True:
+                item = inbox.get()
+                if item is None:
+                    break
+                index, job = item
+                with log_context(f'w{worker_id}-{index}'):
+                    try:
+                        result = run_job(browser, job, creator_index, network_policy,
+                                         session_cache=session_cache, resolutions=resolutions, ledger=ledger,
+                                         session=session)
+                    except Exception as e:
+                        result = {'creator': job.get('creator'), 'agency_campaign_id': job.get('agency_campaign_id'),
+                                  'success': False, 'phase': 'worker', 'error': str(e)}
+                events.send(('done', worker_id, index, result))
+                if not browser.is_connected():
+                    reason = 'browser disconnected'
+                    break
+        finally:
+            if browser.is_connected():
+                session.close()
+                browser.close()
+    events.send(('exit', worker_id, reason))
+
+
+class WorkerHandle:
+    """Supervisor side view of a worker process"""
+
+    def __init__(self, worker_id: int, process, inbox, events):
+        self.id = worker_id
+        self.process = process
+        self.inbox = inbox
+        # read end of the worker's own pipe: a killed worker can only break its own
+        self.events = events
+        self.started_at = time.monotonic()
+        self.ready = False
+        self.jobs = 0
+        self.current = None  # (job index, job, handed out at)
+        self.retiring = False  # gets no more jobs, stopped once idle
+        self.stopped = False  # None was sent to its inbox
+        self.exit_reason = None
+
+    @property
+    def idle(self) -> bool:
+        return self.ready and not self.current and not self.stopped
+
+    def recycle_reason(self, now: float) -> Optional[str]:
+        if self.jobs >= MAX_WORKER_JOBS:
+            return f'{self.jobs} jobs'
+        if now - self.started_at >= MAX_WORKER_AGE:
+            return f'{now - self.started_at:.0f}s old'
+        rss = tree_rss_mb(self.process.pid)
+        if rss is not None and rss >= MAX_WORKER_RSS_MB:
+            return f'{rss:.0f}MB resident'
+        return None
+
+    def stop(self) -> None:
+        self.inbox.put(None)
+        self.stopped = True
+
+    def kill(self) -> None:
+        """SIGKILL the worker's process tree and reap it, so it no longer looks alive"""
+        kill_tree(self.process.pid)
+        self.process.join(KILL_JOIN_TIMEOUT)
+        self.retiring = True
+
+
+class Supervisor:
+    """
+    Runs jobs on several worker processes, each owning a browser
+
+    Each idle worker is handed the next job of the file, so the supervisor
+    always knows which job a worker holds. Workers that crash, hang on a job,
+    lose their browser or grow past the memory, age or job count limits are
+    replaced. On SIGTERM/SIGINT no new job is handed out and the running ones
+    are given DRAIN_TIMEOUT to finish.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, target: Callable = worker_process):
+        """
+        Args:
+            workers: Number of worker processes
+            target: Body of the worker processes, worker_process(worker_id, inbox, events)
+        """
+        self.size = workers
+        self.target = target
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = {}
+        self.next_worker_id = 0
+        self.draining = False
+        self.restarts = 0
+        self.crash_streak = 0
+
+    def start_worker(self) -> None:
+        inbox = self.context.Queue()
+        events, worker_events = self.context.Pipe(duplex=False)
+        worker_id = self.next_worker_id
+        self.next_worker_id += 1
+        process = self.context.Process(
+            target=self.target, args=(worker_id, inbox, worker_events),
+            name=f'outreach-worker-{worker_id}')
+        process.start()
+        # the worker holds the write end now, the read end then sees EOF once it exits
+        worker_events.close()
+        self.workers[worker_id] = WorkerHandle(worker_id, process, inbox, events)
+        logger.info(f'Started worker {worker_id} (pid {process.pid})')
+
+    def receive(self, timeout: float) -> Iterator[tuple]:
+        """Events the workers sent, waiting up to `timeout` for the first one"""
+        pipes = {worker.events: worker for worker in self.workers.values() if not worker.events.closed}
+        if not pipes:
+            time.sleep(timeout)
+            return
+        for pipe in multiprocessing.connection.wait(list(pipes), timeout):
+            try:
+                while pipe.poll():
+                    yield pipe.recv()
+            except EOFError:
+                # the worker exited, its process is reaped below
+                pipe.close()
+            except Exception as e:
+                # killed mid-write: only this worker's pipe is broken, the others are read on
+                logger.warning(f'Events of worker {pipes[pipe].id} are unreadable: {e}')
+                pipe.close()
+
+    def drain(self, signum=None, frame=None) -> None:
+        if not self.draining:
+            logger.info(f'Draining (signal {signum}): no new jobs, waiting for the running ones')
+        self.draining = True
+
+    def run(self, jobs: Iterator[dict], output_file: str) -> dict:
+        """
+        Run the jobs and append their results to output_file
+
+        Returns:
+            dict: Counts of sent, failed and not started jobs, and of worker restarts
+        """
+        counts = {'sent': 0, 'failed': 0, 'not_started': 0}
+        signal.signal(signal.SIGTERM, self.drain)
+        signal.signal(signal.SIGINT, self.drain)
+        jobs = enumerate(jobs)
+        exhausted = False
+        drain_deadline = None
+
+        with open(output_file, 'a') as output:
+
+            def write(result: dict, outcome: Optional[str] = None) -> None:
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+                counts[outcome or ('sent' if result.get('success') else 'failed')] += 1
+
+            def fail(job: dict, error: str, phase: str = 'worker', outcome: Optional[str] = None) -> None:
+                write({'creator': job.get('creator'), 'agency_campaign_id': job.get('agency_campaign_id'),
+                       'success': False, 'phase': phase, 'error': error}, outcome)
+
+            for _ in range(self.size):
+                self.start_worker()
+
+            while True:
+                for event in self.receive(POLL_INTERVAL):
+                    worker = self.workers.get(event[1])
+                    if not worker:
+                        continue
+                    if event[0] == 'ready':
+                        worker.ready = True
+                    elif event[0] == 'done':
+                        if worker.current and worker.current[0] == event[2]:
+                            write(event[3])
+                            worker.current = None
+                        worker.jobs += 1
+                        self.crash_streak = 0
+                    elif event[0] == 'exit':
+                        worker.exit_reason = event[2]
+
+                now = time.monotonic()
+                for worker in list(self.workers.values()):
+                    if worker.current and now - worker.current[2] > JOB_TIMEOUT:
+                        logger.error(f'Worker {worker.id} hung on job {worker.current[0]}, killing it')
+                        worker.kill()
+                        fail(worker.current[1], f'Job timed out after {JOB_TIMEOUT:.0f}s')
+                        worker.current = None
+                    elif not worker.ready and now - worker.started_at > WORKER_LAUNCH_TIMEOUT \
+                            and worker.process.is_alive():
+                        logger.error(f'Worker {worker.id} not ready after {WORKER_LAUNCH_TIMEOUT:.0f}s, killing it')
+                        worker.kill()
+                    if not worker.process.is_alive():
+
+                        worker.process.join()
+                        worker.events.close()
+                        del self.workers[worker.id]
+                        if worker.current:
+                            fail(worker.current[1], f'Worker crashed (exit code {worker.process.exitcode})')
+                        if worker.exit_reason != 'stopped' or worker.process.exitcode:
+                            logger.warning(f'Worker {worker.id} exited: {worker.exit_reason or worker.process.exitcode}')
+                        if not worker.jobs and not worker.stopped:
+                            self.crash_streak += 1
+                            if self.crash_streak == MAX_CRASH_STREAK:
+                                logger.error(f'{self.crash_streak} workers in a row exited without finishing a job, stopping')
+                                self.drain()
+                        continue
+                    if not worker.retiring:
+                        reason = 'draining' if self.draining else worker.recycle_reason(now)
+                        if reason:
+                            if not self.draining:
+                                logger.info(f'Recycling worker {worker.id}: {reason}')
+                            worker.retiring = True
+                    if worker.idle and worker.retiring:
+                        worker.stop()
+                    elif worker.idle and not self.draining and not exhausted:
+                        try:
+                            index, job = next(jobs)
+                        except StopIteration:
+                            exhausted = True
+                            continue
+                        worker.current = (index, job, now)
+                        worker.inbox.put((index, job))
+
+                if exhausted and not self.draining and not any(w.current for w in self.workers.values()):
+                    logger.info('All jobs finished, stopping the workers')
+                    self.draining = True
+                if self.draining:
+                    if drain_deadline is None:
+                        drain_deadline = now + DRAIN_TIMEOUT
+                    if not self.workers:
+                        break
+                    if now > drain_deadline:
+                        logger.warning(f'Drain timed out, killing {len(self.workers)} workers')
+                        for worker in list(self.workers.values()):
+                            worker.kill()
+                            if worker.current:
+                                fail(worker.current[1], 'Killed at shutdown')
+                        break
+                else:
+                    # Replace the workers that exited or are being recycled
+                    while len([w for w in self.workers.values() if not w.retiring]) < self.size:
+                        self.restarts += 1
+                        self.start_worker()
+
+            # Jobs of the file the run was stopped before
+            for index, job in jobs:
+                fail(job, 'Not started, the run was stopped', 'supervisor', 'not_started')
+
+        counts['restarts'] = self.restarts
+        return counts
+
+
+def main(jobs_file: str, output_file: str, workers: int = DEFAULT_WORKERS) -> dict:
+    from send_batch import read_jobs
+    counts = Supervisor(workers).run(read_jobs(jobs_file), output_file)
+    logger.info(f"Finished supervised batch: {counts['sent']} sent, {counts['failed']} failed, "
+                f"{counts['not_started']} not started, {counts['restarts']} worker restarts.")
+    return counts
+
+
+if __name__ == "__main__":
+    """_summary_ Send a batch of jobs with several worker processes, each owning a browser, restarting them as needed.
+    Args:
+        jobs (str): JSONL or CSV file with one job per line, as for send_batch.py
+        output (str): JSONL file the per-job results are appended to as each job finishes
+        workers (int): Number of worker processes, one per core by default
+
+    Usage example: python supervisor.py --jobs jobs.jsonl --output results.jsonl --workers 4
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Send a batch of jobs with supervised worker processes.')
+    parser.add_argument('--jobs', required=True,
+                        help='JSONL or CSV file with one job per line')
+    parser.add_argument('--output', required=True,
+                        help='JSONL file to append per-job results to')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='Number of worker processes')
+    args = parser.parse_args()
+    main(args.jobs, args.output, args.workers)
@@ -0,0 +1,195 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from os import getenv
+from typing import Iterator, Optional
+
+from playwright.sync_api import TimeoutError as SyncTimeoutError
+from playwright.async_api import TimeoutError as AsyncTimeoutError
+from metrics import percentile
+from logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows, concurrent saves may then drop each other's samples
+    fcntl = None
+
+logger = get_logger(__name__)
+
+TIMEOUT_POLICY_FILE = getenv('TIMEOUT_POLICY_FILE', 'timeouts.json')
+# 'off' keeps the default timeouts below
+TIMEOUT_POLICY = getenv('TIMEOUT_POLICY', 'adaptive')
+# A timeout is this percentile of the recent waits, times the multiplier
+TIMEOUT_PERCENTILE = float(getenv('TIMEOUT_PERCENTILE', '0.95'))
+TIMEOUT_MULTIPLIER = float(getenv('TIMEOUT_MULTIPLIER', '2'))
+# Waits observed before the learned timeout replaces the default
+MIN_SAMPLES = 10
+MAX_SAMPLES = 200
+SAVE_INTERVAL = 30  # seconds
+
+# Timeouts (ms) used until enough waits have been observed, they were hard-coded in the bot
+DEFAULT_TIMEOUTS = {
+    'goto': 30000,
+    'page_title': 30000,
+    'search_input': 10000,
+    'search_api': 10000,
+    'empty_row_hidden': 10000,
+    'details_url': 10000,
+    'message_icon': 15000,
+    'im_textarea': 10000,
+    'im_url': 10000,
+    # short: a conversation the IM app doesn't switch to is loaded the full way
+    'im_switch': 5000,
+}
+# (floor, ceiling) in ms; the ceiling lets a slow site get more time than the old fixed value
+DEFAULT_LIMIT = (3000, 60000)
+LIMITS = {
+    'goto': (5000, 60000),
+    'page_title': (5000, 60000),
+}
+
+
+class TimeoutPolicy:
+    """
+    Timeouts of the bot's waits, learned from how long each wait actually took
+
+    Every wait reports how long its element took to appear; the timeout of the
+    next wait on that key is a high percentile of the recent durations, scaled
+    by a safety multiplier and clamped between a floor and a ceiling. Waits that
+    time out count as taking the whole timeout, so a slowing site raises the
+    timeout up to the ceiling. Samples are saved to a JSON file shared by runs.
+    """
+
+    def __init__(self, file: Optional[str] = TIMEOUT_POLICY_FILE, enabled: bool = TIMEOUT_POLICY != 'off',
+                 fraction: float = TIMEOUT_PERCENTILE, multiplier: float = TIMEOUT_MULTIPLIER):
+        """
+        Args:
+            file: JSON file keeping the samples across runs, None to keep them in memory
+            enabled: If False the default timeouts are always used
+            fraction: Percentile of the recent waits the timeout is derived from
+            multiplier: Safety factor applied to the percentile
+        """
+        self.file = file
+        self.enabled = enabled
+        self.fraction = fraction
+        self.multiplier = multiplier
+        self.samples = {}  # key -> deque of recent wait durations (ms)
+        self._unsaved = {}  # key -> durations recorded since the last save
+        self._last_save = float('-inf')
+        self._lock = threading.Lock()
+        if file and enabled:
+            self.samples = {key: deque(values, maxlen=MAX_SAMPLES)
+                            for key, values in self._read().items()}
+
+    def timeout(self, key: str) -> float:
+        """Timeout (ms) to use for the next wait on key"""
+        default = DEFAULT_TIMEOUTS.get(key, 30000)
+        if not self.enabled:
+            return default
+        with self._lock:
+            values = sorted(self.samples.get(key, ()))
+        if len(values) < MIN_SAMPLES:
+            return default
+        floor, ceiling = LIMITS.get(key, DEFAULT_LIMIT)
+        return round(min(ceiling, max(floor, percentile(values, self.fraction) * self.multiplier)))
+
+    def record(self, key: str, elapsed: float) -> None:
+        """Record how long (ms) a wait on key took"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.samples.setdefault(key, deque(maxlen=MAX_SAMPLES)).append(elapsed)
+            self._unsaved.setdefault(key, []).append(elapsed)
+
+    @contextmanager
+    def measure(self, key: str) -> Iterator[float]:
+        """
+        Time a wait on key, yielding the timeout to give it
+
+        Usage:
+            with policy.measure('search_input') as timeout:
+                page.wait_for_selector(SEARCH_INPUT_SELECTOR, timeout=timeout)
+        """
+        timeout = self.timeout(key)
+        started = time.perf_counter()
+        try:
+            yield timeout
+        except (SyncTimeoutError, AsyncTimeoutError):
+            self.record(key, timeout)
+            raise
+        self.record(key, (time.perf_counter() - started) * 1000)
+
+    def save(self, force: bool = False) -> None:
+        """Merge the new samples into the file, at most every SAVE_INTERVAL seconds unless forced"""
+        if not self.file or not self.enabled:
+            return
+        with self._lock:
+            if not self._unsaved or (not force and time.monotonic() - self._last_save < SAVE_INTERVAL):
+                return
+            unsaved, self._unsaved = self._unsaved, {}
+            self._last_save = time.monotonic()
+
+        try:
+            with self._file_lock():
+                # Other processes may have saved since we loaded, keep their samples too
+                merged = self._read()
+                for key, values in unsaved.items():
+                    merged[key] = (merged.get(key, []) + values)[-MAX_SAMPLES:]
+                tmp_file = f'{self.file}.{os.getpid()}.tmp'
+                with open(tmp_file, 'w') as f:
+                    json.dump(merged, f)
+                os.replace(tmp_file, self.file)
+        except OSError as e:
+            logger.warning(f'Could not save the timeout samples to {self.file}: {e}')
+            return
+        with self._lock:
+            for key, values in merged.items():
+                self.samples[key] = deque(values, maxlen=MAX_SAMPLES)
+
+    def summary(self) -> dict:
+        """Current timeout and sample count per key"""
+        keys = set(DEFAULT_TIMEOUTS) | set(self.samples)
+        return {key: {'timeout': self.timeout(key), 'samples': len(self.samples.get(key, ()))}
+                for key in sorted(keys)}
+
+    def _read(self) -> dict:
+        try:
+            with open(self.file) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignoring unreadable timeout samples in {self.file}: {e}')
+            return {}
+        return {key: [float(value) for value in values][-MAX_SAMPLES:]
+                for key, values in data.items() if isinstance(values, list)}
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(f'{self.file}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_timeout_policy() -> TimeoutPolicy:
+    """Process-wide timeout policy, saved when the process exits"""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = TimeoutPolicy()
+            atexit.register(_policy.save, True)
+        return _policy
@@ -0,0 +1,322 @@
+import json
+import queue
+import signal
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from os import getenv
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+from playwright.sync_api import sync_playwright, Browser
+from send_batch import run_job, new_job_page
+from send_message import IS_PROD
+from creator_index import CreatorIndex
+from resolution_store import ResolutionStore
+from sent_ledger import SentLedger
+from network_policy import NetworkPolicy
+from session_cache import SessionCache
+from sentry import init_sentry
+from metrics import registry
+from logger import get_logger, log_context
+
+logger = get_logger(__name__)
+
+WORKER_HOST = getenv('WORKER_HOST', '127.0.0.1')
+WORKER_PORT = int(getenv('WORKER_PORT', '8765'))
+WARM_PAGES = int(getenv('WORKER_WARM_PAGES', '1'))
+MAX_KEPT_RESULTS = 1000
+# How long POST /jobs?wait=1 holds the connection before answering 202 with the record still pending
+WORKER_WAIT_TIMEOUT = float(getenv('WORKER_WAIT_TIMEOUT', '900'))  # seconds
+
+
+class BrowserWorker:
+    """
+    Keeps one browser and a few bot-ready pages warm, and runs queued jobs on them
+
+    Playwright's sync API is bound to the thread that started it, so every
+    browser call happens on the worker thread; HTTP handlers only touch the
+    queue and the job records.
+    """
+
+    def __init__(self, warm_pages: int = WARM_PAGES):
+        self.warm_pages = warm_pages
+        self.jobs = queue.Queue()
+        self.records = OrderedDict()  # job id -> record, oldest first
+        self.records_lock = threading.Lock()
+        self.in_flight = None
+        self.completed = 0
+        self.started_at = time.time()
+        self.browser_connected = False
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='browser-worker', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Finish the running job, then close the browser; the jobs still queued fail"""
+        self._stopping.set()
+        self.jobs.put(None)
+        self._thread.join(timeout)
+        self._fail_queued('The worker stopped before running the job')
+
+    def submit(self, job: dict) -> dict:
+        """Queue a job and return its record"""
+        record = {'id': uuid.uuid4().hex, 'status': 'queued',
+                  'submitted_at': time.time(), 'result': None,
+                  'done': threading.Event()}
+        with self.records_lock:
+            self.records[record['id']] = record
+            while len(self.records) > MAX_KEPT_RESULTS:
+                self.records.popitem(last=False)
+        if self._stopping.is_set() or not self._thread.is_alive():
+            self._finish(record, failed_result('The worker is not running'))
+        else:
+            self.jobs.put((record, job))
+        return record
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.records_lock:
+            return self.records.get(job_id)
+
+    def health(self) -> dict:
+        return {
+            'status': 'ok' if self.browser_connected and self._thread.is_alive() else 'unavailable',
+            'browser_connected': self.browser_connected,
+            'uptime': round(time.time() - self.started_at, 1),
+        }
+
+    def queue_stats(self) -> dict:
+        return {
+            'depth': self.jobs.qsize(),
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+        }
+
+    def _run(self) -> None:
+        try:
+            self._serve()
+        except Exception as e:
+            # without this thread nothing would ever resolve the queued jobs
+            logger.error(f'Browser worker crashed: {e}')
+            running = self.get(self.in_flight) if self.in_flight else None
+            if running and not running['done'].is_set():
+                self._finish(running, failed_result(f'The worker crashed: {e}'))
+            self._fail_queued(f'The worker crashed: {e}')
+        self.browser_connected = False
+        self._fail_queued('The worker stopped before running the job')
+        logger.info('Browser worker stopped.')
+
+    def _serve(self) -> None:
+        creator_index = CreatorIndex()
+        network_policy = NetworkPolicy.from_env()
+        session_cache = SessionCache()
+        resolutions = ResolutionStore()
+        ledger = SentLedger()
+        with sync_playwright() as p:
+            browser = None
+            launch_error = None
+            warm = deque()
+            while not self._stopping.is_set():
+                if (not browser or not browser.is_connected()) and not launch_error:
+                    browser, launch_error = self._launch(p)
+                    warm.clear()
+                if browser and not launch_error:
+                    self._fill_warm_pages(browser, warm, network_policy)
+
+                item = self.jobs.get()
+                if item is None:
+                    break
+                record, job = item
+                if launch_error:
+                    # the last launch failed, try again now that a job is waiting
+                    browser, launch_error = self._launch(p)
+                    if launch_error:
+                        self._finish(record, failed_result(launch_error))
+                        continue
+                record['status'] = 'running'
+                self.in_flight = record['id']
+                page = warm.popleft() if warm else None
+                try:
+                    # Logs of the job can be found by its worker id
+                    with log_context(record['id']):
+                        record['result'] = run_job(
+                            browser, job, creator_index, network_policy, page=page,
+                            session_cache=session_cache, resolutions=resolutions, ledger=ledger)
+                except Exception as e:
+                    logger.error(f'Worker job {record["id"]} failed: {e}')
+                    record['result'] = failed_result(str(e))
+                # a job rejected before using its page leaves it warm for the next one
+                if page and not page.is_closed():
+                    warm.appendleft(page)
+                self.browser_connected = browser.is_connected()
+                self._finish(record, record['result'])
+                self.in_flight = None
+                self.completed += 1
+
+            if browser and browser.is_connected():
+                browser.close()
+
+    def _launch(self, p) -> tuple[Optional[Browser], Optional[str]]:
+        """
+        Launch the browser
+
+        Returns:
+            tuple: (browser, None), or (None, error) after failing the queued jobs, which can't run without it
+        """
+        try:
+            browser = p.chromium.launch(headless=IS_PROD)
+        except Exception as e:
+            error = f'Could not launch the browser: {e}'
+            logger.error(error)
+            self.browser_connected = False
+            self._fail_queued(error)
+            return None, error
+        self.browser_connected = True
+        logger.info('Browser launched.')
+        return browser, None
+
+    def _finish(self, record: dict, result: dict) -> None:
+        record['result'] = result
+        record['status'] = 'done'
+        record['done'].set()
+
+    def _fail_queued(self, error: str) -> None:
+        """Resolve every queued job with an error, so no client waits on a job that will never run"""
+        while True:
+            try:
+                item = self.jobs.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                self._finish(item[0], failed_result(error))
+
+    def _fill_warm_pages(self, browser: Browser, warm: deque, network_policy: Optional[NetworkPolicy]) -> None:
+        while len(warm) < self.warm_pages:
+            try:
+                warm.append(new_job_page(browser, network_policy))
+            except Exception as e:
+                logger.warning(f'Could not prepare a warm page: {e}')
+                return
+
+
+def failed_result(error: str) -> dict:
+    return {'success': False, 'phase': 'worker', 'error': error}
+
+
+def public_record(record: dict) -> dict:
+    return {key: value for key, value in record.items() if key != 'done'}
+
+
+def make_handler(worker: BrowserWorker):
+    class WorkerRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/health':
+                health = worker.health()
+                self._send(200 if health['status'] == 'ok' else 503, health)
+            elif path == '/queue':
+                self._send(200, worker.queue_stats())
+            elif path == '/metrics':
+                self._send_text(200, registry.prometheus(), 'text/plain; version=0.0.4')
+            elif path == '/metrics.json':
+                self._send(200, registry.summary())
+            elif path.startswith('/jobs/'):
+                record = worker.get(path[len('/jobs/'):])
+                if record:
+                    self._send(200, public_record(record))
+                else:
+                    self._send(404, {'error': 'Unknown job id'})
+            else:
+                self._send(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/jobs':
+                self._send(404, {'error': 'Not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                job = json.loads(self.rfile.read(length))
+            except ValueError as e:
+                self._send(400, {'error': f'Invalid JSON body: {e}'})
+                return
+
+            record = worker.submit(job)
+            # ?wait=1 holds the connection until the job has finished, or for WORKER_WAIT_TIMEOUT at most
+            if parse_qs(url.query).get('wait', ['0'])[0] in ('1', 'true') \
+                    and record['done'].wait(WORKER_WAIT_TIMEOUT):
+                self._send(200, public_record(record))
+            else:
+                self._send(202, public_record(record))
+
+        def _send(self, status: int, body: dict) -> None:
+            self._send_text(status, json.dumps(body), 'application/json')
+
+        def _send_text(self, status: int, body: str, content_type: str) -> None:
+            payload = body.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(f'{self.address_string()} {format % args}')
+
+    return WorkerRequestHandler
+
+
+def main(host: str = WORKER_HOST, port: int = WORKER_PORT, warm_pages: int = WARM_PAGES) -> None:
+    worker = BrowserWorker(warm_pages)
+    worker.start()
+    server = ThreadingHTTPServer((host, port), make_handler(worker))
+
+    def shutdown(signum, frame):
+        logger.info(f'Received signal {signum}, shutting down...')
+        # shutdown() blocks until serve_forever returns, so it can't run on this thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    logger.info(f'Worker listening on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        worker.stop()
+
+
+if __name__ == "__main__":
+    """_summary_ Run a resident worker that keeps a browser warm and sends messages for queued jobs.
+    Args:
+        host (str): Interface to listen on
+        port (int): Port to listen on
+        warm_pages (int): Number of bot-ready pages to keep prepared ahead of jobs
+
+    Endpoints:
+        POST /jobs[?wait=1]  job JSON as in send_batch.py, returns the job record (with its result when waiting)
+        GET /jobs/<id>       job record
+        GET /health          browser and worker thread status
+        GET /queue           queue depth, running job and completed count
+        GET /metrics         step and job timings in the Prometheus text format (/metrics.json for a summary)
+
+    Usage example: python worker.py --port 8765
+    """
+    init_sentry()
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Run a resident outreach browser worker.')
+    parser.add_argument('--host', default=WORKER_HOST,
+                        help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=WORKER_PORT,
+                        help='Port to listen on')
+    parser.add_argument('--warm_pages', type=int, default=WARM_PAGES,
+                        help='Number of pages to keep prepared ahead of jobs')
+    args = parser.parse_args()
+    main(args.host, args.port, args.warm_pages)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# The modules of src/ import each other by their bare names, like the scripts run from src/
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+# Learn timeouts in memory only, tests must not write the real timeouts file
+os.environ.setdefault('TIMEOUT_POLICY_FILE', '')
+
+
+@pytest.fixture(scope='session')
+def browser():
+    """Headless Chromium, the tests needing it are skipped where it is not installed"""
+    from playwright.sync_api import sync_playwright, Error
+    with sync_playwright() as p:
+        try:
+            browser = p.chromium.launch(headless=True)
+        except Error as e:
+            pytest.skip(f'Chromium is not available: {e}')
+        yield browser
+        browser.close()
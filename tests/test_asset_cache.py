@@ -0,0 +1,47 @@
+from asset_cache import AssetCache
+from mock_seller_center import MockSellerCenter, MockSettings, STATIC_STYLESHEET, creator_id_of
+
+FAST = dict(latency_ms=0, page_ms=0, search_ms=0, detail_ms=0, im_ms=0, modal_ms=0,
+            modal_rate=0, guide_rate=0, captcha_rate=0)
+
+
+def open_im(browser, cache: AssetCache, url: str) -> None:
+    """Load an IM page in a new context routed through the cache"""
+    context = browser.new_context()
+    cache.apply(context)
+    page = context.new_page()
+    page.goto(url)
+    page.wait_for_selector('.im-conversation-header:has-text("alice")')
+    assert page.evaluate("getComputedStyle(document.querySelector('.im-sidebar')).float") == 'right'
+    context.close()
+
+
+def test_recording_is_replayed_offline(browser, tmp_path):
+    mock = MockSellerCenter(MockSettings(**FAST), port=0).start()
+    mock.search('alice')
+    url = f'{mock.url}/seller/im?shop_id=1&creator_id={creator_id_of("alice")}'
+    recording = AssetCache(str(tmp_path), 0, 'record')
+    open_im(browser, recording, url)
+    recording.close()
+    # nothing listens on the mock's port anymore
+    mock.stop()
+    replay = AssetCache(str(tmp_path), 0, 'replay')
+    open_im(browser, replay, url)
+    assert replay.counts['replay_misses'] == 0
+    assert replay.counts['hits'] >= 2
+    replay.close()
+
+
+def test_cache_mode_only_routes_static_urls(browser, tmp_path):
+    mock = MockSellerCenter(MockSettings(**FAST), port=0).start()
+    mock.search('alice')
+    url = f'{mock.url}/seller/im?shop_id=1&creator_id={creator_id_of("alice")}'
+    cache = AssetCache(str(tmp_path), 1024 * 1024, 'cache', url_patterns=(f'{mock.url}/static/**',))
+    open_im(browser, cache, url)
+    open_im(browser, cache, url)
+    mock.stop()
+    # the IM page itself never went through the cache, the stylesheet was fetched once
+    assert cache.counts['misses'] == 1
+    assert cache.counts['hits'] == 1
+    assert cache.connection.execute('SELECT url FROM assets').fetchall() == [(mock.url + STATIC_STYLESHEET,)]
+    cache.close()
@@ -0,0 +1,28 @@
+from bot_context import isolate_evasion, setup_context, stealth_script
+
+
+def test_each_evasion_is_isolated():
+    script = stealth_script()
+    assert script.startswith('const opts = ')
+    # the helpers the evasions share stay at the top level
+    assert '\nconst utils = {}' in script
+    assert script.count('try { (function () {') >= 10
+
+
+def test_failing_evasion_does_not_stop_the_next(browser):
+    context = browser.new_context()
+    page = context.new_page()
+    page.add_init_script(';\n'.join([isolate_evasion('throw new Error("broken")'),
+                                     isolate_evasion("'use strict'; window.after = 1")]))
+    page.goto('data:text/html,<p>stealth</p>')
+    assert page.evaluate('window.after') == 1
+    context.close()
+
+
+def test_stealth_script_runs(browser):
+    context = setup_context(browser.new_context())
+    page = context.new_page()
+    page.goto('data:text/html,<p>stealth</p>')
+    assert page.evaluate('navigator.webdriver') in (None, False)
+    assert page.evaluate('typeof window.chrome') == 'object'
+    context.close()
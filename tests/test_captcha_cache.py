@@ -0,0 +1,90 @@
+import base64
+import os
+
+import pytest
+
+pytest.importorskip('PIL')
+models = pytest.importorskip('tiktok_captcha_solver.models')
+
+from captcha_cache import CaptchaCache, CachingClient, fingerprint_fixtures, image_hash, key_distance, solution_key
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'captcha')
+
+
+def fixture_b64(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return base64.b64encode(f.read()).decode()
+
+
+class FakeApiClient:
+    """Solver ApiClient counting its calls"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def puzzle(self, puzzle_b64: str, piece_b64: str):
+        self.calls += 1
+        return models.PuzzleCaptchaResponse(slide_x_proportion=0.59)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = CaptchaCache(str(tmp_path / 'captcha_cache.db'), max_size=10)
+    yield cache
+    cache.close()
+
+
+def puzzle_key(puzzle: str) -> str:
+    return solution_key('puzzle', (fixture_b64(puzzle), fixture_b64('piece.png')))
+
+
+def test_reencoded_image_is_within_the_tolerance():
+    assert image_hash(b'not an image').startswith('sha256:')
+    assert key_distance(puzzle_key('puzzle.png'), puzzle_key('puzzle-reencoded.jpg')) <= 2
+    assert key_distance(puzzle_key('puzzle.png'), puzzle_key('puzzle-other.png')) > 2
+    assert key_distance(puzzle_key('puzzle.png'), solution_key('rotate', (fixture_b64('puzzle.png'),))) is None
+
+
+def test_fixtures_are_grouped():
+    groups = fingerprint_fixtures(FIXTURES)
+    assert sorted(map(sorted, groups.values())) == [
+        ['piece.png'], ['puzzle-other.png'], ['puzzle-reencoded.jpg', 'puzzle.png']]
+
+
+def test_only_confirmed_solutions_are_served(cache):
+    key = puzzle_key('puzzle.png')
+    cache.put(key, 'puzzle', '{"slide_x_proportion": 0.59}')
+    assert cache.lookup(key) is None
+    cache.confirm(key)
+    assert cache.lookup(key) == (key, '{"slide_x_proportion": 0.59}')
+    assert cache.lookup(puzzle_key('puzzle-reencoded.jpg')) == (key, '{"slide_x_proportion": 0.59}')
+    assert cache.lookup(puzzle_key('puzzle-other.png')) is None
+    cache.reject(key)
+    assert cache.lookup(key) is None
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 3
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = CaptchaCache(str(tmp_path / 'captcha_cache.db'), max_size=2)
+    for index in range(3):
+        cache.put(f'puzzle||sha256:{index}', 'puzzle', '{}')
+    assert cache.stats()['stored'] == 2
+    assert cache.stats()['evicted'] == 1
+    cache.close()
+
+
+def test_repeated_captcha_skips_the_api(cache):
+    api = FakeApiClient()
+    client = CachingClient(api, cache, fixture_dir=None)
+    assert client.puzzle(fixture_b64('puzzle.png'), fixture_b64('piece.png')).slide_x_proportion == 0.59
+    client.finish(True)
+    # the same puzzle served again as a JPEG
+    assert client.puzzle(fixture_b64('puzzle-reencoded.jpg'), fixture_b64('piece.png')).slide_x_proportion == 0.59
+    assert api.calls == 1
+    client.finish(False)
+    # the failed cached solution is dropped
+    client.puzzle(fixture_b64('puzzle.png'), fixture_b64('piece.png'))
+    assert api.calls == 2
+    client.puzzle(fixture_b64('puzzle-other.png'), fixture_b64('piece.png'))
+    assert api.calls == 3
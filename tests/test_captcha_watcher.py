@@ -0,0 +1,48 @@
+from playwright.sync_api import Error
+
+from captcha_watcher import CaptchaWatcher
+
+
+class FakeCaptcha:
+    """Locator of the captcha containers, shown or never shown"""
+
+    def __init__(self, visible: bool):
+        self.visible = visible
+
+    @property
+    def first(self):
+        return self
+
+    def is_visible(self) -> bool:
+        return self.visible
+
+    def wait_for(self, state: str, timeout: float) -> None:
+        if not self.visible:
+            raise Error(f'Timeout {timeout}ms exceeded')
+
+
+class FakePage:
+    def __init__(self, visible: bool):
+        self.captcha = FakeCaptcha(visible)
+
+    def locator(self, selector: str) -> FakeCaptcha:
+        return self.captcha
+
+
+def test_announced_captcha_is_only_solved_once_visible():
+    solved = []
+    watcher = CaptchaWatcher(solve=solved.append)
+    watcher.pending = True
+    assert not watcher.solve_pending(FakePage(visible=False))
+    assert watcher.detected == 0 and not watcher.pending
+
+    watcher.pending = True
+    page = FakePage(visible=True)
+    assert watcher.solve_pending(page)
+    assert solved == [page] and watcher.detected == 1
+
+
+def test_nothing_announced_nor_visible():
+    watcher = CaptchaWatcher(solve=lambda page: None)
+    assert not watcher.solve_pending(FakePage(visible=False))
+    assert watcher.solve_pending(FakePage(visible=True))
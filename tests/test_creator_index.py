@@ -0,0 +1,52 @@
+import sqlite3
+import threading
+
+from creator_index import CreatorIndex
+
+
+def test_entries_are_scoped_by_account(tmp_path):
+    index = CreatorIndex(str(tmp_path / 'index.db'))
+    index.record('seller-a@example.com', '@Alice', '1', '10')
+    assert index.get('seller-a@example.com', 'alice') == ('1', '10')
+    # another account's shop must not open shop 1's conversation
+    assert index.get('seller-b@example.com', 'alice') is None
+    index.record('seller-b@example.com', 'alice', '2', '20')
+    index.invalidate('seller-a@example.com', 'ALICE')
+    assert index.get('seller-a@example.com', 'alice') is None
+    assert index.get('seller-b@example.com', 'alice') == ('2', '20')
+    index.close()
+
+
+def test_unscoped_entries_are_dropped(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'index.db')
+    connection.execute('CREATE TABLE creators (creator TEXT PRIMARY KEY, shop_id TEXT NOT NULL, '
+                       'creator_id TEXT NOT NULL, resolved_at REAL NOT NULL)')
+    connection.execute("INSERT INTO creators VALUES ('alice', '1', '10', 0)")
+    connection.commit()
+    connection.close()
+    index = CreatorIndex(str(tmp_path / 'index.db'))
+    assert index.get('seller-a@example.com', 'alice') is None
+    index.record('seller-a@example.com', 'alice', '1', '10')
+    assert index.get('seller-a@example.com', 'alice') == ('1', '10')
+    index.close()
+
+
+def test_shared_by_threads(tmp_path):
+    index = CreatorIndex(str(tmp_path / 'index.db'))
+    errors = []
+
+    def work(thread: int) -> None:
+        try:
+            for i in range(50):
+                index.record(f'account-{thread}', f'creator_{i}', str(thread), str(i))
+                assert index.get(f'account-{thread}', f'creator_{i}') == (str(thread), str(i))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    index.close()
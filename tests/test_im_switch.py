@@ -0,0 +1,51 @@
+import pytest
+
+from mock_seller_center import MockSellerCenter, MockSettings, creator_id_of
+from outreach_bot import OutreachMessageBot, IM_HEADER_SELECTOR
+from timeout_policy import TimeoutPolicy
+
+FAST = dict(latency_ms=0, page_ms=0, search_ms=0, detail_ms=0, im_ms=0, modal_ms=0,
+            modal_rate=0, guide_rate=0, captcha_rate=0)
+
+
+def im_url(mock: MockSellerCenter, handle: str) -> str:
+    return f'{mock.url}/seller/im?shop_id=1&creator_id={creator_id_of(handle)}'
+
+
+@pytest.fixture
+def im_bot(browser, request):
+    """A bot on alice's conversation of a mock IM page whose inbox list also shows bob"""
+    mock = MockSellerCenter(MockSettings(**FAST, im_switch=request.param), port=0).start()
+    mock.search('alice')
+    mock.search('bob')
+    context = browser.new_context()
+    page = context.new_page()
+    page.goto(im_url(mock, 'alice'))
+    page.wait_for_selector(IM_HEADER_SELECTOR + ':has-text("alice")')
+    bot = OutreachMessageBot(page, timeout_policy=TimeoutPolicy(file=None, enabled=False))
+    bot.im_page = page
+    yield mock, bot
+    context.close()
+    mock.stop()
+
+
+@pytest.mark.parametrize('im_bot', [True], indirect=True)
+def test_switches_inside_the_im_app(im_bot):
+    mock, bot = im_bot
+    assert bot.switch_conversation('bob', '1', im_url(mock, 'bob'))
+    assert bot.page.locator(IM_HEADER_SELECTOR).text_content() == 'bob'
+
+
+@pytest.mark.parametrize('im_bot', [False], indirect=True)
+def test_handle_in_the_inbox_list_is_not_a_switch(im_bot):
+    mock, bot = im_bot
+    # bob's handle is on the page, in the inbox list, while alice's conversation stays open
+    assert bot.page.get_by_text('bob', exact=True).count() == 1
+    assert not bot.switch_conversation('bob', '1', im_url(mock, 'bob'))
+    assert bot.page.locator(IM_HEADER_SELECTOR).text_content() == 'alice'
+
+
+@pytest.mark.parametrize('im_bot', [True], indirect=True)
+def test_other_shop_is_loaded(im_bot):
+    mock, bot = im_bot
+    assert not bot.switch_conversation('bob', '2', im_url(mock, 'bob').replace('shop_id=1', 'shop_id=2'))
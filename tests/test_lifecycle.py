@@ -0,0 +1,29 @@
+import lifecycle
+from lifecycle import ContextRecycler
+
+
+def test_recycles_on_growth_since_the_first_job(monkeypatch):
+    readings = iter([2000, 2100, 2600])
+    reads = []
+
+    def tree_rss_mb():
+        reads.append(1)
+        return next(readings)
+
+    monkeypatch.setattr(lifecycle, 'tree_rss_mb', tree_rss_mb)
+    recycler = ContextRecycler(max_jobs=0, max_rss_growth_mb=500, sample_jobs=5)
+    # a browser already past 500MB is not a reason to recycle, only its growth is
+    assert recycler.job_done() is None
+    assert [recycler.job_done() for _ in range(4)] == [None] * 4
+    assert len(reads) == 2
+    assert [recycler.job_done() for _ in range(4)] == [None] * 4
+    assert recycler.job_done() == '600MB more resident memory'
+    assert len(reads) == 3
+    recycler.reset()
+    assert recycler.baseline_mb is None
+
+
+def test_recycles_after_max_jobs():
+    recycler = ContextRecycler(max_jobs=2, max_rss_growth_mb=0)
+    assert recycler.job_done() is None
+    assert recycler.job_done() == '2 jobs'
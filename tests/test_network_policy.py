@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+from network_policy import NetworkPolicy
+
+
+def request(url: str, resource_type: str = 'xhr') -> SimpleNamespace:
+    return SimpleNamespace(url=url, resource_type=resource_type)
+
+
+def response(url: str, resource_type: str, length: int) -> SimpleNamespace:
+    return SimpleNamespace(request=request(url, resource_type), headers={'content-length': str(length)})
+
+
+def test_only_the_captcha_hosts_are_allowed():
+    policy = NetworkPolicy()
+    assert not policy.is_blocked(request('https://verification-va.tiktok.com/captcha/verify', 'image'))
+    assert not policy.is_blocked(request('https://p16-security-va.ibyteimg.com/security-captcha/1.png', 'image'))
+    # "verify" in an unrelated url no longer lets an image through
+    assert policy.is_blocked(request('https://p16-sign.tiktokcdn-us.com/avatar.jpeg?verify=1', 'image'))
+
+
+def test_measure_mode_counts_the_bytes_it_would_block():
+    policy = NetworkPolicy(measure=True)
+    policy._count_response(response('https://affiliate.tiktok.com/api/v1/find', 'xhr', 300))
+    policy._count_response(response('https://p16-sign.tiktokcdn-us.com/avatar.jpeg', 'image', 4000))
+    stats = policy.stats()
+    assert (stats['allowed_bytes'], stats['blocked_bytes']) == (300, 4000)
+    assert NetworkPolicy().stats()['blocked_bytes'] is None
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import pytest
+
+from creator_index import CreatorIndex
+from creator_search import CreatorNotFoundError, AMBIGUOUS, MAX_CONSECUTIVE_MISSES
+from outreach_bot_base import OutreachBotBase
+from overlays import OverlayGuard
+from phases import FIND_CREATOR, OPEN_CONVERSATION, PROCESS_MESSAGES
+from sent_ledger import SentLedger
+from timeout_policy import TimeoutPolicy
+
+IM_URL = 'https://affiliate.tiktok.com/seller/im?shop_id=1&creator_id=42'
+
+
+def make_bot(tmp_path, **kwargs) -> OutreachBotBase:
+    # nothing here touches the page but its url
+    page = SimpleNamespace(url='about:blank')
+    return OutreachBotBase(page, CreatorIndex(str(tmp_path / 'index.db')), OverlayGuard(overlays=[]),
+                           timeout_policy=TimeoutPolicy(file=None, enabled=False), **kwargs)
+
+
+def test_retry_keeps_the_checkpoint_of_the_same_creator(tmp_path):
+    bot = make_bot(tmp_path)
+    assert bot.start_attempt({'creator': 'alice'}) == (None, FIND_CREATOR)
+    bot.page.url = 'https://affiliate.tiktok.com/connection/creator/detail?cid=42'
+    bot.details_opened()
+    bot.phase = OPEN_CONVERSATION
+    assert bot.start_attempt({'creator': 'alice'}) == (OPEN_CONVERSATION, OPEN_CONVERSATION)
+    assert bot.start_attempt({'creator': 'bob'}) == (None, FIND_CREATOR)
+
+
+def test_opened_conversation_is_indexed_and_found_again(tmp_path):
+    bot = make_bot(tmp_path)
+    bot.start_attempt({'creator': 'alice', 'account': 'seller@example.com'})
+    bot.page.url = IM_URL
+    bot.conversation_opened('alice')
+    assert bot.shop_id == '1'
+    assert bot.phase_after_search() == PROCESS_MESSAGES
+
+    bot.new_job()
+    bot.start_attempt({'creator': 'alice', 'account': 'seller@example.com'})
+    assert bot.indexed_ids('@Alice') == ('1', '42')
+    # the IM page loaded but not the conversation, the entry is stale
+    bot.indexed_conversation_failed('alice', Exception('no textarea'))
+    assert bot.indexed_ids('alice') is None
+
+
+def test_send_is_claimed_once(tmp_path, monkeypatch):
+    monkeypatch.setenv('ENVIRONMENT', 'production')
+    ledger = SentLedger(str(tmp_path / 'sent.db'))
+    first, second = make_bot(tmp_path, ledger=ledger), make_bot(tmp_path, ledger=ledger)
+    assert first.claim_send('campaign', 'alice', 'seller@example.com')
+    assert not second.claim_send('campaign', 'alice', 'seller@example.com')
+    assert second.already_sent
+    first.send_failed('campaign', 'alice')
+    assert second.claim_send('campaign', 'alice', 'seller@example.com')
+
+
+def test_ambiguous_search_fails_instead_of_picking_a_row(tmp_path):
+    bot = make_bot(tmp_path)
+    payload = {'creators': [{'handle': 'alice', 'creator_id': '1'}, {'handle': '@Alice', 'creator_id': '2'}]}
+    with pytest.raises(CreatorNotFoundError) as raised:
+        bot.match_search(payload, 'alice')
+    assert raised.value.resolution.status == AMBIGUOUS
+    assert bot.match_search(payload['creators'][:1], 'alice').creator_id == '1'
+
+
+def test_each_bot_counts_its_own_missed_searches(tmp_path):
+    first, second = make_bot(tmp_path), make_bot(tmp_path)
+    for _ in range(MAX_CONSECUTIVE_MISSES):
+        first.interception.record(False)
+    assert not first.interception.enabled()
+    assert second.interception.enabled()
@@ -0,0 +1,18 @@
+from creator_search import Resolution, RESOLVED, AMBIGUOUS, NOT_FOUND
+from resolution_store import ResolutionStore, skipped_result
+
+
+def test_ambiguous_creator_is_skipped_until_assigned(tmp_path):
+    store = ResolutionStore(str(tmp_path / 'resolutions.db'))
+    store.record('campaign', Resolution('Alice', AMBIGUOUS, candidates=2))
+    store.record('campaign', Resolution('bob', NOT_FOUND, candidates=5))
+    # jobs name creators with or without the @
+    assert store.get('campaign', '@alice ')['status'] == AMBIGUOUS
+    assert store.skipped('campaign') == {'alice': AMBIGUOUS, 'bob': NOT_FOUND}
+    job = {'creator': '@Alice', 'agency_campaign_id': 'campaign'}
+    assert skipped_result(job, store.get('campaign', job['creator']))[AMBIGUOUS]
+
+    store.assign('campaign', '@Alice', '42')
+    assert store.get('campaign', 'alice') == {'status': RESOLVED, 'creator_id': '42', 'candidates': 0, 'error': None}
+    assert store.skipped('campaign') == {'bob': NOT_FOUND}
+    assert store.unresolved('campaign', ['@ALICE', 'carol']) == ['carol']
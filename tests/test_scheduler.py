@@ -0,0 +1,20 @@
+from scheduler import Account, Scheduler
+
+
+def test_skipped_job_gives_its_token_back():
+    account = Account('seller', {}, messages_per_hour=1, burst=1, concurrency=2, now=0)
+    scheduler = Scheduler([account])
+    for creator in ('alice', 'bob', 'carol'):
+        scheduler.add({'creator': creator, 'agency_campaign_id': 'campaign'})
+
+    _, job, _ = scheduler.next_job(now=0)
+    assert job['creator'] == 'alice'
+    # one token an hour, the next job waits for it
+    assert scheduler.next_job(now=0)[1] is None
+    account.record({'success': False, 'attempts': 0, 'phase': 'resolve'}, now=0)
+    assert scheduler.next_job(now=0)[1]['creator'] == 'bob'
+
+    account.record({'success': True, 'attempts': 1}, now=0)
+    assert scheduler.next_job(now=0)[1] is None
+    assert account.stats()['sent'] == 1
+    assert account.stats()['skipped'] == 1
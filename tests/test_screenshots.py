@@ -0,0 +1,65 @@
+import io
+import os
+
+import pytest
+
+moto = pytest.importorskip('moto')
+Image = pytest.importorskip('PIL.Image')
+
+import aws
+from aws import ScreenshotStorage
+from screenshots import ScreenshotService
+
+BUCKET = 'screenshots'
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """In-memory S3 stand-in, with a fresh client for the storage"""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setattr(aws, '_s3_clients', {})
+    with moto.mock_aws():
+        yield aws.get_s3_client('us-east-1', None)
+
+
+def png(width: int = 400, height: int = 200) -> bytes:
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(output, format='PNG')
+    return output.getvalue()
+
+
+def service(tmp_path, **kwargs) -> ScreenshotService:
+    storage = ScreenshotStorage(BUCKET, 'us-east-1', None)
+    return ScreenshotService(storage, spool_dir=str(tmp_path / 'spool'), workers=1, **kwargs)
+
+
+def test_upload_is_encoded_and_downscaled(s3, tmp_path):
+    s3.create_bucket(Bucket=BUCKET)
+    screenshots = service(tmp_path, image_format='webp', max_width=100)
+    url = screenshots.submit(png(), 'failure')
+    screenshots.shutdown()
+    key = url.split('.amazonaws.com/', 1)[1]
+    assert key.endswith('/failure.webp')
+    uploaded = s3.get_object(Bucket=BUCKET, Key=key)
+    assert uploaded['ContentType'] == 'image/webp'
+    assert Image.open(io.BytesIO(uploaded['Body'].read())).size == (100, 50)
+    assert screenshots.uploaded == 1
+
+
+def test_failed_upload_is_spooled_then_flushed(s3, tmp_path):
+    screenshots = service(tmp_path, image_format='png')
+    # no bucket yet, the upload fails
+    url = screenshots.submit(png(), 'failure')
+    screenshots.shutdown()
+    assert screenshots.spooled == 1
+    assert len(os.listdir(tmp_path / 'spool')) == 1
+
+    s3.create_bucket(Bucket=BUCKET)
+    screenshots = service(tmp_path, image_format='png')
+    assert screenshots.flush_spool() == 1
+    screenshots.shutdown()
+    assert screenshots.uploaded == 1
+    assert os.listdir(tmp_path / 'spool') == []
+    key = url.split('.amazonaws.com/', 1)[1]
+    assert s3.get_object(Bucket=BUCKET, Key=key)['ContentType'] == 'image/png'
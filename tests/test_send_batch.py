@@ -0,0 +1,32 @@
+from creator_search import Resolution, RESOLVED, AMBIGUOUS
+from resolution_store import ResolutionStore
+from send_batch import job_resolution, job_skip_result, resolved_creator_id
+from sent_ledger import SentLedger
+
+JOB = {'creator': 'alice', 'message': 'hi', 'agency_campaign_id': 'campaign'}
+
+
+def test_job_needs_cookies_without_a_cached_session():
+    skip = job_skip_result(JOB, None, None, None)
+    assert skip['phase'] == 'read_job'
+    assert 'sessionid_cookie' in skip['error']
+    assert job_skip_result(JOB, 'state.json', None, None) is None
+
+
+def test_sent_and_unresolved_jobs_are_skipped(tmp_path):
+    resolutions = ResolutionStore(str(tmp_path / 'resolutions.db'))
+    resolutions.record('campaign', Resolution('alice', AMBIGUOUS, candidates=2))
+    resolution = job_resolution(JOB, resolutions)
+    assert job_skip_result(JOB, 'state.json', resolution, None)[AMBIGUOUS]
+
+    ledger = SentLedger(str(tmp_path / 'sent.db'))
+    ledger.reserve('campaign', 'alice')
+    ledger.confirm('campaign', 'alice')
+    assert job_skip_result(JOB, 'state.json', resolution, ledger)['already_sent']
+
+    resolutions.assign('campaign', 'alice', '42')
+    resolution = job_resolution(JOB, resolutions)
+    assert resolution['status'] == RESOLVED
+    assert job_skip_result(JOB, 'state.json', resolution, None) is None
+    assert resolved_creator_id(resolution) == '42'
+    assert job_resolution({'creator': 'alice'}, resolutions) is None
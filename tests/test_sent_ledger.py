@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sent_ledger import SentLedger
+
+
+def test_one_of_several_runs_gets_the_send(tmp_path):
+    db_file = str(tmp_path / 'sent.db')
+    runs = [SentLedger(db_file) for _ in range(8)]
+    with ThreadPoolExecutor(len(runs)) as pool:
+        reserved = list(pool.map(lambda ledger: ledger.reserve('campaign', '@Alice'), runs))
+    assert reserved.count(True) == 1
+
+
+def test_released_send_can_be_retried(tmp_path):
+    ledger = SentLedger(str(tmp_path / 'sent.db'))
+    assert ledger.reserve('campaign', 'alice')
+    ledger.release('campaign', 'alice')
+    assert not ledger.is_sent('campaign', 'alice')
+    assert ledger.reserve('campaign', 'alice')
+    ledger.confirm('campaign', 'alice')
+    # a confirmed send is never released
+    ledger.release('campaign', 'alice')
+    assert ledger.is_sent('campaign', '@ALICE ')
+    assert ledger.sending() == []
+
+
+def test_handles_are_normalized(tmp_path):
+    ledger = SentLedger(str(tmp_path / 'sent.db'))
+    ledger.reserve('campaign', '@Alice')
+    assert ledger.unsent('campaign', ['alice', '@bob']) == ['@bob']
+    skipped = []
+    jobs = [{'agency_campaign_id': 'campaign', 'creator': 'ALICE'}, {'agency_campaign_id': 'campaign', 'creator': 'bob'}]
+    assert [job['creator'] for job in ledger.filter_jobs(jobs, skipped)] == ['bob']
+    assert len(skipped) == 1
@@ -0,0 +1,55 @@
+import json
+import time
+
+import supervisor
+from supervisor import Supervisor
+
+
+def fake_worker(worker_id: int, inbox, events) -> None:
+    """Worker without a browser: hangs on the jobs of creator 'hang', finishes the others"""
+    events.send(('ready', worker_id))
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        index, job = item
+        if job['creator'] == 'hang':
+            time.sleep(3600)
+        events.send(('done', worker_id, index, {'creator': job['creator'], 'success': True}))
+    events.send(('exit', worker_id, 'stopped'))
+
+
+def slow_launch_worker(worker_id: int, inbox, events) -> None:
+    """Worker whose first instance hangs before it is ready, like a stuck browser launch"""
+    if worker_id == 0:
+        time.sleep(3600)
+    fake_worker(worker_id, inbox, events)
+
+
+def test_hung_worker_is_reaped_and_replaced(tmp_path, monkeypatch):
+    monkeypatch.setattr(supervisor, 'JOB_TIMEOUT', 2)
+    monkeypatch.setattr(supervisor, 'POLL_INTERVAL', 0.1)
+    # run() installs its drain handlers, keep pytest's
+    monkeypatch.setattr(supervisor.signal, 'signal', lambda signum, handler: None)
+    jobs = [{'creator': name} for name in ('alice', 'hang', 'bob', 'carol')]
+    output = tmp_path / 'results.jsonl'
+    counts = Supervisor(1, target=fake_worker).run(iter(jobs), str(output))
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert counts['sent'] == 3
+    assert counts['failed'] == 1
+    assert counts['restarts'] == 1
+    assert [result['creator'] for result in results] == ['alice', 'hang', 'bob', 'carol']
+    assert 'timed out' in results[1]['error']
+
+
+def test_worker_hung_in_launch_is_reaped_and_replaced(tmp_path, monkeypatch):
+    monkeypatch.setattr(supervisor, 'WORKER_LAUNCH_TIMEOUT', 2)
+    monkeypatch.setattr(supervisor, 'POLL_INTERVAL', 0.1)
+    monkeypatch.setattr(supervisor.signal, 'signal', lambda signum, handler: None)
+    jobs = [{'creator': name} for name in ('alice', 'bob')]
+    output = tmp_path / 'results.jsonl'
+    counts = Supervisor(1, target=slow_launch_worker).run(iter(jobs), str(output))
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert counts['sent'] == 2
+    assert counts['restarts'] == 1
+    assert [result['creator'] for result in results] == ['alice', 'bob']
@@ -0,0 +1,22 @@
+from worker import BrowserWorker
+
+
+def test_jobs_fail_when_the_browser_cannot_launch(tmp_path, monkeypatch):
+    # an empty browsers directory: Chromium can't be found, as on a broken install
+    monkeypatch.setenv('PLAYWRIGHT_BROWSERS_PATH', str(tmp_path / 'browsers'))
+    monkeypatch.chdir(tmp_path)
+    worker = BrowserWorker(warm_pages=0)
+    worker.start()
+    record = worker.submit({'creator': 'alice', 'message': 'Hi'})
+    assert record['done'].wait(60)
+    assert record['result']['success'] is False
+    assert 'Could not launch the browser' in record['result']['error']
+    # the worker thread is still up, and tries the launch again for the next job
+    assert worker.health()['status'] == 'unavailable'
+    record = worker.submit({'creator': 'bob', 'message': 'Hi'})
+    assert record['done'].wait(60)
+    assert 'Could not launch the browser' in record['result']['error']
+    worker.stop(timeout=60)
+    record = worker.submit({'creator': 'carol', 'message': 'Hi'})
+    assert record['done'].is_set()
+    assert record['result']['error'] == 'The worker is not running'